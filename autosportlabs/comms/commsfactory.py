@@ -42,14 +42,25 @@ def comms_factory(device, conn_type):
             return serial_comm(device)
 
 
+def is_ioloop_supported():
+    # serial ports can't be waited on with select on Windows
+    return platform != 'win'
+
+
 def socket_comm(device):
     from autosportlabs.comms.socket.socketconnection import SocketConnection
+    if is_ioloop_supported():
+        from autosportlabs.comms.loopcomms import LoopComms
+        return LoopComms(device, SocketConnection(), wireless=True)
     from autosportlabs.comms.socket.socketcomm import SocketComm
     return SocketComm(SocketConnection(), device)
 
 
 def serial_comm(device):
     from autosportlabs.comms.serial.serialconnection import SerialConnection
+    if is_ioloop_supported():
+        from autosportlabs.comms.loopcomms import LoopComms
+        return LoopComms(device, SerialConnection())
     from autosportlabs.comms.comms import Comms
     return Comms(device, SerialConnection())
 
@@ -0,0 +1,152 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ('IOLoop',)
+import errno
+import fcntl
+import os
+import select
+import traceback
+from collections import deque
+from threading import Thread, Lock, current_thread
+from kivy.logger import Logger
+
+
+class IOLoop(object):
+    """
+    A single thread that waits on every open connection with select, and runs
+    the reader of a connection as soon as data arrives. Other threads hand work
+    to the loop with call_soon, which wakes it through a pipe; while nothing
+    arrives the thread sleeps without any periodic wakeups.
+    """
+    instance = None
+
+    def __init__(self):
+        self._readers = {}
+        self._callbacks = deque()
+        self._lock = Lock()
+        self._wake_read, self._wake_write = os.pipe()
+        fcntl.fcntl(self._wake_write, fcntl.F_SETFL, fcntl.fcntl(self._wake_write, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self._thread = None
+
+    @staticmethod
+    def get_instance():
+        if IOLoop.instance is None:
+            IOLoop.instance = IOLoop()
+        return IOLoop.instance
+
+    def in_loop(self):
+        """
+        :return True if called on the loop's thread
+        """
+        return current_thread() is self._thread
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                t = Thread(target=self._run, name='IOLoop')
+                t.daemon = True
+                self._thread = t
+                t.start()
+
+    def call_soon(self, callback, *args):
+        """
+        Runs a callback on the loop's thread; may be called from any thread
+        :param callback the function to call
+        :type callback function
+        """
+        self._callbacks.append((callback, args))
+        self._start()
+        try:
+            os.write(self._wake_write, 'x')
+        except OSError as e:
+            # the pipe is full of wakeups the loop has yet to read; it will run the callback anyway
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def add_reader(self, fd, callback):
+        """
+        Calls callback on the loop's thread whenever fd is readable
+        :param fd the file descriptor
+        :type fd int
+        :param callback the function to call, without arguments
+        :type callback function
+        """
+        self.call_soon(self._readers.__setitem__, fd, callback)
+
+    def remove_reader(self, fd):
+        """
+        Stops waiting on fd. A file descriptor must be removed before it is closed,
+        which is safest done on the loop's thread.
+        :param fd the file descriptor
+        :type fd int
+        """
+        if self.in_loop():
+            self._readers.pop(fd, None)
+        else:
+            self.call_soon(self._readers.pop, fd, None)
+
+    def _run_callbacks(self):
+        os.read(self._wake_read, 4096)
+        callbacks = self._callbacks
+        # callbacks added while these run have written their own wakeup
+        while callbacks:
+            callback, args = callbacks.popleft()
+            try:
+                callback(*args)
+            except Exception as e:
+                Logger.error('IOLoop: Exception in callback: {}'.format(e))
+                Logger.debug(traceback.format_exc())
+
+    def _run(self):
+        Logger.info('IOLoop: starting')
+        wake_read = self._wake_read
+        readers = self._readers
+        while True:
+            try:
+                readable = select.select([wake_read] + readers.keys(), [], [])[0]
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                # a reader's file descriptor was closed without removing it first
+                Logger.error('IOLoop: select failed, dropping closed connections: {}'.format(e))
+                self._drop_closed_readers()
+                continue
+
+            for fd in readable:
+                if fd == wake_read:
+                    self._run_callbacks()
+                    continue
+                callback = readers.get(fd)
+                if callback is None:
+                    continue
+                try:
+                    callback()
+                except Exception as e:
+                    Logger.error('IOLoop: Exception reading {}: {}'.format(fd, e))
+                    Logger.debug(traceback.format_exc())
+
+    def _drop_closed_readers(self):
+        for fd in self._readers.keys():
+            try:
+                os.fstat(fd)
+            except OSError:
+                Logger.warn('IOLoop: removing closed file descriptor {}'.format(fd))
+                del self._readers[fd]
@@ -0,0 +1,75 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ('LineBuffer',)
+from collections import deque
+
+LINE_DELIMITER = '\r\n'
+
+
+class LineBuffer(object):
+    """
+    Frames the lines a connection receives. Blocks of bytes are added as they are
+    read, and the complete lines in them are split out in a single scan; an
+    incomplete line is kept until the rest of it arrives.
+    """
+
+    def __init__(self, delimiter=LINE_DELIMITER):
+        """
+        :param delimiter the end of a line
+        :type delimiter str
+        """
+        self._delimiter = delimiter
+        self._buffer = bytearray()
+        self._lines = deque()
+
+    def __len__(self):
+        """
+        :return the number of complete lines
+        """
+        return len(self._lines)
+
+    def add(self, data):
+        """
+        Adds bytes read from the connection
+        :param data the bytes read
+        :type data str
+        """
+        buf = self._buffer
+        # only the new data, and a delimiter split across the previous block, need to be scanned
+        start = max(0, len(buf) - len(self._delimiter) + 1)
+        buf.extend(data)
+        end = buf.rfind(self._delimiter, start)
+        if end < 0:
+            return
+        lines = str(buf[:end]).split(self._delimiter)
+        del buf[:end + len(self._delimiter)]
+        self._lines.extend(lines)
+
+    def next_line(self):
+        """
+        :return the next complete line, without its delimiter, or None if there isn't one
+        """
+        lines = self._lines
+        return lines.popleft() if lines else None
+
+    def clear(self):
+        del self._buffer[:]
+        self._lines.clear()
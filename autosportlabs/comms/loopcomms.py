@@ -0,0 +1,219 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ('LoopComms',)
+import Queue
+import traceback
+from threading import Event, Lock
+from kivy.logger import Logger
+from autosportlabs.comms.commscommon import PortNotOpenException, CommsErrorException
+from autosportlabs.comms.ioloop import IOLoop
+from autosportlabs.comms.linebuffer import LineBuffer
+
+CLOSE_TIMEOUT = 2.0
+SCAN_TIMEOUT = 3.0
+
+
+class LoopComms(object):
+    """
+    Communicates with a RC device over a serial or socket connection, read by the shared IOLoop.
+    Lines are framed as soon as they arrive, and passed straight to the message handler on
+    the loop's thread; messages are written directly by the thread sending them.
+    """
+    CONNECT_TIMEOUT = 1.0
+    DEFAULT_TIMEOUT = 1.0
+
+    def __init__(self, device, connection, wireless=False, io_loop=None):
+        """
+        :param device the port or IP address of the device
+        :type device string
+        :param connection the connection to the device
+        :type connection SerialConnection or SocketConnection
+        :param wireless True if the connection is wireless
+        :type wireless bool
+        :param io_loop the loop to read on; defaults to the shared loop
+        :type io_loop IOLoop
+        """
+        self.device = device
+        self._connection = connection
+        self._wireless = wireless
+        self._io_loop = io_loop or IOLoop.get_instance()
+        self.supports_streaming = False
+        self._lines = LineBuffer()
+        self._fd = None
+        self._write_lock = Lock()
+        self._message_handler = None
+        # messages waiting for read_message, when no handler is set
+        self._rx_queue = Queue.Queue()
+
+    def set_message_handler(self, handler):
+        """
+        Passes received messages to a handler rather than queueing them for read_message
+        :param handler called with each message on the loop's thread
+        :type handler function
+        """
+        self._message_handler = handler
+
+    def get_available_devices(self):
+        connection = self._connection
+        if not hasattr(connection, 'open_beacon_socket'):
+            return connection.get_available_devices()
+
+        # listen for RC wifi's UDP beacon on the loop, rather than blocking on it
+        Logger.info('LoopComms: listening for RC wifi...')
+        sock = connection.open_beacon_socket()
+        found = Event()
+        addresses = []
+
+        def read_beacon():
+            result = connection.read_beacon(sock)
+            if result:
+                addresses.extend(result)
+                found.set()
+
+        io_loop = self._io_loop
+        fd = sock.fileno()
+        io_loop.add_reader(fd, read_beacon)
+        found.wait(SCAN_TIMEOUT)
+        closed = Event()
+
+        def close_beacon_socket():
+            io_loop.remove_reader(fd)
+            sock.close()
+            closed.set()
+
+        io_loop.call_soon(close_beacon_socket)
+        closed.wait(CLOSE_TIMEOUT)
+        if not addresses:
+            Logger.info('LoopComms: found no RC wifi (timeout listening for UDP beacon)')
+        return addresses
+
+    def isOpen(self):
+        return self._fd is not None
+
+    def open(self):
+        Logger.debug('LoopComms: Opening connection {}'.format(self.device))
+        if self.isOpen():
+            return
+        connection = self._connection
+        try:
+            connection.open(self.device)
+            connection.flushInput()
+            connection.flushOutput()
+        except Exception as e:
+            Logger.error('LoopComms: Exception opening connection {}: {}'.format(self.device, e))
+            Logger.debug(traceback.format_exc())
+            try:
+                connection.close()
+            except Exception:
+                pass
+            return
+        self._lines.clear()
+        self._fd = fd = connection.fileno()
+        self._io_loop.add_reader(fd, self._on_readable)
+
+    def keep_alive(self):
+        # the connection is read in this process, so there is no connection process to keep alive
+        pass
+
+    def close(self):
+        Logger.debug('LoopComms: close()')
+        if not self.isOpen():
+            return
+        io_loop = self._io_loop
+        if io_loop.in_loop():
+            self._close_connection()
+            return
+
+        closed = Event()
+
+        def close_connection():
+            self._close_connection()
+            closed.set()
+
+        io_loop.call_soon(close_connection)
+        if not closed.wait(CLOSE_TIMEOUT):
+            Logger.error('LoopComms: Timeout closing connection')
+
+    def _close_connection(self):
+        """
+        Stops reading the connection and closes it; called on the loop's thread
+        """
+        fd = self._fd
+        if fd is None:
+            return
+        self._io_loop.remove_reader(fd)
+        self._fd = None
+        try:
+            self._connection.close()
+        except Exception:
+            Logger.debug('LoopComms: Exception closing connection')
+            Logger.debug(traceback.format_exc())
+
+    def _on_readable(self):
+        try:
+            data = self._connection.read_available()
+        except Exception as e:
+            Logger.error('LoopComms: Exception reading connection: {}'.format(e))
+            Logger.debug(traceback.format_exc())
+            self._close_connection()
+            return
+
+        if not data:
+            # readable without any data: the device has gone
+            Logger.info('LoopComms: connection closed by device')
+            self._close_connection()
+            return
+
+        lines = self._lines
+        lines.add(data)
+        handler = self._message_handler
+        msg = lines.next_line()
+        while msg is not None:
+            if msg:
+                if handler is not None:
+                    handler(msg)
+                else:
+                    self._rx_queue.put(msg)
+            msg = lines.next_line()
+
+    def read_message(self):
+        if not self.isOpen():
+            raise PortNotOpenException('Port Closed')
+        try:
+            return self._rx_queue.get(True, self.DEFAULT_TIMEOUT)
+        except Queue.Empty:
+            return None
+
+    def write_message(self, message):
+        if not self.isOpen(): raise PortNotOpenException('Port Closed')
+        with self._write_lock:
+            try:
+                self._connection.write(message)
+            except CommsErrorException:
+                raise
+            except Exception as e:
+                raise CommsErrorException(cause=e)
+
+    def is_wireless(self):
+        """Returns if this comms object uses wireless communications or not.
+        :return: True for socket connections
+        """
+        return self._wireless
@@ -22,6 +22,7 @@ import serial
 from serial import SerialException
 from serial.tools import list_ports
 from autosportlabs.comms.commscommon import PortNotOpenException, CommsErrorException
+from autosportlabs.comms.linebuffer import LineBuffer
 from kivy.logger import Logger
 
 
@@ -34,7 +35,7 @@ class SerialConnection():
     ser = None
 
     def __init__(self, **kwargs):
-        pass
+        self._lines = LineBuffer()
 
     def get_available_devices(self):
         Logger.debug("SerialConnection: getting available devices")
@@ -50,12 +51,14 @@ class SerialConnection():
         return self.ser != None
 
     def open(self, device):
+        self._lines.clear()
         self.ser = serial.Serial(device, timeout=self.timeout, write_timeout=self.writeTimeout)
 
     def close(self):
         if self.ser != None:
             self.ser.close()
         self.ser = None
+        self._lines.clear()
 
     def read(self, count):
         ser = self.ser
@@ -68,16 +71,43 @@ class SerialConnection():
             else:
                 raise
 
+    def fileno(self):
+        """
+        :return the file descriptor of the open port, for waiting on with select
+        """
+        ser = self.ser
+        if ser == None: raise PortNotOpenException()
+        return ser.fileno()
+
+    def read_available(self):
+        """
+        Reads the bytes waiting to be read, waiting up to the read timeout for at least one
+        :return the bytes read, or '' if none arrived
+        """
+        ser = self.ser
+        if ser == None: raise PortNotOpenException()
+        try:
+            return ser.read(ser.in_waiting or 1)
+        except SerialException as e:
+            if str(e).startswith('device reports readiness'):
+                return ''
+            else:
+                raise
+
     def read_line(self):
-        msg = ''
-        while True:
-            c = self.read(1)
-            if c == '':
+        """
+        :return the next line received, without its delimiter, or None if no complete line arrived
+        before the read timeout
+        """
+        lines = self._lines
+        msg = lines.next_line()
+        while msg is None:
+            data = self.read_available()
+            if data == '':
                 return None
-            msg += c
-            if msg[-2:] == '\r\n':
-                msg = msg[:-2]
-                return msg
+            lines.add(data)
+            msg = lines.next_line()
+        return msg
 
     def write(self, data):
         try:
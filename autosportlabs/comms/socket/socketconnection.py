@@ -22,6 +22,7 @@ from kivy.logger import Logger
 import socket
 import json
 import errno
+from autosportlabs.comms.linebuffer import LineBuffer
 
 READ_TIMEOUT = 2
 SCAN_TIMEOUT = 3
@@ -33,12 +34,12 @@ class InvalidAddressException(Exception):
 
 
 class SocketConnection(object):
-    MSG_RECEIVE_BUFFER_SIZE = 32
+    MSG_RECEIVE_BUFFER_SIZE = 4096
     BEACON_RECEIVE_BUFFER_SIZE = 4096
     PORT = 7223
     def __init__(self):
         self.socket = None
-        self._data = ''
+        self._lines = LineBuffer()
 
     def get_available_devices(self):
         """
@@ -46,27 +47,49 @@ class SocketConnection(object):
         :return: List of ip addresses
         """
         Logger.info("SocketConnection: listening for RC wifi...")
-        # Listen for UDP beacon from RC wifi
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock = self.open_beacon_socket()
         sock.settimeout(SCAN_TIMEOUT)
 
+        try:
+            while True:
+                addresses = self.read_beacon(sock)
+                if addresses:
+                    return addresses
+        except socket.timeout:
+            Logger.info("SocketConnection: found no RC wifi (timeout listening for UDP beacon)")
+            return []
+        finally:
+            sock.close()
+
+    def open_beacon_socket(self):
+        """
+        Opens the UDP socket RC wifi's beacon is received on
+        :return: socket
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         # Bind the socket to the port
         server_address = ('', SocketConnection.PORT)
         sock.bind(server_address)
+        return sock
 
-        try:
-            data, address = sock.recvfrom(SocketConnection.BEACON_RECEIVE_BUFFER_SIZE)
-
-            if data:
-                Logger.info("SocketConnection: got UDP data {}".format(data))
+    def read_beacon(self, sock):
+        """
+        Reads a datagram from the beacon socket
+        :param sock: the socket opened by open_beacon_socket
+        :type sock: socket
+        :return: List of ip addresses the beacon says RC wifi is available on, or None if the datagram wasn't a beacon
+        """
+        data, address = sock.recvfrom(SocketConnection.BEACON_RECEIVE_BUFFER_SIZE)
+        if data:
+            Logger.info("SocketConnection: got UDP data {}".format(data))
+            try:
                 message = json.loads(data)
-                if message['beacon'] and message['beacon']['ip']:
-                    sock.close()
-                    return message['beacon']['ip']
-        except socket.timeout:
-            sock.close()
-            Logger.info("SocketConnection: found no RC wifi (timeout listening for UDP beacon)")
-            return []
+                beacon = message.get('beacon')
+                if beacon and beacon.get('ip'):
+                    return beacon['ip']
+            except (ValueError, AttributeError):
+                Logger.warn("SocketConnection: ignoring UDP data that isn't a beacon")
+        return None
 
     def isOpen(self):
         """
@@ -89,6 +112,7 @@ class SocketConnection(object):
             raise InvalidAddressException("{} is not a valid IP address".format(address))
 
         # Connect to ip address here
+        self._lines.clear()
         rc_address = (address, SocketConnection.PORT)
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.settimeout(READ_TIMEOUT)
@@ -102,7 +126,20 @@ class SocketConnection(object):
         if self.socket is not None:
             self.socket.close()
         self.socket = None
-        self._data = ''
+        self._lines.clear()
+
+    def fileno(self):
+        """
+        :return: the file descriptor of the open socket, for waiting on with select
+        """
+        return self.socket.fileno()
+
+    def read_available(self):
+        """
+        Reads the data waiting on the socket
+        :return: String, or '' if the socket was closed by the device
+        """
+        return self.socket.recv(SocketConnection.MSG_RECEIVE_BUFFER_SIZE)
 
     def read_line(self, keep_reading):
         """
@@ -115,6 +152,12 @@ class SocketConnection(object):
 
         timeout_count = 0
         max_timeouts = 3
+        lines = self._lines
+
+        # lines received with an earlier block are returned before reading more
+        msg = lines.next_line()
+        if msg is not None:
+            return msg
 
         while keep_reading.is_set():
             try:
@@ -123,14 +166,9 @@ class SocketConnection(object):
                 if data == '':
                     return None
 
-                self._data += data
-
-                if '\r\n' in self._data:
-                    lines = self._data.split('\r\n', 1)
-                    msg = lines[0]
-                    self._data = lines[1]
-
-                    Logger.debug("SocketConnection: returning data {}".format(msg))
+                lines.add(data)
+                msg = lines.next_line()
+                if msg is not None:
                     return msg
 
             except socket.timeout:
@@ -1,4 +1,4 @@
-from kivy.logger import Logger
+from kivy.logger import Logger, LOG_LEVELS
 import traceback
 
 class ApiDispatcher(object):
@@ -29,7 +29,8 @@ class ApiDispatcher(object):
 
     def dispatch_msg(self, msg_json, source):
         for msg_name in msg_json.keys():
-            Logger.trace('ApiDispatcher: processing message: {}'.format(msg_name))
+            if Logger.isEnabledFor(LOG_LEVELS['trace']):
+                Logger.trace('ApiDispatcher: processing message: {}'.format(msg_name))
             listeners = self.msg_listeners.get(msg_name, None)
             if listeners:
                 for listener in listeners:
@@ -20,8 +20,10 @@
 
 import io
 import json
+import re
 import traceback
 import Queue
+from collections import OrderedDict
 from time import sleep
 from threading import Thread, RLock, Event
 from autosportlabs.racecapture.config.rcpconfig import *
@@ -31,7 +33,7 @@ from autosportlabs.racecapture.config.rcpconfig import Capabilities
 from autosportlabs.racecapture.api.apicontext import ApiDispatcher
 from functools import partial
 from kivy.clock import Clock
-from kivy.logger import Logger
+from kivy.logger import Logger, LOG_LEVELS
 from traceback import print_stack
 
 TRACK_ADD_MODE_IN_PROGRESS = 1
@@ -49,7 +51,34 @@ DEFAULT_READ_RETRIES = 2
 
 COMMS_KEEP_ALIVE_TIMEOUT = 2
 
+# config commands written per channel; other config sections are written as a whole
+CHANNEL_CONFIG_COMMANDS = ('setImuCfg', 'setAnalogCfg', 'setTimerCfg', 'setGpioCfg', 'setPwmCfg')
+
+# commands written without waiting for the replies to the ones before them
+DEFAULT_PIPELINE_WINDOW = 4
+
 NO_DATA_AVAILABLE_DELAY = 0.1
+
+# A sample message without channel meta, as the device streams it: {"s":{"t":1234,"d":[1.0,2,...,16383]}}
+SAMPLE_MESSAGE_PATTERN = re.compile(r'\{"s":\{"t":(-?\d+),"d":\[([^\]]*)\]\}\}\s*$')
+TRACE_LOG_LEVEL = LOG_LEVELS['trace']
+
+def parse_sample_message(msg):
+    """
+    Parses a sample message without building it through the JSON decoder
+    :param msg the message received
+    :type msg str
+    :return dict of the message, as json.loads would return it, or None if it isn't a plain sample message
+    """
+    match = SAMPLE_MESSAGE_PATTERN.match(msg)
+    if match is None:
+        return None
+    tick, data = match.groups()
+    try:
+        return {'s': {'t': int(tick), 'd': map(float, data.split(',')) if data else []}}
+    except ValueError:
+        return None
+
 class RcpCmd:
     name = None
     cmd = None
@@ -69,6 +98,8 @@ class CommandSequence():
     rootName = None
     winCallback = None
     failCallback = None
+    # the number of commands waiting for replies at once
+    window = 1
 
 class RcpApi:
     detect_win_callback = None
@@ -94,6 +125,9 @@ class RcpApi:
 
     def __init__(self, settings, on_disconnect=None, on_connect=None, **kwargs):
         self.comms = kwargs.get('comms', self.comms)
+        # notifies on_rx at most once per frame, however many messages arrive
+        self._rx_trigger = Clock.create_trigger(self._notify_rx)
+        self._rx_error_count = 0
         self._running = Event()
         self._running.clear()
         self._enable_autodetect = Event()
@@ -181,7 +215,13 @@ class RcpApi:
 
     def init_api(self, comms):
         self.comms = comms
-        self._start_message_rx_worker()
+        set_message_handler = getattr(comms, 'set_message_handler', None)
+        if set_message_handler is not None:
+            # comms delivers messages as they arrive, without an rx worker
+            self._running.set()
+            set_message_handler(self._on_comms_message)
+        else:
+            self._start_message_rx_worker()
         self._start_cmd_sequence_worker()
         self.start_auto_detect_worker()
         Clock.schedule_interval(lambda dt: comms.keep_alive(), COMMS_KEEP_ALIVE_TIMEOUT)
@@ -220,6 +260,52 @@ class RcpApi:
     def _dispatch_message(self, msg_json):
         ApiDispatcher.get_instance().dispatch_msg(msg_json, self)
 
+    def _notify_rx(self, dt):
+        self.on_rx(True)
+
+    def _decode_message(self, msg):
+        """
+        Decodes a received message, taking a fast path for the sample messages streamed at the sample rate
+        :param msg the message received
+        :type msg str
+        :return dict of the message
+        """
+        msg_json = parse_sample_message(msg)
+        if msg_json is not None:
+            if Logger.isEnabledFor(TRACE_LOG_LEVEL):
+                Logger.trace('RCPAPI: Rx: ' + msg)
+            return msg_json
+
+        # clean incoming string, and drop illegal characters
+        msg = unicode(msg, errors='ignore')
+        msg_json = json.loads(msg, strict=False)
+
+        if 's' in msg_json:
+            if Logger.isEnabledFor(TRACE_LOG_LEVEL):
+                Logger.trace('RCPAPI: Rx: ' + str(msg))
+        else:
+            Logger.debug('RCPAPI: Rx: ' + str(msg))
+        return msg_json
+
+    def _on_comms_message(self, msg):
+        """
+        Handles a message delivered by comms, on its thread
+        """
+        try:
+            msg_json = self._decode_message(msg)
+            self._rx_trigger()
+            self._rx_error_count = 0
+            self._dispatch_message(msg_json)
+        except Exception as e:
+            Logger.warn('RCPAPI: Message rx exception: {} | {}'.format(repr(msg), str(e)))
+            Logger.debug(traceback.format_exc())
+            self._rx_error_count += 1
+            if self._rx_error_count > 5 and not self._auto_detect_event.is_set():
+                Logger.warn("RCPAPI: Too many Rx exceptions; re-opening connection")
+                self._rx_error_count = 0
+                self.recover_connection()
+                self.connected_version = None
+
     def msg_rx_worker(self):
         Logger.info('RCPAPI: msg_rx_worker starting')
         comms = self.comms
@@ -229,15 +315,8 @@ class RcpApi:
             try:
                 msg = comms.read_message()
                 if msg:
-                    # clean incoming string, and drop illegal characters
-                    msg = unicode(msg, errors='ignore')
-                    msg_json = json.loads(msg, strict=False)
-
-                    if 's' in msg_json:
-                        Logger.trace('RCPAPI: Rx: ' + str(msg))
-                    else:
-                        Logger.debug('RCPAPI: Rx: ' + str(msg))
-                    Clock.schedule_once(lambda dt: self.on_rx(True))
+                    msg_json = self._decode_message(msg)
+                    self._rx_trigger()
                     error_count = 0
                     self._dispatch_message(msg_json)
                     msg = ''
@@ -283,14 +362,156 @@ class RcpApi:
         command.failCallback = fail_callback
         self._command_queue.put(command)
 
-    def _queue_multiple(self, command_list, root_name, win_callback, fail_callback):
+    def _queue_multiple(self, command_list, root_name, win_callback, fail_callback, window=1):
         command = CommandSequence()
         command.command_list = command_list
         command.rootName = root_name
         command.winCallback = win_callback
         command.failCallback = fail_callback
+        command.window = window
         self._command_queue.put(command)
 
+    def _send_rcp_cmd(self, rcpCmd):
+        args = []
+        if rcpCmd.payload is not None:
+            args.append(rcpCmd.payload)
+        if rcpCmd.index is not None:
+            args.append(rcpCmd.index)
+        if rcpCmd.option is not None:
+            args.append(rcpCmd.option)
+        if rcpCmd.last is not None:
+            args.append(rcpCmd.last)
+        rcpCmd.cmd(*args)
+
+    def _drain_replies(self, quiet_time=0):
+        """
+        Discards replies left over from commands already dealt with
+        :param quiet_time keep discarding until no reply arrives for this many seconds
+        :type quiet_time float
+        """
+        q = self.cmdSequenceQueue
+        try:
+            while True:
+                reply = q.get(True, quiet_time) if quiet_time else q.get_nowait()
+                Logger.warn('RCPAPI: discarding unexpected reply {}'.format(reply))
+        except Queue.Empty:
+            pass
+
+    @staticmethod
+    def _reply_index(payload):
+        """
+        The index a reply is for, if it says; either as an 'index' field or
+        as the single channel a get reply is keyed by
+        """
+        if not isinstance(payload, dict):
+            return None
+        index = payload.get('index')
+        if index is not None:
+            return int(index)
+        keys = payload.keys()
+        if len(keys) == 1 and isinstance(keys[0], basestring) and keys[0].isdigit():
+            return int(keys[0])
+        return None
+
+    def _wait_for_reply(self, rcpCmd, outstanding):
+        """
+        Waits for the reply to a command
+        :param rcpCmd the command
+        :type rcpCmd RcpCmd
+        :param outstanding the commands sent after it, still waiting for replies
+        :type outstanding list of RcpCmd
+        :return (reply payload, the index the reply gave), or (None, None) if the reply was lost
+        """
+        q = self.cmdSequenceQueue
+        name = rcpCmd.name
+        retry = 0
+        while retry < DEFAULT_READ_RETRIES:
+            try:
+                result = q.get(True, self.msg_rx_timeout)
+            except Queue.Empty:
+                Logger.warn('RCPAPI: Read message timeout waiting for {}'.format(name))
+                self.recoverTimeout()
+                retry += 1
+                continue
+
+            msgName = result.keys()[0]
+            if not msgName == name:
+                Logger.warn('RCPAPI: rx message did not match expected name ' + str(name) + '; ' + str(msgName))
+                continue
+            payload = result[name]
+            index = self._reply_index(payload)
+            if index is None or rcpCmd.index is None or index == int(rcpCmd.index):
+                return payload, index
+            if any(c.name == name and c.index is not None and int(c.index) == index for c in outstanding):
+                # the device has moved on to a later command; this one's reply was lost
+                Logger.warn('RCPAPI: reply for {} index {} arrived before index {}'.format(name, index, rcpCmd.index))
+                return None, None
+            Logger.warn('RCPAPI: discarding stale reply for {} index {}'.format(name, index))
+        return None, None
+
+    def _execute_command_sequence(self, command_list, window):
+        """
+        Sends a sequence of commands, with up to window of them waiting for their replies at once.
+        The device replies to commands in the order they were sent, so each reply is matched to the
+        oldest command waiting for one, and to its index when the reply gives one. When a reply is
+        lost, the commands from the first one whose reply can't be told apart are sent again, one
+        at a time, so the device always receives them in order.
+        :param command_list the commands
+        :type command_list list of RcpCmd
+        :param window the number of commands waiting for replies at once
+        :type window int
+        :return dict of the replies by command name
+        """
+        responseResults = {}
+        cmdLength = len(command_list)
+        level2Retries = [0] * cmdLength
+        # for each command taking a reply that didn't give its index, the number of commands sent by then
+        ambiguous_acks = {}
+        # the commands before acknowledged have replies; the commands before sent have been sent
+        acknowledged = 0
+        sent = 0
+        self._drain_replies()
+        try:
+            self.notifyProgress(acknowledged, cmdLength)
+            while acknowledged < cmdLength:
+                while sent < cmdLength and sent - acknowledged < window:
+                    self._send_rcp_cmd(command_list[sent])
+                    sent += 1
+
+                rcpCmd = command_list[acknowledged]
+                name = rcpCmd.name
+                result, index = self._wait_for_reply(rcpCmd, command_list[acknowledged + 1:sent])
+
+                if result is None:
+                    Logger.warn('RCPAPI: Level 2 retry for (' + str(level2Retries[acknowledged]) + ') ' + name)
+                    level2Retries[acknowledged] += 1
+                    if level2Retries[acknowledged] > self.level_2_retries:
+                        raise Exception('Timeout waiting for ' + name)
+                    # an earlier command of the same name may have taken this one's reply
+                    # for its own lost one; send again from the first that could have
+                    failed = acknowledged
+                    for i in sorted(ambiguous_acks.keys()):
+                        if command_list[i].name == name and ambiguous_acks[i] > failed:
+                            acknowledged = i
+                            break
+                    for i in ambiguous_acks.keys():
+                        if i >= acknowledged:
+                            del ambiguous_acks[i]
+                    sent = acknowledged
+                    # a link that lost a reply isn't trusted with more than one command at once
+                    window = 1
+                    self._drain_replies(self.msg_rx_timeout)
+                    continue
+
+                if index is None:
+                    ambiguous_acks[acknowledged] = sent
+                responseResults[name] = result
+                acknowledged += 1
+                self.notifyProgress(acknowledged, cmdLength)
+            return responseResults
+        finally:
+            self._drain_replies()
+
     def cmd_sequence_worker(self):
         Logger.info('RCPAPI: cmd_sequence_worker starting')
         while self._running.is_set():
@@ -308,60 +529,11 @@ class RcpApi:
 
                 if not comms.isOpen(): self.run_auto_detect()
 
-                q = self.cmdSequenceQueue
-
-                responseResults = {}
-                cmdCount = 0
-                cmdLength = len(command_list)
-                self.notifyProgress(cmdCount, cmdLength)
+                names = set([rcpCmd.name for rcpCmd in command_list])
+                for name in names:
+                    self.addListener(name, self.rcpCmdComplete)
                 try:
-                    for rcpCmd in command_list:
-                        payload = rcpCmd.payload
-                        index = rcpCmd.index
-                        option = rcpCmd.option
-                        last = rcpCmd.last
-
-                        level2Retry = 0
-                        name = rcpCmd.name
-                        result = None
-
-                        self.addListener(name, self.rcpCmdComplete)
-                        while not result and level2Retry <= self.level_2_retries:
-                            args = []
-                            if payload is not None:
-                                args.append(payload)
-                            if index is not None:
-                                args.append(index)
-                            if option is not None:
-                                args.append(option)
-                            if last is not None:
-                                args.append(last)
-                            rcpCmd.cmd(*args)
-                            retry = 0
-                            while not result and retry < DEFAULT_READ_RETRIES:
-                                try:
-                                    result = q.get(True, self.msg_rx_timeout)
-                                    msgName = result.keys()[0]
-                                    if not msgName == name:
-                                        Logger.warn('RCPAPI: rx message did not match expected name ' + str(name) + '; ' + str(msgName))
-                                        result = None
-                                except Exception as e:
-                                    Logger.warn('RCPAPI: Read message timeout waiting for {}'.format(name))
-                                    self.recoverTimeout()
-                                    retry += 1
-                            if not result:
-                                Logger.warn('RCPAPI: Level 2 retry for (' + str(level2Retry) + ') ' + name)
-                                level2Retry += 1
-
-
-                        if not result:
-                            raise Exception('Timeout waiting for ' + name)
-
-
-                        responseResults[name] = result[name]
-                        self.removeListener(name, self.rcpCmdComplete)
-                        cmdCount += 1
-                        self.notifyProgress(cmdCount, cmdLength)
+                    responseResults = self._execute_command_sequence(command_list, command.window)
 
                     if rootName:
                         callback = self.callback_factory(winCallback, {rootName: responseResults})
@@ -380,6 +552,9 @@ class RcpApi:
                     Clock.schedule_once(callback)
                     self.connected_version = None
                     self.recover_connection()
+                finally:
+                    for name in names:
+                        self.removeListener(name, self.rcpCmdComplete)
 
                 Logger.debug('RCPAPI: Execute Sequence complete')
 
@@ -450,6 +625,7 @@ class RcpApi:
 
     def getRcpCfgCallback(self, cfg, rcpCfgJson, winCallback):
         cfg.fromJson(rcpCfgJson)
+        cfg.device_snapshot = self.config_snapshot(cfg)
         winCallback(cfg)
 
     def getRcpCfg(self, cfg, winCallback, failCallback):
@@ -504,7 +680,8 @@ class RcpApi:
             if capabilities.has_camera_control:
                 cmdSequence.append(RcpCmd('camCtrlCfg', self.get_camera_control_config))
 
-            self._queue_multiple(cmdSequence, 'rcpCfg', lambda rcpJson: self.getRcpCfgCallback(cfg, rcpJson, winCallback), failCallback)
+            self._queue_multiple(cmdSequence, 'rcpCfg', lambda rcpJson: self.getRcpCfgCallback(cfg, rcpJson, winCallback), failCallback,
+                                 window=DEFAULT_PIPELINE_WINDOW)
 
         # First we need to get capabilities, then figure out what to query
         self.executeSingle(RcpCmd('capabilities', self.getCapabilities), query_available_configs, failCallback)
@@ -513,90 +690,163 @@ class RcpApi:
         # Capabilities object also needs version info
         self.executeSingle(RcpCmd('capabilities', self.getCapabilities), success_cb, fail_cb)
 
-    def writeRcpCfg(self, cfg, winCallback=None, failCallback=None):
+    def _sequence_write_config(self, cfg, all_sections=False):
+        """
+        Builds the commands that write the stale sections of a config
+        :param cfg the config
+        :type cfg RcpConfig
+        :param all_sections True to write every section, stale or not
+        :type all_sections bool
+        :return list of RcpCmd
+        """
         cmdSequence = []
 
         connCfg = cfg.connectivityConfig
-        if connCfg.stale:
+        if all_sections or connCfg.stale:
             cmdSequence.append(RcpCmd('setConnCfg', self.setConnectivityCfg, connCfg.toJson()))
 
         gpsCfg = cfg.gpsConfig
-        if gpsCfg.stale:
+        if all_sections or gpsCfg.stale:
             cmdSequence.append(RcpCmd('setGpsCfg', self.setGpsCfg, gpsCfg.toJson()))
 
         lapCfg = cfg.lapConfig
-        if lapCfg.stale:
+        if all_sections or lapCfg.stale:
             cmdSequence.append(RcpCmd('setLapCfg', self.setLapCfg, lapCfg.toJson()))
 
         imuCfg = cfg.imuConfig
         for i in range(imuCfg.channelCount):
             imuChannel = imuCfg.channels[i]
-            if imuChannel.stale:
+            if all_sections or imuChannel.stale:
                 cmdSequence.append(RcpCmd('setImuCfg', self.setImuCfg, imuChannel.toJson(), i))
 
         analogCfg = cfg.analogConfig
         for i in range(analogCfg.channelCount):
             analogChannel = analogCfg.channels[i]
-            if analogChannel.stale:
+            if all_sections or analogChannel.stale:
                 cmdSequence.append(RcpCmd('setAnalogCfg', self.setAnalogCfg, analogChannel.toJson(), i))
 
         timerCfg = cfg.timerConfig
         for i in range(timerCfg.channelCount):
             timerChannel = timerCfg.channels[i]
-            if timerChannel.stale:
+            if all_sections or timerChannel.stale:
                 cmdSequence.append(RcpCmd('setTimerCfg', self.setTimerCfg, timerChannel.toJson(), i))
 
         gpioCfg = cfg.gpioConfig
         for i in range(gpioCfg.channelCount):
             gpioChannel = gpioCfg.channels[i]
-            if gpioChannel.stale:
+            if all_sections or gpioChannel.stale:
                 cmdSequence.append(RcpCmd('setGpioCfg', self.setGpioCfg, gpioChannel.toJson(), i))
 
         pwmCfg = cfg.pwmConfig
         for i in range(pwmCfg.channelCount):
             pwmChannel = pwmCfg.channels[i]
-            if pwmChannel.stale:
+            if all_sections or pwmChannel.stale:
                 cmdSequence.append(RcpCmd('setPwmCfg', self.setPwmCfg, pwmChannel.toJson(), i))
 
         canCfg = cfg.canConfig
-        if canCfg.stale:
+        if all_sections or canCfg.stale:
             cmdSequence.append(RcpCmd('setCanCfg', self.setCanCfg, canCfg.toJson()))
 
         obd2Cfg = cfg.obd2Config
-        if obd2Cfg.stale:
+        if all_sections or obd2Cfg.stale:
             self.sequence_write_obd2_channels(obd2Cfg.toJson(), cmdSequence)
 
         can_channels = cfg.can_channels
-        if can_channels.stale:
+        if all_sections or can_channels.stale:
             self.sequence_write_can_channels(can_channels.to_json_dict(), cmdSequence)
 
         trackCfg = cfg.trackConfig
-        if trackCfg.stale:
+        if all_sections or trackCfg.stale:
             cmdSequence.append(RcpCmd('setTrackCfg', self.setTrackCfg, trackCfg.toJson()))
 
         scriptCfg = cfg.scriptConfig
-        if scriptCfg.stale:
+        if all_sections or scriptCfg.stale:
             self.sequenceWriteScript(scriptCfg.toJson(), cmdSequence)
 
         trackDb = cfg.trackDb
-        if trackDb.stale:
+        if all_sections or trackDb.stale:
             self.sequenceWriteTrackDb(trackDb.toJson(), cmdSequence)
 
         wifi_config = cfg.wifi_config
-        if wifi_config.stale:
+        if all_sections or wifi_config.stale:
             cmdSequence.append(RcpCmd('setWifiCfg', self.set_wifi_config, wifi_config.to_json()))
 
         sdlog_control_config = cfg.sd_logging_control_config
-        if sdlog_control_config.stale:
+        if all_sections or sdlog_control_config.stale:
             cmdSequence.append(RcpCmd('setSdLogCtrlCfg', self.set_sdlog_control_config, sdlog_control_config.to_json_dict()))
 
         camera_control_config = cfg.camera_control_config
-        if camera_control_config.stale:
+        if all_sections or camera_control_config.stale:
             cmdSequence.append(RcpCmd('setCamCtrlCfg', self.set_camera_control_config, camera_control_config.to_json_dict()))
 
-        cmdSequence.append(RcpCmd('flashCfg', self.sendFlashConfig))
+        return cmdSequence
+
+    def _group_config_commands(self, cmdSequence):
+        """
+        Groups config write commands by what they write: each channel of the
+        channel configs on its own, and each other section as a whole
+        :param cmdSequence the commands
+        :type cmdSequence list of RcpCmd
+        :return OrderedDict of the commands by group
+        """
+        groups = OrderedDict()
+        for rcpCmd in cmdSequence:
+            key = (rcpCmd.name, rcpCmd.index) if rcpCmd.name in CHANNEL_CONFIG_COMMANDS else rcpCmd.name
+            groups.setdefault(key, []).append(rcpCmd)
+        return groups
+
+    def _command_signature(self, rcpCmds):
+        return json.dumps([[rcpCmd.payload, rcpCmd.index, rcpCmd.option, rcpCmd.last] for rcpCmd in rcpCmds],
+                          sort_keys=True, separators=(',', ':'))
+
+    def config_snapshot(self, cfg):
+        """
+        Takes a snapshot of every section of a config, to compare a later write against
+        :param cfg the config, as it is on the device
+        :type cfg RcpConfig
+        :return dict of the snapshot
+        """
+        groups = self._group_config_commands(self._sequence_write_config(cfg, all_sections=True))
+        return {key: self._command_signature(rcpCmds) for key, rcpCmds in groups.iteritems()}
+
+    def _plan_config_write(self, cfg):
+        cmdSequence = []
+        snapshot = dict(cfg.device_snapshot or {})
+        groups = self._group_config_commands(self._sequence_write_config(cfg))
+        for key, rcpCmds in groups.iteritems():
+            signature = self._command_signature(rcpCmds)
+            if snapshot.get(key) != signature:
+                cmdSequence.extend(rcpCmds)
+                snapshot[key] = signature
+        if cmdSequence:
+            cmdSequence.append(RcpCmd('flashCfg', self.sendFlashConfig))
+        return cmdSequence, snapshot
+
+    def plan_rcp_cfg_write(self, cfg):
+        """
+        Reports what writeRcpCfg would send, without sending anything: the commands for the
+        stale sections and channels that differ from the config last read from or written to the device
+        :param cfg the config
+        :type cfg RcpConfig
+        :return list of RcpCmd
+        """
+        return self._plan_config_write(cfg)[0]
+
+    def writeRcpCfg(self, cfg, winCallback=None, failCallback=None):
+        cmdSequence, snapshot = self._plan_config_write(cfg)
+        Logger.info('RCPAPI: Writing {} config commands'.format(len(cmdSequence)))
+
+        def on_written(result):
+            cfg.device_snapshot = snapshot
+            if winCallback:
+                winCallback(result)
+
+        if not cmdSequence:
+            # the device already has this config
+            Clock.schedule_once(lambda dt: on_written({'setRcpCfg': {}}))
+            return
 
-        self._queue_multiple(cmdSequence, 'setRcpCfg', winCallback, failCallback)
+        self._queue_multiple(cmdSequence, 'setRcpCfg', on_written, failCallback, window=DEFAULT_PIPELINE_WINDOW)
 
     def resetDevice(self, bootloader=False, reset_delay=0):
         if bootloader:
@@ -0,0 +1,110 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ('RcpConfigCache', 'forget_other_device')
+import errno
+import json
+import os
+import re
+from kivy.logger import Logger
+
+
+def forget_other_device(rc_config, config_serial, version):
+    """
+    Clears what a config knows of the device it was read from when a different device connects,
+    whether or not the config is then replaced by the new device's
+    :param rc_config the config
+    :type rc_config RcpConfig
+    :param config_serial the serial number of the device the config was read from, or None
+    :type config_serial string
+    :param version the version of the connected device
+    :type version VersionConfig
+    :return True if the connected device is not the one the config was read from
+    """
+    if config_serial is None or version is None or version.serial == config_serial:
+        return False
+    # writes skip the sections that match this snapshot, and it describes the other device
+    rc_config.device_snapshot = None
+    return True
+
+
+class RcpConfigCache(object):
+    """
+    Keeps the config last read from or written to each device on disk, by device serial
+    number and firmware version, so a device's config can be shown as soon as it connects
+    while it is read again in the background.
+    """
+    CACHE_DIR = 'config_cache'
+
+    def __init__(self, data_dir):
+        """
+        :param data_dir the directory to keep the cache in
+        :type data_dir string
+        """
+        self._cache_dir = os.path.join(data_dir, RcpConfigCache.CACHE_DIR)
+
+    def _get_path(self, version):
+        if not version or not version.serial:
+            # without a serial number, one device can't be told from another
+            return None
+        name = '{}_{}_{}.json'.format(version.name, version.serial, version.version_string())
+        return os.path.join(self._cache_dir, re.sub(r'[^\w.-]', '_', name))
+
+    def load(self, version):
+        """
+        Loads the cached config of a device
+        :param version the version of the connected device
+        :type version VersionConfig
+        :return the config json, or None if there isn't one
+        """
+        path = self._get_path(version)
+        if path is None or not os.path.isfile(path):
+            return None
+        try:
+            with open(path) as cache_file:
+                return json.load(cache_file)
+        except (IOError, ValueError) as e:
+            Logger.warn('RcpConfigCache: could not load cached config {}: {}'.format(path, e))
+            return None
+
+    def save(self, version, rc_config):
+        """
+        Saves the config of a device
+        :param version the version of the connected device
+        :type version VersionConfig
+        :param rc_config the config, as it is on the device
+        :type rc_config RcpConfig
+        """
+        path = self._get_path(version)
+        if path is None:
+            return
+        try:
+            os.makedirs(self._cache_dir)
+        except OSError as exception:
+            if exception.errno != errno.EEXIST:
+                raise
+
+        # write a new file and swap it in, so a partial write never replaces a good cache
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as cache_file:
+            json.dump(rc_config.toJson(), cache_file, separators=(',', ':'))
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(temp_path, path)
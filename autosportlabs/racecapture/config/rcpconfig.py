@@ -1553,6 +1553,9 @@ class RcpConfig(object):
         self.sd_logging_control_config = SDLoggingControlConfig()
         self.scriptConfig = LuaScript()
         self.trackDb = TracksDb()
+        # the sections of the config as last read from or written to the device, so a write
+        # only needs to send what differs; None until the config is read from the device
+        self.device_snapshot = None
 
     @property
     def stale(self):
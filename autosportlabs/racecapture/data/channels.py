@@ -69,8 +69,11 @@ class ChannelMeta(object):
 
 class ChannelMetaCollection(object):
     channel_metas = []
+    # incremented each time the channel metas are loaded
+    version = 0
 
     def fromJson(self, metaJson):
+        self.version += 1
         channel_metas = self.channel_metas
         del channel_metas[:]
         for ch in metaJson:
@@ -0,0 +1,126 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+
+__all__ = ('PlotPyramid',)
+import bisect
+
+# the fewest points the coarsest level is reduced to
+MIN_LEVEL_POINTS = 64
+
+
+class PlotPyramid(object):
+    """
+    Keeps a plot's samples at a series of resolutions, so any x range of it can be
+    drawn with about the same number of points. Each level halves the one below it:
+    every four points become the lowest and highest of them, in x order, so a peak
+    such as a brake spike or a limiter hit survives at every level.
+    """
+
+    def __init__(self, x_values, y_values, sample_indexes=None):
+        """
+        :param x_values the x value of each sample, in ascending order
+        :type x_values list
+        :param y_values the y value of each sample; samples without a value are left out
+        :type y_values list
+        :param sample_indexes the index of each sample in its source data, if not the position in the lists
+        :type sample_indexes list
+        """
+        if sample_indexes is None:
+            sample_indexes = xrange(len(x_values))
+        xs = []
+        ys = []
+        indexes = []
+        for x, y, index in zip(x_values, y_values, sample_indexes):
+            if y is not None:
+                xs.append(x)
+                ys.append(y)
+                indexes.append(index)
+        # list of (x values, y values, sample indexes), finest first
+        self._levels = [(xs, ys, indexes)]
+        while len(xs) > MIN_LEVEL_POINTS:
+            xs, ys, indexes = self._reduce(xs, ys, indexes)
+            self._levels.append((xs, ys, indexes))
+
+    @staticmethod
+    def _reduce(xs, ys, indexes):
+        reduced_xs = []
+        reduced_ys = []
+        reduced_indexes = []
+        for start in xrange(0, len(xs), 4):
+            end = min(start + 4, len(xs))
+            low = high = start
+            for i in xrange(start + 1, end):
+                y = ys[i]
+                if y < ys[low]:
+                    low = i
+                elif y > ys[high]:
+                    high = i
+            if low == high:
+                # a flat stretch; keep both its ends, so each level still halves the one below
+                high = end - 1
+            for i in sorted(set((low, high))):
+                reduced_xs.append(xs[i])
+                reduced_ys.append(ys[i])
+                reduced_indexes.append(indexes[i])
+        return reduced_xs, reduced_ys, reduced_indexes
+
+    @property
+    def levels(self):
+        return len(self._levels)
+
+    @property
+    def max_x(self):
+        """
+        The x value of the last sample, or None if there are none
+        """
+        xs = self._levels[0][0]
+        return xs[-1] if xs else None
+
+    def points(self, x_min, x_max, max_points):
+        """
+        Gets the points to draw an x range with, from the finest level that can show it
+        :param x_min the start of the range
+        :type x_min float
+        :param x_max the end of the range
+        :type x_max float
+        :param max_points the most points to draw the range with
+        :type max_points int
+        :return list of (x, y), with the points just outside the range so the line reaches its edges
+        """
+        for xs, ys, indexes in self._levels:
+            start = bisect.bisect_left(xs, x_min)
+            end = bisect.bisect_right(xs, x_max)
+            if end - start <= max_points:
+                break
+        start = max(0, start - 1)
+        end = min(len(xs), end + 1)
+        return zip(xs[start:end], ys[start:end])
+
+    def sample_index_at(self, x):
+        """
+        Finds the sample at an x value
+        :param x the x value
+        :type x float
+        :return the source index of the first sample after x
+        :raises IndexError if there isn't one
+        """
+        xs, ys, indexes = self._levels[0]
+        return indexes[bisect.bisect_right(xs, x)]
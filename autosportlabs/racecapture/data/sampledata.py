@@ -18,6 +18,8 @@
 # have received a copy of the GNU General Public License along with
 # this code. If not, see <http://www.gnu.org/licenses/>.
 
+from array import array
+from itertools import izip
 from autosportlabs.racecapture.data.channels import ChannelMeta, ChannelMetaCollection
 
 class SampleMetaException(Exception):
@@ -29,18 +31,228 @@ class SampleValue(object):
         self.channelMeta = channelMeta
 
 STARTING_BITMAP = 1
+
+class ChannelIndex(object):
+    """
+    The fixed position of each channel in a SampleRow; built once each time the channel meta changes
+    """
+    def __init__(self, names):
+        """
+        :param names the channel names, in position order
+        :type names list
+        """
+        self.names = tuple(names)
+        self.positions = dict((name, index) for index, name in enumerate(self.names))
+
+    def __len__(self):
+        return len(self.names)
+
+    def extend(self, names):
+        """
+        :return a new ChannelIndex with names appended
+        """
+        return ChannelIndex(self.names + tuple(names))
+
+class SampleRow(object):
+    """
+    The value of every channel at one point in time: an array of values in ChannelIndex order,
+    and a bitmap of the channels that have a value.
+    A row is never modified once created, so one row is shared by every consumer of a sample
+    without copying. It reads like a dict of channel name to value, for the channels that have one.
+    A row can also carry a bitmap of the channels that changed since the previous row its consumer saw.
+    """
+    __slots__ = ('channel_index', 'values', 'present', 'changed')
+
+    def __init__(self, channel_index, values=None, present=0, changed=None):
+        """
+        :param channel_index the position of each channel
+        :type channel_index ChannelIndex
+        :param values the value of each channel, NaN where there is no value. Not to be modified.
+        :type values array of 'd'
+        :param present bitmap of the positions with a value
+        :type present int
+        :param changed bitmap of the positions whose value changed, or None if not known
+        :type changed int
+        """
+        self.channel_index = channel_index
+        self.values = values if values is not None else array('d', [float('nan')]) * len(channel_index)
+        self.present = present
+        self.changed = changed
+
+    def get(self, name, default=None):
+        position = self.channel_index.positions.get(name)
+        if position is None or not (self.present >> position) & 1:
+            return default
+        return self.values[position]
+
+    def __getitem__(self, name):
+        position = self.channel_index.positions.get(name)
+        if position is None or not (self.present >> position) & 1:
+            raise KeyError(name)
+        return self.values[position]
+
+    def __contains__(self, name):
+        position = self.channel_index.positions.get(name)
+        return position is not None and (self.present >> position) & 1 == 1
+
+    def __len__(self):
+        return bin(self.present).count('1')
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def iterkeys(self):
+        present = self.present
+        for position, name in enumerate(self.channel_index.names):
+            if (present >> position) & 1:
+                yield name
+
+    def iteritems(self):
+        present = self.present
+        values = self.values
+        for position, name in enumerate(self.channel_index.names):
+            if (present >> position) & 1:
+                yield name, values[position]
+
+    def iterchanged(self):
+        """
+        Iterates the channels that changed, or every channel with a value if that isn't known
+        :return generator of (channel name, value)
+        """
+        changed = self.changed
+        if changed is None:
+            for item in self.iteritems():
+                yield item
+            return
+        names = self.channel_index.names
+        values = self.values
+        changed &= self.present
+        while changed:
+            low_bit = changed & -changed
+            position = low_bit.bit_length() - 1
+            yield names[position], values[position]
+            changed ^= low_bit
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def select(self, names):
+        """
+        :return tuple of the values of channels, None where there is no value
+        """
+        return tuple([self.get(name) for name in names])
         
+class SampleDecoder(object):
+    """
+    Decodes the data of 's' messages for one set of channel metas.
+    The channels present in a sample are given by its bitmask words. Each
+    combination of bitmask words is compiled once into the positions of the
+    channels present, and values are written straight into a channel array.
+    """
+    # Channels logged at a mix of rates only produce a few combinations of bitmasks
+    MAX_PATTERNS = 1024
+
+    def __init__(self, metas):
+        """
+        :param metas the channel metas to decode samples for
+        :type metas ChannelMetaCollection
+        """
+        channel_metas = metas.channel_metas
+        self.metas = metas
+        self.version = metas.version
+        self.names = tuple([meta.name for meta in channel_metas])
+        self.channel_count = len(channel_metas)
+        self.bitmask_field_count = max(0, (self.channel_count - 1) / 32) + 1
+        self.max_field_count = self.channel_count + self.bitmask_field_count
+        self._patterns = {}
+
+    def is_current(self, metas):
+        """
+        :return True if the decoder was compiled for the current channel metas
+        """
+        return self.metas is metas and self.version == metas.version
+
+    def _compile(self, bitmasks):
+        positions = []
+        channel_count = self.channel_count
+        for bitmap_index, bitmask in enumerate(bitmasks):
+            base = bitmap_index * 32
+            while bitmask:
+                low_bit = bitmask & -bitmask
+                position = base + low_bit.bit_length() - 1
+                if position >= channel_count:
+                    break
+                positions.append(position)
+                bitmask ^= low_bit
+        return tuple(positions)
+
+    def decode(self, data, values):
+        """
+        Decodes the data of a sample
+        :param data the 'd' field of the message: the values present, followed by the bitmask words
+        :type data list
+        :param values the array of channel values to write into
+        :type values array
+        :return tuple of the positions of the channels present in the sample
+        """
+        field_count = len(data)
+        bitmask_field_count = self.bitmask_field_count
+        if field_count > self.max_field_count or field_count < bitmask_field_count:
+            raise SampleMetaException('Unexpected data packet count {}; channel meta expects between {} and {} channels'.format(field_count, bitmask_field_count, self.max_field_count))
+
+        value_count = field_count - bitmask_field_count
+        bitmasks = tuple([int(field) for field in data[value_count:]])
+        positions = self._patterns.get(bitmasks)
+        if positions is None:
+            positions = self._compile(bitmasks)
+            if len(self._patterns) >= SampleDecoder.MAX_PATTERNS:
+                self._patterns.clear()
+            self._patterns[bitmasks] = positions
+
+        if len(positions) != value_count:
+            raise SampleMetaException('Unexpected data packet count {}; bitmask expects {} channels'.format(value_count, len(positions)))
+
+        for position, value in izip(positions, data):
+            values[position] = value
+        return positions
+
 class Sample(object):
+    """
+    A sample decoded from an 's' message. The values of the channels present
+    are in values, at the positions of the channel metas listed in positions.
+    """
     tick = 0
-    samples = []
     metas = ChannelMetaCollection()
     updated_meta = False
     
     def __init__(self, **kwargs):
         self.tick = kwargs.get('tick', self.tick)
-        self.samples = kwargs.get('samples', self.samples)
         self.metas = kwargs.get('channelMetas', self.metas)
         self.updated_meta = len(self.metas.channel_metas) > 0
+        # the decoder of the current data, or None if samples were given as SampleValues
+        self.decoder = None
+        self.values = array('d')
+        self.positions = ()
+        self._samples = kwargs.get('samples', [])
+
+    @property
+    def samples(self):
+        """
+        The values present in the sample, as SampleValues
+        """
+        if self._samples is None:
+            channel_metas = self.metas.channel_metas
+            values = self.values
+            self._samples = [SampleValue(values[position], channel_metas[position]) for position in self.positions]
+        return self._samples
+
+    @samples.setter
+    def samples(self, samples):
+        self._samples = samples
+        self.decoder = None
         
     def fromJson(self, json):
         if json:
@@ -58,41 +270,11 @@ class Sample(object):
                     self.processData(dataJson)
     
     def processData(self, dataJson):
-        metas = self.metas.channel_metas
-        channelConfigCount = len(metas) 
-        bitmaskFieldCount = max(0, (channelConfigCount - 1) / 32) + 1       
-        
-        maxFieldCount = channelConfigCount + bitmaskFieldCount
-                
-        fieldData = dataJson
-        fieldDataSize = len(fieldData)
-        if fieldDataSize > maxFieldCount or fieldDataSize < bitmaskFieldCount:
-            raise SampleMetaException('Unexpected data packet count {}; channel meta expects between {} and {} channels'.format(fieldDataSize, bitmaskFieldCount, maxFieldCount))
-
-        bitmaskFields = []
-        for i in range(fieldDataSize - bitmaskFieldCount, fieldDataSize):
-            bitmaskFields.append(int(fieldData[i]))
-        
-        samples = self.samples
-        del samples[:]
-        
-        channelConfigIndex = 0
-        bitmapIndex = 0
-        fieldIndex = 0
-        mask_index = 0
-        channelConfigCount = len(metas)
-        while channelConfigIndex < channelConfigCount:
-            if mask_index >= 32:            
-                mask_index = 0;
-                bitmapIndex += 1
-                if bitmapIndex > len(bitmaskFields):
-                    raise Exception("channel count overflowed number of bitmap fields available")
-            
-            mask = 1 << mask_index
-            if (bitmaskFields[bitmapIndex] & mask) != 0:
-                value = float(fieldData[fieldIndex])
-                fieldIndex += 1
-                sample = SampleValue(value, metas[channelConfigIndex])
-                samples.append(sample)
-            channelConfigIndex += 1
-            mask_index += 1
+        decoder = self.decoder
+        if decoder is None or not decoder.is_current(self.metas):
+            decoder = SampleDecoder(self.metas)
+            self.values = array('d', [float('nan')]) * decoder.channel_count
+
+        self.positions = decoder.decode(dataJson, self.values)
+        self.decoder = decoder
+        self._samples = None
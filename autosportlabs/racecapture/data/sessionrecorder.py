@@ -18,18 +18,18 @@
 # have received a copy of the GNU General Public License along with
 # this code. If not, see <http://www.gnu.org/licenses/>.
 
-from datetime import datetime
+from collections import OrderedDict
 from threading import Thread
+from time import sleep
 from kivy.clock import Clock
 from kivy.logger import Logger
 from kivy.event import EventDispatcher
 from autosportlabs.util.timeutil import format_date
 from autosportlabs.racecapture.config.rcpconfig import GpsSample
 from autosportlabs.racecapture.geo.geopoint import GeoPoint
+from autosportlabs.racecapture.databus.databus import SampleTap
 from autosportlabs.util.threadutil import safe_thread_exit
 import copy
-import Queue
-from Queue import Empty, Full
 
 
 class SessionRecorder(EventDispatcher):
@@ -40,14 +40,13 @@ class SessionRecorder(EventDispatcher):
     # Main app views that the SessionRecorder should start recording when
     # displayed
     RECORDING_VIEWS = ['dash']
-    SAMPLE_QUEUE_GET_TIMEOUT = 0.5
-    SAMPLE_QUEUE_MAX_SIZE = 50
+    # How long the worker waits for samples when none are captured
+    SAMPLE_TAP_POLL_INTERVAL = 0.05
+    # Enough for several seconds of samples at the device's fastest rate
+    SAMPLE_TAP_MAX_SIZE = 1000
     SAMPLE_QUEUE_UNCOMMITTED_INSERT_LIMIT = 37
     SAMPLE_QUEUE_BACKLOG_LOG_THRESHOLD = 0.5
     SAMPLE_QUEUE_BACKLOG_LOG_INTERVAL = 100
-    SAMPLE_QUEUE_MIN_SEND_DELAY_MS = 4 
-    SAMPLE_QUEUE_MAX_SEND_DELAY_MS = 250
-    SAMPLE_QUEUE_SLOWING_THRESHOLD = SAMPLE_QUEUE_MAX_SIZE * SAMPLE_QUEUE_BACKLOG_LOG_THRESHOLD
 
     def __init__(self, datastore, databus, rcpapi, settings, track_manager=None, status_pump=None, stop_delay=120):
         """
@@ -57,19 +56,17 @@ class SessionRecorder(EventDispatcher):
         :param rcpapi: RcpApi object for listening for connect/disconnect events
         :return:
         """
-        self._sample_queue = Queue.Queue(
-            maxsize=SessionRecorder.SAMPLE_QUEUE_MAX_SIZE)
+        # captures samples at the device's rate, fed by the DataBusPump
+        self.sample_tap = SampleTap(SessionRecorder.SAMPLE_TAP_MAX_SIZE)
         self._recorder_thread = None
-        self._sample_queue_full = False
-        self._sample_last_send = datetime(1,1,1)
-        self._sample_send_delay = SessionRecorder.SAMPLE_QUEUE_MIN_SEND_DELAY_MS
 
-        self._sample_accumulator = {}
         self._datastore = datastore
         self._databus = databus
         self._rcapi = rcpapi
         self._settings = settings
         self._channels = None
+        # channel order of the samples queued for recording
+        self._channel_names = []
         self.recording = False
         self._current_session_id = None
         self._track_manager = track_manager
@@ -84,7 +81,6 @@ class SessionRecorder(EventDispatcher):
         self._rcapi.add_connect_listener(self._on_rc_connected)
         self._rcapi.add_disconnect_listener(self._on_rc_disconnected)
         self._databus.addMetaListener(self._on_meta)
-        self._databus.addSampleListener(self._on_sample)
         self._gps_sample = GpsSample()
         metas = self._databus.getMeta()
         if metas:
@@ -126,7 +122,8 @@ class SessionRecorder(EventDispatcher):
                 self._create_session_name(), self._channels)
             self.dispatch('on_recording', True)
             self.recording = True
-            self._sample_accumulator = {}
+            self._channel_names = list(self._channels.keys())
+            self.sample_tap.start()
 
             t = Thread(target=self._session_recorder_worker)
             t.daemon = True
@@ -156,6 +153,7 @@ class SessionRecorder(EventDispatcher):
         """
         if self.recording:
             Logger.info("SessionRecorder: stopping session")
+            self.sample_tap.stop()
             self.recording = False
             if self._recorder_thread is not None:
                 self._recorder_thread.join()
@@ -223,38 +221,52 @@ class SessionRecorder(EventDispatcher):
     def _session_recorder_worker(self):
         Logger.info('SessionRecorder: session recorder worker starting')
         try:
-            # reset our sample data dict
-            qsize = 0
-            insert_counter = 0
-            sample_queue = self._sample_queue
-            index = 0
-            # will drain the queue before exiting thread
-            while self.recording or qsize > 0:
-                try:
-                    sample_data = sample_queue.get(
-                        True, SessionRecorder.SAMPLE_QUEUE_GET_TIMEOUT)
-                    self._datastore.insert_sample_nocommit(
-                        sample_data, self._current_session_id)
-                    insert_counter += 1
-                    qsize = sample_queue.qsize()
-                    # since the commit is slow, only do the commit once the queue empty to prevent overrunning the buffer.
-                    if (qsize == 0) or (insert_counter >= SessionRecorder.SAMPLE_QUEUE_UNCOMMITTED_INSERT_LIMIT):
-                        self._datastore.commit()
-                        insert_counter = 0
-                    
-                    if qsize > 0 and index % SessionRecorder.SAMPLE_QUEUE_BACKLOG_LOG_INTERVAL == 0:
-                        Logger.info( 'SessionRecorder: queue backlog: {}, commit backlog: {}, sample send delay: {}ms'
-				.format(qsize, insert_counter, self._sample_send_delay ))
-
-                    if insert_counter > (SessionRecorder.SAMPLE_QUEUE_UNCOMMITTED_INSERT_LIMIT*SessionRecorder.SAMPLE_QUEUE_BACKLOG_LOG_THRESHOLD):
-                        Logger.debug( 'SessionRecorder: commit backlog: {}'.format(insert_counter))
-
-                    if qsize > (SessionRecorder.SAMPLE_QUEUE_MAX_SIZE*SessionRecorder.SAMPLE_QUEUE_BACKLOG_LOG_THRESHOLD):
-                        Logger.debug( 'SessionRecorder: queue backlog: {}'.format(qsize))
+            # record through the datastore's dedicated writer connection
+            with self._datastore.writer():
+                sample_tap = self.sample_tap
+                channel_names = self._channel_names
+                channel_index = None
+                dropped = 0
+                index = 0
+                # will drain the tap before exiting thread
+                while True:
+                    samples = sample_tap.take(SessionRecorder.SAMPLE_QUEUE_UNCOMMITTED_INSERT_LIMIT)
+                    if not samples:
+                        if not self.recording:
+                            break
+                        sleep(SessionRecorder.SAMPLE_TAP_POLL_INTERVAL)
+                        continue
+
+                    rows = [row for tick, row in samples]
+                    if channel_index is not rows[0].channel_index:
+                        channel_index = rows[0].channel_index
+                        same_order = list(channel_index.names) == channel_names
+                    if same_order and all(row.channel_index is channel_index for row in rows):
+                        # rows hold their values in our channel order; store them as they are
+                        values = [row.values for row in rows]
+                    else:
+                        values = [row.select(channel_names) for row in rows]
+                    self._datastore.insert_samples_nocommit(
+                        channel_names, values, self._current_session_id)
+                    self._datastore.commit()
+                    backlog = len(sample_tap)
+
+                    if backlog > 0 and index % SessionRecorder.SAMPLE_QUEUE_BACKLOG_LOG_INTERVAL == 0:
+                        Logger.info('SessionRecorder: tap backlog: {}, batch size: {}, last tick: {}'
+                                    .format(backlog, len(samples), samples[-1][0]))
+
+                    if backlog > (SessionRecorder.SAMPLE_TAP_MAX_SIZE * SessionRecorder.SAMPLE_QUEUE_BACKLOG_LOG_THRESHOLD):
+                        Logger.debug('SessionRecorder: tap backlog: {}'.format(backlog))
+
+                    if sample_tap.dropped != dropped:
+                        Logger.warn('SessionRecorder: dropped {} samples; recording is falling behind'
+                                    .format(sample_tap.dropped - dropped))
+                        dropped = sample_tap.dropped
 
                     index += 1
-                except Empty:
-                    pass
+
+                # pack the recorded session now that it's complete
+                self._datastore.finalize_session(self._current_session_id)
         except Exception as e:
             Logger.error(
                 'SessionRecorder: Exception in session recorder worker ' + str(e))
@@ -281,51 +293,10 @@ class SessionRecorder(EventDispatcher):
             Logger.info(
                 "SessionRecorder: ChannelMeta changed - stop recording")
             self.stop(stop_now=True)
-        self._channels = copy.deepcopy(dict(metas))
+        # keep the DataBus's channel order, so its sample rows can be stored as they are
+        self._channels = OrderedDict([(name, copy.deepcopy(meta)) for name, meta in metas.iteritems()])
         self._check_should_record()
 
-    def _slow_down_send_rate(self):
-            self._sample_send_delay = min( self._sample_send_delay * 1.5,
-                        SessionRecorder.SAMPLE_QUEUE_MAX_SEND_DELAY_MS )
-
-    def _speed_up_send_rate(self):
-        self._sample_send_delay = max( self._sample_send_delay - SessionRecorder.SAMPLE_QUEUE_MIN_SEND_DELAY_MS,
-                SessionRecorder.SAMPLE_QUEUE_MIN_SEND_DELAY_MS )
-
-    def _on_sample(self, sample):
-        """
-        Sample listener for data from RC. Saves data to Datastore if a session is being recorded
-        :param sample:
-        :return:
-        """
-        if not self.recording:
-            return
-
-        # Merging previous sample with new data to desparsify the data
-        self._sample_accumulator.update( sample )
-        qsize = self._sample_queue.qsize()
-        if qsize == 0:
-            self._speed_up_send_rate()
-
-        deltaT_ms = (datetime.utcnow() - self._sample_last_send).microseconds/1000
-        if ((deltaT_ms >= self._sample_send_delay)
-                or (qsize < SessionRecorder.SAMPLE_QUEUE_SLOWING_THRESHOLD)):
-
-            if qsize > SessionRecorder.SAMPLE_QUEUE_SLOWING_THRESHOLD:
-                self._slow_down_send_rate()
-
-            self._sample_last_send = datetime.utcnow()
-
-            try:
-                self._sample_queue.put_nowait(copy.deepcopy(self._sample_accumulator))
-                self._sample_queue_full = False
-
-            except Full:
-                if not self._sample_queue_full:
-                    # latch to prevent the log from filling up with warnings
-                    Logger.warn('SessionRecorder: dropping sample; queue full')
-                self._sample_queue_full = True
-
     def _on_rc_connected(self):
         """
         Event listener for when RC is connected
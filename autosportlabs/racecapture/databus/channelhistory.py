@@ -0,0 +1,181 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ('ChannelHistory', 'HistoryWindow')
+from array import array
+from itertools import chain, islice, izip
+
+
+class ChannelHistory(object):
+    """
+    The recent values of a channel, as (tick, value) pairs in a fixed size ring
+    buffer. Appending is O(1); once full, the oldest values are overwritten.
+    One history is written by the DataBus and shared by any number of readers.
+    """
+
+    def __init__(self, size):
+        """
+        :param size the number of values to keep
+        :type size int
+        """
+        self.size = size
+        self._ticks = array('d', [0]) * size
+        self._values = array('d', [0]) * size
+        # total number of values appended; the next value goes at appended % size
+        self.appended = 0
+
+    def __len__(self):
+        return min(self.appended, self.size)
+
+    def append(self, tick, value):
+        """
+        :param tick the device tick of the value, in milliseconds
+        :type tick int
+        :param value the channel value
+        :type value float
+        """
+        index = self.appended % self.size
+        self._ticks[index] = tick
+        self._values[index] = value
+        self.appended += 1
+
+    def resize(self, size):
+        """
+        Changes the number of values kept, keeping the latest values
+        :param size the number of values to keep
+        :type size int
+        """
+        ticks = array('d', [0]) * size
+        values = array('d', [0]) * size
+        appended = self.appended
+        # values keep their place by append count, so windows of them stay valid
+        for count in range(appended - min(appended, self.size, size), appended):
+            ticks[count % size] = self._ticks[count % self.size]
+            values[count % size] = self._values[count % self.size]
+        self._ticks = ticks
+        self._values = values
+        self.size = size
+
+    def _tick_at(self, first, offset):
+        return self._ticks[(first + offset) % self.size]
+
+    def last(self, count):
+        """
+        :param count the number of values
+        :type count int
+        :return HistoryWindow of the latest values, up to count of them
+        """
+        appended = self.appended
+        count = max(0, min(count, appended, self.size))
+        return HistoryWindow(self, appended - count, appended)
+
+    def last_seconds(self, seconds):
+        """
+        :param seconds the length of the window
+        :type seconds float
+        :return HistoryWindow of the values within seconds of the latest value
+        """
+        appended = self.appended
+        count = min(appended, self.size)
+        if count == 0:
+            return HistoryWindow(self, appended, appended)
+
+        first = (appended - count) % self.size
+        since = self._tick_at(first, count - 1) - seconds * 1000.0
+        # ticks only increase, so the start of the window can be found by bisection
+        low = 0
+        high = count
+        while low < high:
+            middle = (low + high) / 2
+            if self._tick_at(first, middle) < since:
+                low = middle + 1
+            else:
+                high = middle
+        return HistoryWindow(self, appended - count + low, appended)
+
+    def clear(self):
+        self.appended = 0
+
+
+class HistoryWindow(object):
+    """
+    A window of a ChannelHistory. The window refers to the history's arrays rather
+    than copying them, so it should be read promptly: values that the history
+    overwrites after the window is created are not valid, and reading them raises
+    an IndexError.
+    """
+
+    def __init__(self, history, start, end):
+        """
+        :param history the history
+        :type history ChannelHistory
+        :param start the append count of the first value in the window
+        :type start int
+        :param end the append count after the last value in the window
+        :type end int
+        """
+        self._history = history
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def _segments(self, data):
+        """
+        :return the window's values in data as at most two contiguous runs, without copying
+        """
+        history = self._history
+        if history.appended - self.start > history.size:
+            raise IndexError('History window has been overwritten')
+        size = history.size
+        first = self.start % size
+        count = self.end - self.start
+        if first + count <= size:
+            return (islice(data, first, first + count),)
+        return (islice(data, first, size), islice(data, 0, first + count - size))
+
+    def ticks(self):
+        return chain(*self._segments(self._history._ticks))
+
+    def values(self):
+        return chain(*self._segments(self._history._values))
+
+    def __iter__(self):
+        return izip(self.ticks(), self.values())
+
+    def min(self):
+        """
+        :return the lowest value in the window, or None if it is empty
+        """
+        return min(self.values()) if len(self) else None
+
+    def max(self):
+        """
+        :return the highest value in the window, or None if it is empty
+        """
+        return max(self.values()) if len(self) else None
+
+    def mean(self):
+        """
+        :return the mean of the values in the window, or None if it is empty
+        """
+        count = len(self)
+        return sum(self.values()) / count if count else None
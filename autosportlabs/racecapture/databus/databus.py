@@ -18,12 +18,16 @@
 # have received a copy of the GNU General Public License along with
 # this code. If not, see <http://www.gnu.org/licenses/>.
 
-from kivy.clock import Clock
-from time import sleep
+from time import sleep, time
+from array import array
+from collections import deque
 from kivy.logger import Logger
 from threading import Thread, Event, Lock
 from autosportlabs.racecapture.data.channels import ChannelMeta
-from autosportlabs.racecapture.data.sampledata import Sample, SampleMetaException, ChannelMetaCollection
+from autosportlabs.racecapture.data.sampledata import Sample, SampleMetaException, ChannelMetaCollection, \
+    ChannelIndex, SampleRow
+from autosportlabs.racecapture.databus.channelhistory import ChannelHistory
+from autosportlabs.racecapture.databus.updatescheduler import AdaptiveUpdateScheduler
 from autosportlabs.racecapture.databus.filter.bestlapfilter import BestLapFilter
 from autosportlabs.racecapture.databus.filter.laptimedeltafilter import LaptimeDeltaFilter
 from autosportlabs.util.threadutil import safe_thread_exit
@@ -31,23 +35,142 @@ from autosportlabs.racecapture.config.rcpconfig import Capabilities
 from utils import is_mobile_platform
 
 DEFAULT_DATABUS_UPDATE_INTERVAL = 0.02  # 50Hz UI update rate
+# allows for jitter in when the changes to a rate capped channel arrive
+RATE_CAP_TOLERANCE = 0.8
+DEFAULT_CHANNEL_HISTORY_SIZE = 1000
 
 class DataBusFactory(object):
     def create_standard_databus(self, system_channels):
-        databus = DataBus()
+        databus = DataBus(cap_to_sample_rate=True)
         databus.add_data_filter(BestLapFilter(system_channels))
         databus.add_data_filter(LaptimeDeltaFilter(system_channels))
         return databus
 
+class SampleTap(object):
+    """
+    Captures every sample decoded by the DataBusPump, at the device's native rate
+    and on the comms thread, independent of how often the UI notifies listeners.
+
+    Captured SampleRows are handed to a consumer thread through a bounded deque, whose
+    append and popleft are atomic, so neither the comms thread nor the consumer
+    waits on a lock. When the consumer falls behind, the oldest samples are dropped.
+    """
+    DEFAULT_MAX_SIZE = 1000
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        """
+        :param max_size the number of samples to hold before dropping the oldest
+        :type max_size int
+        """
+        self._samples = deque(maxlen=max_size)
+        self.capturing = False
+        self.captured = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._samples)
+
+    def start(self):
+        """
+        Starts capturing samples
+        """
+        self._samples.clear()
+        self.captured = 0
+        self.dropped = 0
+        self.capturing = True
+
+    def stop(self):
+        """
+        Stops capturing samples; samples already captured can still be taken
+        """
+        self.capturing = False
+
+    def capture(self, tick, sample_row):
+        """
+        Captures the current value of the channels. Called on the comms thread.
+        :param tick the device tick of the sample
+        :type tick int
+        :param sample_row the current value of each channel
+        :type sample_row SampleRow
+        """
+        if not self.capturing:
+            return
+        samples = self._samples
+        if len(samples) == samples.maxlen:
+            self.dropped += 1
+        samples.append((tick, sample_row))
+        self.captured += 1
+
+    def take(self, limit):
+        """
+        Takes the oldest captured samples
+        :param limit the most samples to take
+        :type limit int
+        :return list of (tick, SampleRow)
+        """
+        samples = self._samples
+        taken = []
+        try:
+            while len(taken) < limit:
+                taken.append(samples.popleft())
+        except IndexError:
+            pass
+        return taken
+
+
+class DataBusFrame(object):
+    """
+    The channel data published by the DataBus for one update. Frames are not
+    modified once published.
+    """
+    __slots__ = ('seq', 'sample_row', 'changed', 'meta_version')
+
+    def __init__(self, seq, sample_row, changed, meta_version):
+        """
+        :param seq the sequence number of the frame
+        :type seq int
+        :param sample_row the channel values
+        :type sample_row SampleRow
+        :param changed bitmap of the row positions changed since the previous frame
+        :type changed int
+        :param meta_version the version of the channel meta the frame was published with
+        :type meta_version int
+        """
+        self.seq = seq
+        self.sample_row = sample_row
+        self.changed = changed
+        self.meta_version = meta_version
+
+
 class DataBus(object):
     """Central hub for current sample data. Receives data from DataBusPump
-    Also contains the periodic updater for listeners. Updates occur in the UI thread via Clock.schedule_interval
+    Also contains the periodic updater for listeners. Updates occur in the UI thread, scheduled by the update_scheduler
     Architecture:    
     (DATA SOURCE) => DataBus => (LISTENERS)
     
     Typical use:
     (CHANNEL LISTENERS) => DataBus.addChannelListener()  -- listeners receive updates with a particular channel's value
     (META LISTENERS) => DataBus.addMetaListener() -- Listeners receive updates with meta data
+    (SAMPLE LISTENERS) => DataBus.add_sample_listener() -- listeners receive the latest SampleRow, shared between
+    all listeners and not to be modified, whenever a channel changed. The row's changed bitmap has the
+    channels that changed since the previous notification.
+
+    Only channels whose value changed since the previous notification are sent to channel listeners,
+    and no more often than a rate cap set with set_channel_rate_cap(), or, when created with
+    cap_to_sample_rate, than the sample rate in the channel's meta. Changes within a channel's
+    cap are held back for a later notification.
+
+    Listeners are notified at a rate chosen by the update_scheduler, which slows it down when the
+    UI thread can't keep up.
+
+    (HISTORY READERS) => DataBus.get_channel_history() -- a channel's recent values, recorded as they
+    arrive once any reader asks for them and shared between every reader of the channel.
+
+    Updates are handed from the comms thread to the UI thread without sharing the update lock: each
+    update publishes an immutable DataBusFrame and merges its changes into a bitmap of the changes
+    not yet notified, and the UI thread swaps out the latest frame and that bitmap together, under a
+    lock held for no more than the swap. Slow listeners never hold up decoding, and however long the
+    UI thread goes without notifying, no more than the latest frame is kept.
 
     Note: DataBus must be started via start_update before any data flows
     """
@@ -56,27 +179,117 @@ class DataBus(object):
     sample = None
     channel_listeners = {}
     meta_listeners = []
-    meta_updated = False
     data_filters = []
     sample_listeners = []
     _polling = False
     rcp_meta_read = False
 
     def __init__(self, **kwargs):
+        # cap each channel's notifications at the sample rate in its meta
+        self._cap_to_sample_rate = kwargs.pop('cap_to_sample_rate', False)
         super(DataBus, self).__init__(**kwargs)
+        # serializes updates; never taken by notify_listeners
         self.update_lock = Lock()
+        self._new_listener_channels = []
+        self._channel_histories = {}
+        self._history_positions = []
+        self._meta_version = 0
+        self._latest_frame = None
+        # the row positions changed since notify_listeners last took them, guarded by the frame lock
+        self._pending_changed = 0
+        self._frame_lock = Lock()
+        # the meta version of the last frame consumed by notify_listeners
+        self._notified_meta_version = 0
+        self._set_channel_index(ChannelIndex([]))
+        # listener notification counters, for the last frame and in total
+        self.frame_notifications = 0
+        self.frame_notifications_skipped = 0
+        self.notifications = 0
+        self.notifications_skipped = 0
+        self.notifications_deferred = 0
+        # per channel rate caps, in Hz; only used on the UI thread
+        self._rate_caps = {}
+        # rate caps from the channel meta, replaced whenever the meta is updated
+        self._meta_rate_caps = {}
+        self._rate_caps_updated = False
+        self._rate_cap_index = None
+        self._rate_cap_periods = None
+        self._rate_cap_times = None
+        self._deferred_changed = 0
+        self.update_scheduler = AdaptiveUpdateScheduler(self.notify_listeners)
+
+    def _set_channel_index(self, channel_index):
+        """
+        Sets the channel positions of the sample rows, clearing the current values
+        """
+        filter_channels = set()
+        for f in self.data_filters:
+            filter_channels.update(f.get_channel_meta(self.channel_metas).keys())
+        positions = channel_index.positions
+        self._filter_positions = [(positions[name], name) for name in filter_channels if name in positions]
+        self._channel_index = channel_index
+        self._row_map = None
+        self._row_values = array('d', [float('nan')]) * len(channel_index)
+        self._row_present = 0
+        self._update_history_positions()
+        # changes not yet notified are to positions of the previous channel index
+        self._publish(SampleRow(channel_index, array('d', self._row_values), 0), 0, reset=True)
+
+    def _publish(self, sample_row, changed, reset=False):
+        """
+        Publishes a frame for the UI thread; called with the update lock held
+        :param reset True to drop the changes not yet notified, rather than add to them
+        :type reset bool
+        """
+        self.sample_row = sample_row
+        latest = self._latest_frame
+        seq = latest.seq + 1 if latest is not None else 1
+        frame = DataBusFrame(seq, sample_row, changed, self._meta_version)
+        with self._frame_lock:
+            self._pending_changed = changed if reset else self._pending_changed | changed
+            self._latest_frame = frame
 
     def start_update(self, interval=DEFAULT_DATABUS_UPDATE_INTERVAL):
+        """
+        Starts notifying listeners
+        :param interval the initial update interval, adapted to the load from then on
+        :type interval float
+        """
         if self._polling:
             return
 
-        Clock.schedule_interval(self.notify_listeners, interval)
+        self.update_scheduler.start(interval)
         self._polling = True
 
     def stop_update(self):
-        Clock.unschedule(self.notify_listeners)
+        self.update_scheduler.stop()
         self._polling = False
 
+    def set_channel_rate_cap(self, channel, rate):
+        """
+        Limits how often a channel's listeners are notified; called on the UI thread
+        :param channel the channel name
+        :type channel string
+        :param rate the highest notification rate in Hz, or None to remove the cap
+        :type rate float
+        """
+        if rate is None:
+            self._rate_caps.pop(channel, None)
+        else:
+            self._rate_caps[channel] = rate
+        self._rate_caps_updated = True
+
+    @property
+    def rate_capped_channels(self):
+        """
+        :return the number of channels with a rate cap below the current update rate
+        """
+        periods = self._rate_cap_periods
+        if periods is None:
+            return 0
+        interval = self.update_scheduler.interval
+        return sum(1 for period in periods if period > interval)
+
     def _update_datafilter_meta(self, datafilter):
         channel_metas = self.channel_metas
         metas = datafilter.get_channel_meta(channel_metas)
@@ -92,21 +305,27 @@ class DataBus(object):
             self.update_lock.acquire()
             # update channel metadata
             cd = self.channel_data
-            cm = self.channel_metas
             # clear our list of channel data values, in case channels
             # were removed on this metadata update
             cd.clear()
 
-            # clear and reload our channel metas
-            cm.clear()
+            # load new channel metas, replacing rather than modifying the current
+            # ones as listeners on the UI thread may be reading them
+            cm = {}
             for meta in metas.channel_metas:
                 cm[meta.name] = meta
+            self.channel_metas = cm
 
             # add channel meta for existing filters
             for f in self.data_filters:
                 self._update_datafilter_meta(f)
 
-            self.meta_updated = True
+            if self._cap_to_sample_rate:
+                self._meta_rate_caps = dict((meta.name, meta.sampleRate) for meta in metas.channel_metas if meta.sampleRate > 0)
+                self._rate_caps_updated = True
+
+            self._meta_version += 1
+            self._set_channel_index(ChannelIndex(cm.keys()))
             self.rcp_meta_read = True
         finally:
             self.update_lock.release()
@@ -114,46 +333,242 @@ class DataBus(object):
     def addSampleListener(self, callback):
         self.sample_listeners.append(callback)
 
-    def update_samples(self, sample):
+    def update_samples(self, sample, sample_taps=()):
         """Update channel data with new samples
+        :param sample the decoded sample
+        :type sample Sample
+        :param sample_taps taps capturing the updated channel data
+        :type sample_taps list of SampleTap
         """
         try:
             self.update_lock.acquire()
             cd = self.channel_data
-            for sample_item in sample.samples:
-                channel = sample_item.channelMeta.name
-                value = sample_item.value
-                cd[channel] = value
+            positions = self._channel_index.positions
+            values = self._row_values
+            present = self._row_present
+            changed = 0
+            # channels in this sample, whether or not their values changed
+            updated = 0
+            decoder = sample.decoder
+            if decoder is not None:
+                # decoded straight into an array; copy the values present to their row positions
+                row_map = self._get_row_map(decoder)
+                sample_values = sample.values
+                for sample_position in sample.positions:
+                    channel, position, bit = row_map[sample_position]
+                    value = sample_values[sample_position]
+                    cd[channel] = value
+                    if values[position] != value:
+                        values[position] = value
+                        changed |= bit
+                    updated |= bit
+            else:
+                for sample_item in sample.samples:
+                    channel = sample_item.channelMeta.name
+                    value = sample_item.value
+                    cd[channel] = value
+                    position = positions.get(channel)
+                    if position is None:
+                        # a channel missing from the meta; give it a position of its own
+                        position = self._add_row_channel(channel)
+                        positions = self._channel_index.positions
+                    if values[position] != value:
+                        values[position] = value
+                        changed |= 1 << position
+                    updated |= 1 << position
 
             # apply filters to updated data
             for f in self.data_filters:
                 f.filter(cd)
+
+            for position, channel in self._filter_positions:
+                value = cd.get(channel)
+                if value is not None:
+                    if values[position] != value:
+                        values[position] = value
+                        changed |= 1 << position
+                    updated |= 1 << position
+
+            present |= updated
+            if self._history_positions:
+                tick = sample.tick
+                for position, history in self._history_positions:
+                    if updated >> position & 1:
+                        history.append(tick, values[position])
+
+            # publish an immutable copy of the row, shared by every consumer
+            self._row_present = present
+            sample_row = SampleRow(self._channel_index, array('d', values), present)
+            self._publish(sample_row, changed)
+
+            for tap in sample_taps:
+                tap.capture(sample.tick, sample_row)
         finally:
             self.update_lock.release()
 
-    def notify_listeners(self, dt):
-
-        try:
-            self.update_lock.acquire()
-            if self.meta_updated:
-                cm = self.channel_metas
-                self.notify_meta_listeners(cm)
-                self.meta_updated = False
-
-            cd = self.channel_data
-            for channel, value in cd.iteritems():
-                self.notify_channel_listeners(channel, value)
+    def _get_row_map(self, decoder):
+        """
+        Maps the positions of a decoder's channels to their row positions
+        :return list of (channel name, row position, row presence bit) by decoder position
+        """
+        row_map = self._row_map
+        if row_map is None or self._row_map_key != (decoder, self._channel_index):
+            row_map = []
+            for channel in decoder.names:
+                position = self._channel_index.positions.get(channel)
+                if position is None:
+                    position = self._add_row_channel(channel)
+                row_map.append((channel, position, 1 << position))
+            self._row_map = row_map
+            self._row_map_key = (decoder, self._channel_index)
+        return row_map
+
+    def _add_row_channel(self, channel):
+        channel_index = self._channel_index.extend([channel])
+        self._channel_index = channel_index
+        self._row_values.append(float('nan'))
+        self._update_history_positions()
+        return channel_index.positions[channel]
+
+    def _update_history_positions(self):
+        positions = self._channel_index.positions
+        self._history_positions = [(positions[channel], history) for channel, history in self._channel_histories.iteritems()
+                                   if channel in positions]
+
+    def get_channel_history(self, channel, size=DEFAULT_CHANNEL_HISTORY_SIZE):
+        """
+        Gets the history of a channel's recent values, which is recorded from when it is first requested.
+        Readers of a channel share its history, which keeps the most values any of them asked for.
+        :param channel the channel name
+        :type channel string
+        :param size the number of values to keep
+        :type size int
+        :return ChannelHistory
+        """
+        with self.update_lock:
+            history = self._channel_histories.get(channel)
+            if history is None:
+                history = ChannelHistory(size)
+                self._channel_histories[channel] = history
+                self._update_history_positions()
+            elif history.size < size:
+                history.resize(size)
+            return history
 
+    def notify_listeners(self, dt):
+        """
+        Notifies listeners of the latest frame; called on the UI thread
+        """
+        # take the latest frame and the changes of every frame published since the last notification
+        with self._frame_lock:
+            frame = self._latest_frame
+            changed = self._pending_changed
+            self._pending_changed = 0
+
+        if frame.meta_version != self._notified_meta_version:
+            self._notified_meta_version = frame.meta_version
+            self.notify_meta_listeners(self.channel_metas)
+
+        sample_row = frame.sample_row
+        if self._new_listener_channels:
+            new_listener_channels = self._new_listener_channels
+            self._new_listener_channels = []
+            positions = sample_row.channel_index.positions
+            for channel in new_listener_channels:
+                position = positions.get(channel)
+                if position is not None:
+                    changed |= 1 << position
+        changed &= sample_row.present
+        if (self._rate_caps or self._meta_rate_caps) and (changed or self._deferred_changed):
+            changed = self._apply_rate_caps(sample_row.channel_index, changed)
+
+        # a view of the latest row with the channels changed since the last notification
+        delta = SampleRow(sample_row.channel_index, sample_row.values, sample_row.present, changed)
+        notified = 0
+        for channel, value in delta.iterchanged():
+            notified += self.notify_channel_listeners(channel, value)
+
+        available = 0
+        for channel, listeners in self.channel_listeners.iteritems():
+            if channel in sample_row:
+                available += len(listeners)
+        self.frame_notifications = notified
+        self.frame_notifications_skipped = max(0, available - notified)
+        self.notifications += notified
+        self.notifications_skipped += self.frame_notifications_skipped
+
+        if changed:
             for listener in self.sample_listeners:
-                listener(cd)
-        finally:
-            self.update_lock.release()
+                listener(delta)
+
+    def _apply_rate_caps(self, channel_index, changed):
+        """
+        Holds back changes to channels notified more recently than their rate cap allows
+        :return the changed channels to notify now
+        """
+        if self._rate_cap_index is not channel_index or self._rate_caps_updated:
+            self._update_rate_caps(channel_index)
+        periods = self._rate_cap_periods
+        times = self._rate_cap_times
+        now = time()
+        changed |= self._deferred_changed
+        deferred = 0
+        remaining = changed
+        while remaining:
+            bit = remaining & -remaining
+            remaining ^= bit
+            position = bit.bit_length() - 1
+            period = periods[position]
+            if period:
+                if now < times[position]:
+                    deferred |= bit
+                else:
+                    times[position] = now + period
+        self._deferred_changed = deferred
+        self.notifications_deferred += bin(deferred).count('1')
+        return changed & ~deferred
+
+    def _update_rate_caps(self, channel_index):
+        periods = array('d', [0]) * len(channel_index)
+        positions = channel_index.positions
+        # caps set with set_channel_rate_cap() take the place of those from the meta
+        rate_caps = dict(self._meta_rate_caps)
+        rate_caps.update(self._rate_caps)
+        for name, rate in rate_caps.iteritems():
+            position = positions.get(name)
+            if position is not None:
+                periods[position] = RATE_CAP_TOLERANCE / rate
+        self._rate_cap_periods = periods
+        self._rate_cap_times = array('d', [0]) * len(channel_index)
+        # changes held back were for positions in the previous channel index
+        previous = self._rate_cap_index
+        if previous is not None and channel_index.names[:len(previous.names)] != previous.names:
+            self._deferred_changed = 0
+        self._rate_cap_index = channel_index
+        self._rate_caps_updated = False
 
     def notify_channel_listeners(self, channel, value):
+        """
+        :return the number of listeners notified
+        """
         listeners = self.channel_listeners.get(str(channel))
         if listeners:
             for listener in listeners:
                 listener(value)
+            return len(listeners)
+        return 0
+
+    @property
+    def notify_stats(self):
+        """
+        Channel listener notifications made and skipped because the channel didn't change
+        :return dict of the counts for the last frame and in total
+        """
+        return {'frame_notifications': self.frame_notifications,
+                'frame_skipped': self.frame_notifications_skipped,
+                'deferred': self.notifications_deferred,
+                'notifications': self.notifications,
+                'skipped': self.notifications_skipped}
 
     def notify_meta_listeners(self, channelMeta):
         for listener in self.meta_listeners:
@@ -167,6 +582,9 @@ class DataBus(object):
         else:
             listeners.append(callback)
 
+        # send the new listener the current value on the next notification
+        self._new_listener_channels.append(channel)
+
     def removeChannelListener(self, channel, callback):
         try:
             listeners = self.channel_listeners.get(channel)
@@ -204,8 +622,10 @@ class DataBus(object):
         self.meta_listeners.append(callback)
 
     def add_data_filter(self, datafilter):
-        self.data_filters.append(datafilter)
-        self._update_datafilter_meta(datafilter)
+        with self.update_lock:
+            self.data_filters.append(datafilter)
+            self._update_datafilter_meta(datafilter)
+            self._set_channel_index(ChannelIndex(self.channel_metas.keys()))
 
     def getMeta(self):
         return self.channel_metas
@@ -248,6 +668,20 @@ class DataBusPump(object):
         self._auto_streaming_supported = False
         self._current_view = None
         self._is_recording = False
+        self._sample_taps = []
+
+    def add_sample_tap(self, sample_tap):
+        """
+        Adds a tap capturing every sample as it is received
+        :param sample_tap the tap
+        :type sample_tap SampleTap
+        """
+        if sample_tap not in self._sample_taps:
+            # replace rather than modify the list, as the comms thread iterates it
+            self._sample_taps = self._sample_taps + [sample_tap]
+
+    def remove_sample_tap(self, sample_tap):
+        self._sample_taps = [tap for tap in self._sample_taps if tap is not sample_tap]
 
     @property
     def is_telemetry_active(self):
@@ -296,6 +730,8 @@ class DataBusPump(object):
         self._data_bus = data_bus
         self._session_recorder = session_recorder
         session_recorder.bind(on_recording=self._on_session_recording)
+        # record every sample, rather than only those the UI gets to see
+        self.add_sample_tap(session_recorder.sample_tap)
         rc_api.addListener('s', self.on_sample)
         rc_api.addListener('meta', self.on_meta)
         rc_api.add_connect_listener(self.on_connect)
@@ -393,7 +829,7 @@ class DataBusPump(object):
             sample.fromJson(sample_json)
             if sample.updated_meta:
                 dataBus.update_channel_meta(sample.metas)
-            dataBus.update_samples(sample)
+            dataBus.update_samples(sample, self._sample_taps)
             self._sample_event.set()
         except SampleMetaException:
             # this is to prevent repeated sample meta requests
@@ -0,0 +1,154 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ('AdaptiveUpdateScheduler',)
+import time
+from kivy.clock import Clock
+from kivy.logger import Logger
+
+DEFAULT_MIN_RATE = 10
+DEFAULT_MAX_RATE = 50
+# the share of the UI thread's time that updates, and the frames drawing them, may take
+DEFAULT_LOAD_TARGET = 0.5
+# weight of the latest pass in the smoothed timings
+SMOOTHING = 0.2
+# how quickly the rate recovers once the load drops; it backs off at once
+RECOVERY = 0.1
+
+LIMIT_MAX_RATE = 'max rate'
+LIMIT_MIN_RATE = 'min rate'
+LIMIT_LOAD = 'load'
+
+
+class AdaptiveUpdateScheduler(object):
+    """
+    Runs an update callback on the UI thread at a rate that adapts to the load.
+
+    Each pass measures how long the callback takes, and how late the pass ran
+    compared to when it was scheduled - the time the UI thread spent drawing the
+    frames that followed the previous pass. The interval is set so that both
+    together take no more than the load target, between the rate bounds: the rate
+    drops at once when the UI thread falls behind and recovers gradually.
+    """
+
+    def __init__(self, callback, min_rate=DEFAULT_MIN_RATE, max_rate=DEFAULT_MAX_RATE, load_target=DEFAULT_LOAD_TARGET):
+        """
+        :param callback the update, called with the time since it was scheduled
+        :type callback function
+        :param min_rate the lowest update rate, in Hz
+        :type min_rate float
+        :param max_rate the highest update rate, in Hz
+        :type max_rate float
+        :param load_target the share of the UI thread's time updates may take
+        :type load_target float
+        """
+        self._callback = callback
+        self.load_target = load_target
+        self.interval = 1.0 / max_rate
+        self.set_rate_bounds(min_rate, max_rate)
+        self.update_time = 0.0
+        self.frame_lag = 0.0
+        self.limited_by = LIMIT_MAX_RATE
+        self.running = False
+
+    def set_rate_bounds(self, min_rate, max_rate):
+        """
+        :param min_rate the lowest update rate, in Hz
+        :type min_rate float
+        :param max_rate the highest update rate, in Hz
+        :type max_rate float
+        """
+        if min_rate <= 0 or max_rate < min_rate:
+            raise ValueError('Invalid update rate bounds {} - {}'.format(min_rate, max_rate))
+        self.min_interval = 1.0 / max_rate
+        self.max_interval = 1.0 / min_rate
+        self.interval = min(max(self.interval, self.min_interval), self.max_interval)
+
+    @property
+    def rate(self):
+        return 1.0 / self.interval
+
+    @property
+    def stats(self):
+        """
+        :return dict of the current rate and the timings it was chosen from
+        """
+        return {'rate': self.rate,
+                'update_ms': self.update_time * 1000.0,
+                'frame_lag_ms': self.frame_lag * 1000.0,
+                'limited_by': self.limited_by}
+
+    def start(self, interval=None):
+        """
+        :param interval the initial interval, in seconds; defaults to the highest rate
+        :type interval float
+        """
+        if self.running:
+            return
+        self.interval = min(max(interval or self.min_interval, self.min_interval), self.max_interval)
+        self.running = True
+        Clock.schedule_once(self._on_update, self.interval)
+
+    def stop(self):
+        self.running = False
+        Clock.unschedule(self._on_update)
+
+    def _on_update(self, dt):
+        lag = max(0.0, dt - self.interval) if dt is not None else 0.0
+        start = time.time()
+        try:
+            self._callback(dt)
+        finally:
+            self.adapt(time.time() - start, lag)
+            if self.running:
+                Clock.schedule_once(self._on_update, self.interval)
+
+    def adapt(self, update_time, frame_lag):
+        """
+        Adapts the interval to the timings of a pass
+        :param update_time how long the update took, in seconds
+        :type update_time float
+        :param frame_lag how late the update ran, in seconds
+        :type frame_lag float
+        """
+        self.update_time += (update_time - self.update_time) * SMOOTHING
+        self.frame_lag += (frame_lag - self.frame_lag) * SMOOTHING
+        target = (self.update_time + self.frame_lag) / self.load_target
+
+        interval = self.interval
+        if target > interval:
+            interval = target
+        else:
+            interval += (target - interval) * RECOVERY
+
+        if interval <= self.min_interval:
+            interval = self.min_interval
+            limited_by = LIMIT_MAX_RATE
+        elif interval >= self.max_interval:
+            interval = self.max_interval
+            limited_by = LIMIT_MIN_RATE
+        else:
+            limited_by = LIMIT_LOAD
+
+        if limited_by != self.limited_by:
+            Logger.info('AdaptiveUpdateScheduler: update rate {:.1f}Hz, limited by {} (update {:.1f}ms, frame lag {:.1f}ms)'.format(
+                1.0 / interval, limited_by, self.update_time * 1000.0, self.frame_lag * 1000.0))
+        self.limited_by = limited_by
+        self.interval = interval
@@ -19,3 +19,4 @@
 # this code. If not, see <http://www.gnu.org/licenses/>.
 
 from datastore import *
+from queryexecutor import *
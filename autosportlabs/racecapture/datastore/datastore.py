@@ -19,6 +19,12 @@
 # this code. If not, see <http://www.gnu.org/licenses/>.
 
 import sqlite3
+import array
+import sys
+import threading
+import zlib
+from bisect import bisect_left, bisect_right
+from itertools import chain, compress, izip
 from sqlalchemy import create_engine, MetaData, Table, Column, Integer, Text
 from sqlturk.migration import MigrationTool
 import logging
@@ -28,6 +34,9 @@ import time
 import datetime
 from kivy.logger import Logger
 from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from Queue import Queue, Empty
 
 
 class InvalidChannelException(Exception):
@@ -141,6 +150,324 @@ def _scrub_sql_value(value):
     return '"{}"'.format(sql_name)
 
 
+def _forward_fill(column, last_value):
+    """
+    Replaces the gaps (None) in a column of datapoints with the most recent value
+    :param column the column of datapoints
+    :type column sequence
+    :param last_value the value preceding the column, used to fill any leading gap
+    :return tuple of the filled column and the last value in it
+    """
+    if None not in column:
+        return column, column[-1]
+
+    filled = []
+    append = filled.append
+    for value in column:
+        if value is None:
+            value = last_value
+        else:
+            last_value = value
+        append(value)
+    return filled, last_value
+
+
+# Marks a gap (NULL) in a packed column of channel values
+_GAP = float('nan')
+
+
+def _column_to_bytes(column):
+    """
+    Serializes an array of values in little-endian byte order
+    :param column the values
+    :type column array.array
+    :return String
+    """
+    if sys.byteorder != 'little':
+        column = array.array(column.typecode, column)
+        column.byteswap()
+    return column.tostring()
+
+
+def _column_from_bytes(raw, typecode='d'):
+    """
+    Deserializes little-endian bytes into an array of values
+    :param raw the serialized values
+    :type raw String
+    :param typecode the array type code of the values
+    :type typecode String
+    :return array.array
+    """
+    column = array.array(typecode)
+    column.fromstring(raw)
+    if sys.byteorder != 'little':
+        column.byteswap()
+    return column
+
+
+def _has_gaps(column):
+    """
+    Indicates if an array of channel values contains any gaps
+    :param column the values
+    :type column array.array
+    :return True if any value is a gap
+    """
+    gap = array.array(column.typecode, [_GAP]).tostring()
+    raw = column.tostring()
+    index = raw.find(gap)
+    while index >= 0:
+        # Only a match aligned to a value counts
+        if index % column.itemsize == 0:
+            return True
+        index = raw.find(gap, index + 1)
+    return False
+
+
+def _gaps_to_none(column):
+    """
+    Replaces the gaps in an array of channel values with None, matching how
+    NULL values are returned from row storage
+    :param column the values
+    :type column array.array
+    :return the array if there are no gaps, otherwise a list
+    """
+    if not _has_gaps(column):
+        return column
+    return [None if value != value else value for value in column]
+
+
+def _slice_sample_ranges(sample_ids, columns, sample_ranges):
+    """
+    Selects the samples within ranges of sample ids
+    :param sample_ids the ascending sample ids of the columns
+    :type sample_ids array
+    :param columns dict of channel name to values
+    :type columns dict
+    :param sample_ranges list of (first sample id, last sample id) tuples
+    :type sample_ranges list
+    :return tuple of the selected sample ids and a dict of channel name to the selected values
+    """
+    slices = []
+    for first_sample_id, last_sample_id in sample_ranges:
+        start = bisect_left(sample_ids, first_sample_id)
+        end = bisect_right(sample_ids, last_sample_id)
+        if end > start:
+            slices.append((start, end))
+
+    if len(slices) == 1:
+        start, end = slices[0]
+        return sample_ids[start:end], dict((name, column[start:end]) for name, column in columns.iteritems())
+
+    selected_ids = sample_ids[0:0]
+    selected = dict((name, column[0:0]) for name, column in columns.iteritems())
+    for start, end in slices:
+        selected_ids.extend(sample_ids[start:end])
+        for name, column in columns.iteritems():
+            selected[name].extend(column[start:end])
+    return selected_ids, selected
+
+
+class ColumnPacker(object):
+    """
+    Packs channel values into compressed column blobs a chunk at a time, so a
+    session never has to be held in memory uncompressed.
+    """
+    # A small zlib window keeps memory use down with many channels, and is
+    # enough to catch the runs of repeated values found in datalogs
+    COMPRESSION_LEVEL = 6
+    COMPRESSION_WINDOW_BITS = 12
+    COMPRESSION_MEM_LEVEL = 5
+
+    def __init__(self, channel_names, fill_leading=False):
+        """
+        :param channel_names the channels to pack, in the order columns are added
+        :type channel_names list
+        :param fill_leading True to fill the gap before a channel's first value with that value
+        :type fill_leading bool
+        """
+        self.channel_names = channel_names
+        self.sample_count = 0
+        self._started = [not fill_leading] * len(channel_names)
+        self._leading = [0] * len(channel_names)
+        self._compressors = [self._create_compressor() for name in channel_names]
+        self._blobs = [[] for name in channel_names]
+        self._id_compressor = self._create_compressor()
+        self._id_blob = []
+
+    def _create_compressor(self):
+        return zlib.compressobj(ColumnPacker.COMPRESSION_LEVEL,
+                                zlib.DEFLATED,
+                                ColumnPacker.COMPRESSION_WINDOW_BITS,
+                                ColumnPacker.COMPRESSION_MEM_LEVEL)
+
+    def _write(self, index, column):
+        self._blobs[index].append(self._compressors[index].compress(_column_to_bytes(column)))
+
+    def add_columns(self, sample_ids, columns):
+        """
+        Adds a chunk of samples
+        :param sample_ids the sample ids of the chunk
+        :type sample_ids sequence of int
+        :param columns one sequence of values per channel; None or NaN marks a gap
+        :type columns list
+        """
+        if len(columns) != len(self.channel_names):
+            raise DatastoreException('Expected {} channels, got {}'.format(len(self.channel_names), len(columns)))
+
+        for index, column in enumerate(columns):
+            if None in column:
+                column = [_GAP if value is None else value for value in column]
+
+            if not self._started[index]:
+                first = next((i for i, value in enumerate(column) if value == value), None)
+                if first is None:
+                    self._leading[index] += len(column)
+                    continue
+                self._write(index, array.array('d', [column[first]]) * (self._leading[index] + first))
+                column = column[first:]
+                self._started[index] = True
+
+            self._write(index, array.array('d', column))
+
+        self._id_blob.append(self._id_compressor.compress(_column_to_bytes(array.array('i', sample_ids))))
+        self.sample_count += len(sample_ids)
+
+    def finish(self):
+        """
+        Completes packing
+        :return tuple of the sample id blob and a dict of channel name to column blob
+        """
+        channel_blobs = {}
+        for index, name in enumerate(self.channel_names):
+            if not self._started[index]:
+                # The channel never reported a value
+                self._write(index, array.array('d', [_GAP]) * self._leading[index])
+            self._blobs[index].append(self._compressors[index].flush())
+            channel_blobs[name] = ''.join(self._blobs[index])
+
+        self._id_blob.append(self._id_compressor.flush())
+        return ''.join(self._id_blob), channel_blobs
+
+
+class LapIndexer(object):
+    """
+    Builds the lap index of a session as its samples are stored. A lap is the
+    run of samples with the same CurrentLap, and its lap time is the LapTime
+    reported when LapCount reaches the lap.
+    """
+    LAP_CHANNELS = ['CurrentLap', 'LapCount', 'LapTime', 'Interval', 'Distance']
+
+    def __init__(self, channel_names):
+        """
+        :param channel_names the session's channels, in the order columns are added
+        :type channel_names list
+        """
+        self._positions = [channel_names.index(name) if name in channel_names else None
+                           for name in LapIndexer.LAP_CHANNELS]
+        # Laps can only be told apart if both lap channels are logged
+        self.enabled = self._positions[0] is not None and self._positions[1] is not None
+        self.completed = []
+        self._lap = None
+        self._lap_count = None
+        self._lap_times = {}
+        self._first_sample_id = None
+        self._last_sample_id = None
+        self._start_interval = None
+        self._end_interval = None
+        self._start_distance = None
+        self._end_distance = None
+
+    def _column(self, columns, position, count):
+        return columns[position] if position is not None else [None] * count
+
+    def add_columns(self, sample_ids, columns):
+        """
+        Adds a chunk of samples
+        :param sample_ids the sample ids of the chunk
+        :type sample_ids sequence of int
+        :param columns one sequence of values per channel; None or NaN marks a gap
+        :type columns list
+        """
+        if not self.enabled:
+            return
+        count = len(sample_ids)
+        lap_columns = [self._column(columns, position, count) for position in self._positions]
+        for sample_id, current_lap, lap_count, lap_time, interval, distance in izip(sample_ids, *lap_columns):
+            self.add(sample_id, current_lap, lap_count, lap_time, interval, distance)
+
+    def add_sample(self, sample_id, sample):
+        """
+        Adds a sample
+        :param sample_id the id of the sample
+        :type sample_id int
+        :param sample the sample values by channel name
+        :type sample dict
+        """
+        if not self.enabled:
+            return
+        self.add(sample_id, *[sample.get(name) for name in LapIndexer.LAP_CHANNELS])
+
+    def add(self, sample_id, current_lap, lap_count, lap_time, interval, distance):
+        if self._first_sample_id is None:
+            self._first_sample_id = sample_id
+            self._start_interval = interval
+            self._start_distance = distance
+
+        if lap_count is not None and lap_count == lap_count and lap_count != self._lap_count:
+            self._lap_count = lap_count
+            if lap_count > 0 and lap_time is not None and lap_time == lap_time:
+                self._lap_times.setdefault(int(lap_count), lap_time)
+
+        if current_lap is not None and current_lap == current_lap:
+            current_lap = int(current_lap)
+            if self._lap is None:
+                # Samples before the first lap value belong to that lap
+                self._lap = current_lap
+            elif current_lap != self._lap:
+                self._complete_lap()
+                self._lap = current_lap
+                self._first_sample_id = sample_id
+                self._start_interval = interval
+                self._start_distance = distance
+
+        self._last_sample_id = sample_id
+        self._end_interval = interval
+        self._end_distance = distance
+
+    def _complete_lap(self):
+        def known(value):
+            return None if value is None or value != value else value
+
+        self.completed.append((self._lap,
+                               self._first_sample_id,
+                               self._last_sample_id,
+                               self._lap_times.pop(self._lap, None),
+                               known(self._start_interval),
+                               known(self._end_interval),
+                               known(self._start_distance),
+                               known(self._end_distance)))
+
+    def take_completed(self):
+        """
+        Returns the laps completed since the last call
+        :return list of (lap, first sample id, last sample id, lap time, start interval,
+        end interval, start distance, end distance)
+        """
+        completed = self.completed
+        self.completed = []
+        return completed
+
+    def finish(self):
+        """
+        Completes the lap in progress
+        :return list of laps completed since the last call to take_completed()
+        """
+        if self._lap is not None:
+            self._complete_lap()
+            self._lap = None
+        return self.take_completed()
+
+
 class DataSet(object):
 
     def __init__(self, cursor, smoothing_map=None):
@@ -151,6 +478,15 @@ class DataSet(object):
     def channels(self):
         return [x[0] for x in self._cur.description]
 
+    def _smooth(self, channel, chan_dataset):
+        # If we received a smoothing map and the smoothing rate of
+        # the selected channel is > 1, smooth it out before
+        # returning it to the user
+        if self._smoothing_map and self._smoothing_map[channel] > 1:
+            chan_dataset = _smooth_dataset(
+                chan_dataset, self._smoothing_map[channel])
+        return chan_dataset
+
     def fetch_columns(self, count=None):
         chanmap = {}
         channels = [x[0] for x in self._cur.description]
@@ -162,14 +498,7 @@ class DataSet(object):
         for c in channels:
             idx = channels.index(c)
             chan_dataset = [x[idx] for x in dset]
-
-            # If we received a smoothing map and the smoothing rate of
-            # the selected channel is > 1, smooth it out before
-            # returning it to the user
-            if self._smoothing_map and self._smoothing_map[c] > 1:
-                chan_dataset = _smooth_dataset(
-                    chan_dataset, self._smoothing_map[c])
-            chanmap[c] = chan_dataset
+            chanmap[c] = self._smooth(c, chan_dataset)
 
         return chanmap
 
@@ -185,6 +514,33 @@ class DataSet(object):
         return zip(*zlist)
 
 
+class ColumnDataSet(DataSet):
+    """
+    A DataSet over columns decoded from columnar session storage
+    """
+
+    def __init__(self, channels, columns, smoothing_map=None):
+        super(ColumnDataSet, self).__init__(None, smoothing_map)
+        self._channels = channels
+        self._columns = columns
+        self._offset = 0
+
+    @property
+    def channels(self):
+        return self._channels[:]
+
+    def fetch_columns(self, count=None):
+        chanmap = {}
+        start = self._offset
+        end = len(self._columns[self._channels[0]]) if count is None else start + count
+
+        for c in self._channels:
+            chanmap[c] = self._smooth(c, self._columns[c][start:end])
+
+        self._offset = end
+        return chanmap
+
+
 class Session(object):
 
     def __init__(self, session_id, name, notes='', date=None):
@@ -206,10 +562,22 @@ class Lap(object):
 
 class Filter(object):
 
+    # Comparisons used when evaluating a filter against columns of values.
+    # A gap (NaN) never matches, as with NULL in SQL
+    _COLUMN_COMPARISONS = {
+        'neq': lambda column, val: [v != val and v == v for v in column],
+        'eq': lambda column, val: [v == val for v in column],
+        'lt': lambda column, val: [v < val for v in column],
+        'gt': lambda column, val: [v > val for v in column],
+        'lteq': lambda column, val: [v <= val for v in column],
+        'gteq': lambda column, val: [v >= val for v in column]
+    }
+
     def __init__(self):
         self._cmd_seq = ''
         self._comb_op = 'AND '
         self._channels = []
+        self._terms = []
         self.params = []
 
     @property
@@ -217,14 +585,19 @@ class Filter(object):
         return self._channels[:]
 
     def add_combop(f):
+        @wraps(f)
         def wrap(self, *args, **kwargs):
+            comb_op = None
             if len(self._cmd_seq):
                 self._cmd_seq += self._comb_op
+                comb_op = self._comb_op
             ret = f(self, *args, **kwargs)
+            self._terms.append((comb_op, f.__name__, args))
             return ret
         return wrap
 
     def chan_adj(f):
+        @wraps(f)
         def wrap(self, chan, val):
             self._channels.append(chan)
             prefix = 'datapoint.'
@@ -290,8 +663,41 @@ class Filter(object):
     def group(self, filterchain):
         self._cmd_seq += '({})'.format(str(filterchain).strip())
         self.params = self.params + filterchain.params
+        self._channels += filterchain.channels
         return self
 
+    def evaluate(self, columns, count):
+        """
+        Evaluates the filter against columns of channel values, with AND
+        taking precedence over OR as it does in SQL
+        :param columns dict of channel name to values
+        :type columns dict
+        :param count the number of samples in the columns
+        :type count int
+        :return list of booleans, True for each sample matching the filter
+        """
+        groups = []
+        for comb_op, name, args in self._terms:
+            if name == 'group':
+                matches = args[0].evaluate(columns, count)
+            else:
+                chan, val = args
+                column = columns.get(chan)
+                matches = [False] * count if column is None else Filter._COLUMN_COMPARISONS[name](column, val)
+
+            if comb_op == 'AND ' and len(groups):
+                groups[-1] = [a and b for a, b in izip(groups[-1], matches)]
+            else:
+                groups.append(matches)
+
+        if not len(groups):
+            return [True] * count
+
+        result = groups[0]
+        for matches in groups[1:]:
+            result = [a or b for a, b in izip(result, matches)]
+        return result
+
 
 class DatalogChannel(object):
 
@@ -318,18 +724,76 @@ class DataStore(object):
     # Channels to index on, WARNING: only [A-z] channel names with no spaces
     # will work currently
     EXTRA_INDEX_CHANNELS = ["CurrentLap"]
+
+    # Approximate number of bytes of a datalog parsed and inserted at a time
+    # when importing
+    IMPORT_CHUNK_BYTES = 256 * 1024
+
+    # Number of samples read at a time when loading or packing columns
+    COLUMN_FETCH_SIZE = 2000
+
+    # Seconds a reader connection waits for the database to be unlocked
+    READER_TIMEOUT = 30
+
+    # Seconds the writer connection waits for the database to be unlocked
+    WRITER_TIMEOUT = 30
+
+    # Number of reader connections kept open in WAL mode
+    READER_POOL_SIZE = 2
+
+    # Page cache of each connection in WAL mode, in KB
+    WAL_CACHE_SIZE_KB = 8192
+
     val_filters = ['lt', 'gt', 'eq', 'lt_eq', 'gt_eq']
 
-    def __init__(self, databus=None):
+    def __init__(self, databus=None, columnar=False, wal=False):
+        """
+        :param databus the DataBus for the app
+        :type databus DataBus
+        :param columnar True to store sessions as compressed per-channel columns instead of
+        rows in the datapoint table
+        :type columnar bool
+        :param wal True to run the database in WAL mode, with a dedicated connection for
+        recording and a pool of connections for reading; see writer() and reader()
+        :type wal bool
+        """
         self._channels = []
         self._isopen = False
         self.datalogchanneltypes = {}
         self._ending_datalog_id = 0
+        self._thread_local = threading.local()
         self._conn = None
+        self._db_path = None
         self._databus = databus
+        self._columnar = columnar
+        self._wal = wal
+        self._writer_conn = None
+        self._writer_lock = threading.Lock()
+        self._readers = Queue()
+        self._reader_count = 0
+        self._reader_lock = threading.Lock()
+        # channel order of sessions being recorded into columnar storage
+        self._staged_sessions = {}
+        # lap indexes of sessions being recorded
+        self._lap_indexers = {}
+        # how batches of samples are inserted, by session and channel order
+        self._insert_plans = {}
+        # serializes batch inserts from recorders on different threads, which
+        # would otherwise use the shared connection at the same time
+        self._insert_lock = threading.Lock()
 
     def close(self):
         self._conn.close()
+        if self._writer_conn is not None:
+            self._writer_conn.close()
+            self._writer_conn = None
+        with self._reader_lock:
+            while True:
+                try:
+                    self._readers.get_nowait().close()
+                except Empty:
+                    break
+            self._reader_count = 0
         self._isopen = False
 
     def open_db(self, db_path):
@@ -347,6 +811,18 @@ class DataStore(object):
         sqlite_conn = self._engine.connect()
         self._conn = sqlite_conn.connection
         sqlite_conn.detach()
+        self._db_path = db_path
+
+        if self._wal:
+            self._conn.execute('PRAGMA journal_mode = WAL')
+            self._configure_connection(self._conn)
+            self._writer_conn = self._connect(DataStore.WRITER_TIMEOUT)
+
+        # Pack anything left staged by a recording that didn't finish
+        self._finalize_staged_sessions()
+        if self._columnar:
+            self._pack_row_sessions()
+        self._index_session_laps()
 
         self._populate_channel_list()
 
@@ -356,6 +832,102 @@ class DataStore(object):
     def connection(self):
         return self._conn
 
+    @property
+    def _conn(self):
+        # A thread can be given a connection of its own; see use_connection()
+        connection = getattr(self._thread_local, 'connection', None)
+        return connection if connection is not None else self._shared_conn
+
+    @_conn.setter
+    def _conn(self, connection):
+        self._shared_conn = connection
+
+    def open_reader(self):
+        '''
+        Opens a read-only connection to the database, for querying from another thread
+        :returns sqlite3 connection
+        '''
+        if not self._isopen:
+            raise DatastoreException("Datastore is not open")
+        connection = self._connect(DataStore.READER_TIMEOUT)
+        connection.execute('PRAGMA query_only = 1')
+        return connection
+
+    def _connect(self, timeout):
+        connection = sqlite3.connect(self._db_path, check_same_thread=False, timeout=timeout)
+        self._configure_connection(connection)
+        return connection
+
+    def _configure_connection(self, connection):
+        if self._wal:
+            # WAL stays consistent without syncing every commit
+            connection.execute('PRAGMA synchronous = NORMAL')
+            connection.execute('PRAGMA cache_size = -{}'.format(DataStore.WAL_CACHE_SIZE_KB))
+
+    @contextmanager
+    def _using_connection(self, connection):
+        previous = getattr(self._thread_local, 'connection', None)
+        self.use_connection(connection)
+        try:
+            yield
+        finally:
+            self.use_connection(previous)
+
+    @contextmanager
+    def writer(self):
+        '''
+        Directs the DataStore calls of the current thread to the dedicated writer
+        connection while in the context, so recording isn't held up by queries.
+        Only one thread can use the writer at a time. Without WAL mode the shared
+        connection is used.
+        '''
+        if not self._wal:
+            yield
+            return
+
+        with self._writer_lock:
+            with self._using_connection(self._writer_conn):
+                yield
+
+    @contextmanager
+    def reader(self):
+        '''
+        Directs the DataStore calls of the current thread to a read-only connection
+        from the reader pool while in the context, so long queries such as exports
+        don't hold up recording. Without WAL mode the shared connection is used.
+        '''
+        if not self._wal:
+            yield
+            return
+
+        connection = None
+        with self._reader_lock:
+            try:
+                connection = self._readers.get_nowait()
+            except Empty:
+                if self._reader_count < DataStore.READER_POOL_SIZE:
+                    connection = self.open_reader()
+                    self._reader_count += 1
+
+        if connection is None:
+            # wait for a connection to be returned to the pool
+            connection = self._readers.get()
+
+        try:
+            with self._using_connection(connection):
+                yield
+        finally:
+            self._readers.put(connection)
+
+    def use_connection(self, connection):
+        '''
+        Directs the DataStore calls of the current thread to a connection, such as one
+        from open_reader()
+        :param connection the connection to use, or None to use the shared connection
+        :type connection sqlite3 connection
+        '''
+        self._thread_local.connection = connection
+
     def _populate_channel_list(self):
         del self._channels[:]
         channels = self.get_channel_list()
@@ -576,6 +1148,11 @@ class DataStore(object):
         """
         cursor = self._conn.cursor()
         try:
+            if self._columnar:
+                self._insert_staged_sample(cursor, sample, session_id)
+                self._index_recorded_sample(cursor.lastrowid, sample, session_id)
+                return
+
             # First, insert into the datalog table to give us a reference
             # point for the datapoint insertions
             cursor.execute(
@@ -594,56 +1171,121 @@ class DataStore(object):
                                                                        ','.join(['?'] * (len(values))))
 
             cursor.execute(base_sql, values)
+            self._index_recorded_sample(sample_id, sample, session_id)
 
         except:  # rollback under any exception, then re-raise exception
             self._conn.rollback()
             raise
 
-    def _extrap_datapoints(self, datapoints):
-        """
-        Takes a list of datapoints, and returns a new list of extrapolated datapoints
-
-        i.e: '3, nil, nil, nil, 7' (as a column) will become:
-        [3, 3, 3, 3, 7]
-
-         In the event of the 'start' of the dataset, we may have something like:
-        [nil, nil, nil, 5], in this case, we will just back extrapolate, so:
-        [nil, nil, nil, 5] becomes [5, 5, 5, 5]
+    def _get_lap_indexer(self, session_id):
+        lap_indexer = self._lap_indexers.get(session_id)
+        if lap_indexer is None:
+            names = [row[0] for row in self._conn.execute('SELECT name FROM channel WHERE session_id = ?', (session_id,))]
+            lap_indexer = LapIndexer(names)
+            self._lap_indexers[session_id] = lap_indexer
+        return lap_indexer
 
+    def _index_recorded_sample(self, sample_id, sample, session_id):
         """
+        Adds a recorded sample to the session's lap index, storing laps as they complete
+        """
+        lap_indexer = self._get_lap_indexer(session_id)
+        lap_indexer.add_sample(sample_id, sample)
+        self._insert_laps(session_id, lap_indexer.take_completed())
 
-        ret_list = []
-
-        # first we need to handle the 'start of dataset, begin on a
-        # miss' case
-        if datapoints[0] == None:
-            ret_list = [datapoints[-1] for x in datapoints]
-            return ret_list
-
-        # Next, we need to handle the case where there are only two
-        # entries and both are hits, if this is the case, we just
-        # duplicate the values in the tuple for each entry and return
-        # that
-        if len(datapoints) == 2:
-            ret_list = [x for x in datapoints]
-            return ret_list
-
-        # If we're here, it means we actually have a start and end
-        # point to this data sample, have blanks in between and need
-        # to interpolate+extrapolate the bits in between
-
-        extrap_list = []
-        for e in range(len(datapoints) - 1):
-            extrap_list.append(datapoints[0])
-        extrap_list.append(datapoints[-1])
+    def _get_insert_plan(self, session_id, channel_names):
+        """
+        Returns how batches of samples in a channel order are inserted for a session.
+        Plans are cached, so the same statement text is reused and sqlite3 can
+        reuse its prepared statement.
+        :return tuple of the insert statement, the staged position of each channel
+        (columnar storage only) and the position in channel_names of each of
+        LapIndexer.LAP_CHANNELS
+        """
+        key = (session_id, tuple(channel_names))
+        plan = self._insert_plans.get(key)
+        if plan is None:
+            if self._columnar:
+                names, positions = self._get_staged_channels(session_id)
+                sql = 'INSERT INTO sample (session_id, data) VALUES (?, ?)'
+                staged_positions = [positions.get(name) for name in channel_names]
+            else:
+                sql = "INSERT INTO datapoint ({}) VALUES ({})".format(','.join(['sample_id'] + [_scrub_sql_value(x) for x in channel_names]),
+                                                                      ','.join(['?'] * (len(channel_names) + 1)))
+                staged_positions = None
+            lap_positions = [channel_names.index(name) if name in channel_names else None
+                             for name in LapIndexer.LAP_CHANNELS]
+            plan = (sql, staged_positions, lap_positions)
+            self._insert_plans[key] = plan
+        return plan
+
+    def _discard_insert_plans(self, session_id):
+        for key in [key for key in self._insert_plans.keys() if key[0] == session_id]:
+            self._insert_plans.pop(key)
+
+    def _staged_sample_blob(self, session_id, staged_positions, sample):
+        values = array.array('d', [_GAP]) * len(self._get_staged_channels(session_id)[0])
+        for index, value in izip(staged_positions, sample):
+            if index is not None and value is not None:
+                values[index] = value
+        return sqlite3.Binary(_column_to_bytes(values))
+
+    def _get_inserted_sample_ids(self, cursor, session_id, count):
+        """
+        Reads back the ids the database assigned to the samples just inserted
+        for a session. Called with the insert lock held, so no other batch is
+        inserted in between.
+        :return list of the sample ids, in insertion order
+        """
+        cursor.execute("""SELECT id FROM sample WHERE session_id = ? ORDER BY id DESC LIMIT ?""", (session_id, count))
+        sample_ids = [row[0] for row in cursor.fetchall()]
+        sample_ids.reverse()
+        return sample_ids
 
-        return extrap_list
+    def insert_samples_nocommit(self, channel_names, samples, session_id):
+        """
+        Insert a batch of samples which are queued to be added to the DB.
+        A subsequent commit is required before the samples will appear in the DB.
+        Batches may be inserted from different threads; they are inserted one at a time.
+        :param channel_names the channels of the samples, in the order of their values
+        :type channel_names list
+        :param samples the samples, each a sequence of values in channel order; None where there is no value
+        :type samples list
+        :param session_id the session being recorded
+        :type session_id int
+        """
+        if not len(samples):
+            return
 
-    def _desparsified_data_generator(self, data_file, warnings=None, progress_cb=None):
+        with self._insert_lock:
+            sql, staged_positions, lap_positions = self._get_insert_plan(session_id, channel_names)
+            lap_indexer = self._get_lap_indexer(session_id)
+            cursor = self._conn.cursor()
+            try:
+                if self._columnar:
+                    cursor.executemany(sql, [(session_id, self._staged_sample_blob(session_id, staged_positions, sample))
+                                             for sample in samples])
+                    sample_ids = self._get_inserted_sample_ids(cursor, session_id, len(samples)) if lap_indexer.enabled else None
+                else:
+                    cursor.executemany("""INSERT INTO sample (session_id) VALUES (?)""", [(session_id,)] * len(samples))
+                    sample_ids = self._get_inserted_sample_ids(cursor, session_id, len(samples))
+                    cursor.executemany(sql, [(sample_id,) + tuple(sample) for sample_id, sample in izip(sample_ids, samples)])
+
+                if lap_indexer.enabled:
+                    for sample_id, sample in izip(sample_ids, samples):
+                        lap_indexer.add(sample_id,
+                                        *[sample[position] if position is not None else None for position in lap_positions])
+                    self._insert_laps(session_id, lap_indexer.take_completed())
+
+            except:  # rollback under any exception, then re-raise exception
+                self._conn.rollback()
+                raise
+
+    def _desparsified_chunk_generator(self, data_file, warnings=None, progress_cb=None, leading_gaps=None):
         """
         Takes a racecapture pro CSV file and removes sparsity from the dataset.
-        This function yields samples that have been extrapolated from the
-        parent dataset.
+        This function yields chunks of samples, as a list of columns, that
+        have been extrapolated from the parent dataset.
 
         'extrapolated' means that we'll just carry all values forward: [3, nil, nil, nil, 7] -> [3, 3, 3, 3, 7, 7, 7...]
 
@@ -653,141 +1295,83 @@ class DataStore(object):
         In the event of the 'start' of the dataset, we may have something like:
         [nil, nil, nil, 5], in this case, we will just back extrapolate, so:
         [nil, nil, nil, 5] becomes [5, 5, 5, 5]
+
+        The file is parsed in chunks of lines; each chunk is transposed into
+        columns, forward-filled a column at a time and transposed back into
+        rows. A channel that has not reported a value yet is yielded as None;
+        the back extrapolation for those leading rows is reported through
+        leading_gaps as (channel index, row count, first value) so the caller
+        can apply it once the rows are stored.
         """
 
-        # Notes on this algorithm: The basic idea is that we're going
-        # 100% bob barker on this data...Think Plinko.
-        # We maintain 2 lists of n lists where n = the number
-        # of columns we're playing with.
-        # Container list 1 holds our work space, we file records into
-        # it one by one into their respective columnar lists.
-        # A data point containing a NIL is a 'miss', a data point
-        # containing some value is a 'hit'.  We continue to file until
-        # we get a 'hit'.  When that happens, we take the slice of the
-        # columnar list [0:hit], extrapolate the
-        # values in between, then take the slice [0:hit-1] and insert
-        # it into the second container list (in the same respective
-        # column).  We shift container list 1's respective columnar
-        # list by [hit:], then continue on.  We do this for EACH
-        # columnar list in container list 1. (In the event that we're
-        # just starting out and have misses at the head of the column,
-        # instead of interpolating/extrapolating between hits, we just
-        # back-extrapolate and shift as expected)
-        # After this operation, we shift our attention to container
-        # list 2.  If there is data in each column (i.e. len(col) > 0
-        # for each column), we yield a new list containing:
-        # [col0[0], col1[0], col2[0],...,coln[0]] and shift each
-        # column down by 1 (i.e.: [1, 2, 3] becomes [2, 3])
-        # That's right, this is a generator.  Booya.
-
-        work_list = []
-        yield_list = []
-
-        # In order to facilitate a progress callback, we need to know
-        # the number of lines in the file
-
-        # Get the current file cursor position
+        # Progress is tracked by position in the file, so we only need its
+        # size rather than a count of the lines in it
         start_pos = data_file.tell()
+        data_file.seek(0, os.SEEK_END)
+        total_bytes = data_file.tell() - start_pos
+        data_file.seek(start_pos)
 
-        # Count the remaining lines in the file
-        line_count = sum(1 for line in data_file)
+        channel_count = None
+        last_values = None
+        first_values = None
+        row_count = 0
         current_line = 0
+        bytes_read = 0
 
-        # Reset the file cursor
-        data_file.seek(start_pos)
+        while True:
+            lines = data_file.readlines(DataStore.IMPORT_CHUNK_BYTES)
+            if not lines:
+                break
 
-        for line in data_file:
+            rows = []
+            for line in lines:
+                bytes_read += len(line)
+                try:
+                    # Strip the line and break it down into it's component
+                    # channels, replace all blank entries with None
+                    channels = [
+                        None if x == '' else float(x) for x in line.strip().split(',')]
+                except ValueError:
+                    Logger.warn('Datastore: could not parse logfile data at line {}'.format(current_line))
+                    current_line += 1
+                    continue
 
-            try:
-                # Strip the line and break it down into it's component
-                # channels, replace all blank entries with None
-                channels = [
-                    None if x == '' else float(x) for x in line.strip().split(',')]
-
-                # Now, if this is the first entry (characterized by
-                # work_list being an empty list), we need to create all of
-                # our 'plinko slots' for each channel in both the work and
-                # yield lists
-                work_list_len = len(work_list)
-                channels_len = len(channels)
-                if work_list_len == 0:
-                    work_list = [[] for x in channels]
-                    yield_list = [[] for x in channels]
-
-                if channels_len > work_list_len and current_line > 0:
+                # The first line establishes the channel count for the log
+                if channel_count is None:
+                    channel_count = len(channels)
+                    last_values = [None] * channel_count
+                    first_values = [None] * channel_count
+
+                if len(channels) != channel_count:
                     warn_msg = 'Unexpected channel count in line {}. Expected {}, got {}'.format(
-                        current_line, work_list_len, channels_len)
-                    if warnings:
+                        current_line, channel_count, len(channels))
+                    if warnings is not None:
                         warnings.append((line, warn_msg))
                     Logger.warn("DataStore: {}".format(warn_msg))
+                    current_line += 1
                     continue
 
-                # Down to business, first, we stuff each channel's sample
-                # into the work list
-                Logger.debug('DataStore: work_list.len={}, channels.len={}, current_line={}'.format(
-                    work_list_len, channels_len, current_line))
-                for c in range(channels_len):
-                    work_list[c].append(channels[c])
-
-                # At this point, we need to walk through each channel
-                # column in the work list.  If the length of the column is
-                # 1, we simply move onto the next column.  If the length
-                # is > 1, we check if column[-1] is a miss (None) or a
-                # hit(anything else).  If it is a hit, we
-                # interpolate/extrapolate the column, then move everything
-                # EXCEPT the last item into the yield list
-
-                for c in range(len(work_list)):
-                    if len(work_list[c]) == 1:
-                        continue
-
-                    # If we have a hit at the end of the list, get the
-                    # extraploated/interpolated list of datapoints
-                    if not work_list[c][-1] == None:
-                        mod_list = self._extrap_datapoints(work_list[c])
-
-                        # Now copy everything but the last point in the
-                        # modified list into the yield_list
-                        yield_list[c].extend(mod_list[:-1])
-
-                        # And remove everything BUT the last datapoint from
-                        # the current list in work_list
-                        work_list[c] = work_list[c][-1:]
-
-                # Ok, we now have THINGS in our yield list, if we have
-                # something in EVERY column of the yield list, create a
-                # new list containing the first item in every column,
-                # shift all columns down one, and yield the new list
-                if not 0 in [len(x) for x in yield_list]:
-                    ds_to_yield = [x[0] for x in yield_list]
-                    map(lambda x: x.pop(0), yield_list)
-                    if progress_cb:
-                        percent_complete = float(current_line) / line_count * 100
-                        progress_cb(percent_complete)
-                    yield ds_to_yield
-
-                # Increment line number
-            except Exception as e:
-                Logger.warn('Datastore: could not parse logfile data at line {}'.format(current_line))
-
-            current_line += 1
-
-        # now, finish off and extrapolate the remaining items in the
-        # work list and extend the yield list with the resultant values
-        for idx in range(len(work_list)):
-            set_len = len(work_list[idx])
-            work_list[idx] = [work_list[idx][0] for x in range(set_len)]
-            yield_list[idx].extend(work_list[idx])
-
-        # Yield off the remaining items in the yield list
-        while not 0 in [len(x) for x in yield_list]:
-            current_line += 1
-            ds_to_yield = [x[0] for x in yield_list]
-            map(lambda x: x.pop(0), yield_list)
-            if progress_cb:
-                percent_complete = float(current_line) / line_count * 100
-                progress_cb(percent_complete)
-            yield ds_to_yield
+                rows.append(channels)
+                current_line += 1
+
+            if rows:
+                columns = zip(*rows)
+                for index in range(channel_count):
+                    column = columns[index]
+                    if first_values[index] is None:
+                        # Note where this channel reported its first value
+                        first_index = next((i for i, value in enumerate(column) if value is not None), None)
+                        if first_index is not None:
+                            first_values[index] = column[first_index]
+                            if leading_gaps is not None and row_count + first_index > 0:
+                                leading_gaps.append((index, row_count + first_index, column[first_index]))
+                    columns[index], last_values[index] = _forward_fill(column, last_values[index])
+
+                row_count += len(rows)
+                yield columns
+
+            if progress_cb and total_bytes:
+                progress_cb(float(bytes_read) / total_bytes * 100)
 
     def delete_session(self, session_id):
         self._conn.execute(
@@ -797,23 +1381,34 @@ class DataStore(object):
         self._conn.execute("""DELETE FROM session where id=?""", (session_id,))
         self._conn.execute(
             """DELETE FROM channel where session_id=?""", (session_id,))
+        self._conn.execute(
+            """DELETE FROM channel_data where session_id=?""", (session_id,))
+        self._conn.execute(
+            """DELETE FROM session_index where session_id=?""", (session_id,))
+        self._conn.execute(
+            """DELETE FROM lap where session_id=?""", (session_id,))
         self._conn.commit()
+        self._staged_sessions.pop(session_id, None)
+        self._lap_indexers.pop(session_id, None)
+        self._discard_insert_plans(session_id)
 
     def init_session(self, name, channel_metas=None, notes=''):
         session_id = self.create_session(name, notes)
 
         if channel_metas:
             session_channels = []
-            new_channels = []
             for name, meta in channel_metas.iteritems():
                 channel = DatalogChannel(
                     name.strip(), meta.units.strip(), meta.min, meta.max, meta.sampleRate, 0)
-                if channel.name not in [x.name for x in self._channels]:
-                    new_channels.append(channel)
                 session_channels.append(channel)
-            self._extend_datalog_channels(new_channels)
+
+            # Columnar sessions are staged in the sample table while
+            # recording, so the datapoint table doesn't need the channels
+            if not self._columnar:
+                self._extend_datalog_channels(session_channels)
 
             self._add_session_channels(session_id, session_channels)
+            self._conn.commit()
             self._populate_channel_list()
 
         return session_id
@@ -847,20 +1442,8 @@ class DataStore(object):
         starting_datalog_id = self._get_last_table_id('sample') + 1
         self._ending_datalog_id = starting_datalog_id
 
-        def sample_iter(count, sample_id):
-            for x in range(count):
-                yield [sample_id]
-
-        def datapoint_iter(data, datalog_id):
-            for record in data:
-                record = [datalog_id] + record
-                datalog_id += 1
-                yield record
-            self._ending_datalog_id = datalog_id
-
-        # Create the generator for the desparsified data
-        newdata_gen = self._desparsified_data_generator(
-            data_file, warnings=warnings, progress_cb=progress_cb)
+        leading_gaps = []
+        lap_indexer = LapIndexer([x.name for x in headers])
 
         # Put together an insert statement containing the column names
         datapoint_sql = "INSERT INTO datapoint ({}) VALUES ({});".format(','.join(['sample_id'] + [_scrub_sql_value(x.name) for x in headers]),
@@ -869,24 +1452,398 @@ class DataStore(object):
         # Relatively static insert statement for sample table
         sample_sql = "INSERT INTO sample (session_id) VALUES (?)"
 
-        # Use a generator to efficiently insert data into table, within a
+        # Insert the desparsified data a chunk at a time, within a
         # transaction
         cur = self._conn.cursor()
         try:
-            cur.executemany(
-                datapoint_sql, datapoint_iter(newdata_gen, starting_datalog_id))
-            cur.executemany(sample_sql, sample_iter(
-                self._ending_datalog_id - starting_datalog_id, session_id))
+            for columns in self._desparsified_chunk_generator(data_file, warnings=warnings, progress_cb=progress_cb, leading_gaps=leading_gaps):
+                sample_ids = xrange(self._ending_datalog_id, self._ending_datalog_id + len(columns[0]))
+                cur.executemany(datapoint_sql, izip(sample_ids, *columns))
+                lap_indexer.add_columns(sample_ids, columns)
+                self._ending_datalog_id += len(sample_ids)
+
+            cur.executemany(sample_sql, [(session_id,)] * (self._ending_datalog_id - starting_datalog_id))
+
+            # Back extrapolate each channel's first value over the samples
+            # recorded before that channel reported anything
+            for index, count, value in leading_gaps:
+                cur.execute("UPDATE datapoint SET {} = ? WHERE sample_id >= ? AND sample_id < ?;".format(_scrub_sql_value(headers[index].name)),
+                            (value, starting_datalog_id, starting_datalog_id + count))
+
+            self._insert_laps(session_id, lap_indexer.finish(), indexed=True)
+            self._conn.commit()
+        except:  # rollback under any exception, then re-raise exception
+            self._conn.rollback()
+            raise
+
+    def _handle_data_columnar(self, data_file, headers, session_id, warnings=None, progress_cb=None):
+        """
+        takes a raw dataset in the form of a CSV file and packs the data
+        into columnar storage for the session.
+
+        This function is not thread-safe.
+        """
+        sample_id = self._get_last_table_id('sample') + 1
+        packer = ColumnPacker([x.name for x in headers], fill_leading=True)
+        lap_indexer = LapIndexer([x.name for x in headers])
+        sample_sql = "INSERT INTO sample (session_id) VALUES (?)"
+
+        cur = self._conn.cursor()
+        try:
+            for columns in self._desparsified_chunk_generator(data_file, warnings=warnings, progress_cb=progress_cb):
+                count = len(columns[0])
+                cur.executemany(sample_sql, [(session_id,)] * count)
+                sample_ids = xrange(sample_id, sample_id + count)
+                packer.add_columns(sample_ids, columns)
+                lap_indexer.add_columns(sample_ids, columns)
+                sample_id += count
+            self._store_packed_session(session_id, packer)
+            self._insert_laps(session_id, lap_indexer.finish(), indexed=True)
+            self._conn.commit()
+        except:  # rollback under any exception, then re-raise exception
+            self._conn.rollback()
+            raise
+
+    def _get_staged_channels(self, session_id):
+        """
+        Returns the channel order used to stage samples for a session being recorded
+        :return tuple of the list of channel names and a dict of channel name to index
+        """
+        staged = self._staged_sessions.get(session_id)
+        if staged is None:
+            names = [row[0] for row in self._conn.execute(
+                'SELECT name FROM channel WHERE session_id = ? ORDER BY id', (session_id,))]
+            staged = (names, dict((name, index) for index, name in enumerate(names)))
+            self._staged_sessions[session_id] = staged
+        return staged
+
+    def _insert_staged_sample(self, cursor, sample, session_id):
+        """
+        Stages a recorded sample as an array of values in the session's channel order
+        """
+        names, positions = self._get_staged_channels(session_id)
+        values = array.array('d', [_GAP]) * len(names)
+        for channel_name, value in sample.iteritems():
+            index = positions.get(channel_name)
+            if index is not None and value is not None:
+                values[index] = value
+
+        cursor.execute("""INSERT INTO sample (session_id, data) VALUES (?, ?)""",
+                       (session_id, sqlite3.Binary(_column_to_bytes(values))))
+
+    def _read_staged_samples(self, session_id):
+        """
+        Reads the samples staged for a session
+        :return generator of (sample ids, list of columns) in the session's channel order
+        """
+        names, positions = self._get_staged_channels(session_id)
+        channel_count = len(names)
+        c = self._conn.cursor()
+        c.execute('SELECT id, data FROM sample WHERE session_id = ? AND data IS NOT NULL ORDER BY id', (session_id,))
+        while True:
+            rows = c.fetchmany(DataStore.COLUMN_FETCH_SIZE)
+            if not rows:
+                break
+            values = _column_from_bytes(''.join([str(row[1]) for row in rows]))
+            yield [row[0] for row in rows], [values[index::channel_count] for index in range(channel_count)]
+
+    def _get_row_channels(self, session_id):
+        """
+        Returns the session's channels that are present in the datapoint table
+        """
+        columns = set([row[1].upper() for row in self._conn.execute('PRAGMA table_info(datapoint)')])
+        return [c.name for c in self.get_channel_list(session_id) if c.name.upper() in columns]
+
+    def _read_row_samples(self, session_id, names):
+        """
+        Reads the samples of a session stored in the datapoint table
+        :return generator of (sample ids, list of columns) in the order of names
+        """
+        sql = """SELECT sample.id{} FROM sample JOIN datapoint ON datapoint.sample_id=sample.id
+                 WHERE sample.session_id = ? ORDER BY sample.id""".format(
+                     ''.join([',datapoint.{}'.format(_scrub_sql_value(name)) for name in names]))
+        c = self._conn.cursor()
+        c.execute(sql, (session_id,))
+        while True:
+            rows = c.fetchmany(DataStore.COLUMN_FETCH_SIZE)
+            if not rows:
+                break
+            columns = zip(*rows)
+            yield columns[0], columns[1:]
+
+    def _store_packed_session(self, session_id, packer):
+        """
+        Writes the columns of a session; the caller is responsible for committing
+        """
+        sample_ids, channel_blobs = packer.finish()
+        self._conn.execute("""INSERT INTO session_index (session_id, sample_count, sample_ids) VALUES (?, ?, ?)""",
+                           (session_id, packer.sample_count, sqlite3.Binary(sample_ids)))
+        self._conn.executemany("""INSERT INTO channel_data (session_id, name, data) VALUES (?, ?, ?)""",
+                               [(session_id, name, sqlite3.Binary(blob)) for name, blob in channel_blobs.iteritems()])
+
+    def _pack_session(self, session_id, names, sample_chunks):
+        packer = ColumnPacker(names)
+        for sample_ids, columns in sample_chunks:
+            packer.add_columns(sample_ids, columns)
+        self._store_packed_session(session_id, packer)
+
+    def finalize_session(self, session_id):
+        """
+        Completes a recorded session: the lap in progress is added to the lap index,
+        and samples staged while recording are packed into columnar storage.
+        Sessions stored as rows, or already packed, are left as they are.
+        :param session_id the session to finalize
+        :type session_id int
+        """
+        lap_indexer = self._lap_indexers.pop(session_id, None)
+        c = self._conn.cursor()
+        try:
+            if lap_indexer is not None:
+                self._insert_laps(session_id, lap_indexer.finish(), indexed=True)
+
+            c.execute('SELECT 1 FROM sample WHERE session_id = ? AND data IS NOT NULL LIMIT 1', (session_id,))
+            if c.fetchone() is not None:
+                names, positions = self._get_staged_channels(session_id)
+                self._pack_session(session_id, names, self._read_staged_samples(session_id))
+                self._conn.execute('UPDATE sample SET data = NULL WHERE session_id = ?', (session_id,))
+                Logger.info('DataStore: Packed session {} into columnar storage'.format(session_id))
             self._conn.commit()
         except:  # rollback under any exception, then re-raise exception
             self._conn.rollback()
             raise
+        self._staged_sessions.pop(session_id, None)
+        self._discard_insert_plans(session_id)
+
+    def _insert_laps(self, session_id, laps, indexed=False):
+        """
+        Adds laps to the lap index of a session; the caller is responsible for committing
+        :param laps the laps, as returned by LapIndexer
+        :type laps list
+        :param indexed True if the session's lap index is now complete
+        :type indexed bool
+        """
+        if len(laps):
+            self._conn.executemany("""INSERT INTO lap (session_id, lap, first_sample_id, last_sample_id, lap_time,
+                                      start_interval, end_interval, start_distance, end_distance)
+                                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                                   [(session_id,) + lap for lap in laps])
+        if indexed:
+            self._conn.execute('UPDATE session SET laps_indexed = 1 WHERE id = ?', (session_id,))
+
+    def _index_session_laps(self):
+        """
+        Builds the lap index of sessions stored before it existed, or whose
+        recording didn't finish
+        """
+        session_ids = [row[0] for row in self._conn.execute(
+            'SELECT id FROM session WHERE laps_indexed = 0').fetchall()]
+        for session_id in session_ids:
+            names = [row[0] for row in self._conn.execute('SELECT name FROM channel WHERE session_id = ?', (session_id,))]
+            names = [name for name in LapIndexer.LAP_CHANNELS if name in names]
+            lap_indexer = LapIndexer(names)
+            try:
+                self._conn.execute('DELETE FROM lap WHERE session_id = ?', (session_id,))
+                if lap_indexer.enabled:
+                    Logger.info('DataStore: Indexing laps of session {}'.format(session_id))
+                    sample_ids, columns = self._load_session_columns(session_id, names)
+                    lap_indexer.add_columns(sample_ids, [columns[name] for name in names])
+                self._insert_laps(session_id, lap_indexer.finish(), indexed=True)
+                self._conn.commit()
+            except:  # rollback under any exception, then re-raise exception
+                self._conn.rollback()
+                raise
+
+    def _finalize_staged_sessions(self):
+        session_ids = [row[0] for row in self._conn.execute(
+            'SELECT DISTINCT session_id FROM sample WHERE data IS NOT NULL').fetchall()]
+        for session_id in session_ids:
+            self.finalize_session(session_id)
+
+    def _pack_row_sessions(self):
+        """
+        Moves sessions stored as rows in the datapoint table into columnar storage.
+        Once the datapoint table is empty it is re-created without the channel
+        columns, and the database compacted.
+        """
+        c = self._conn.cursor()
+        session_ids = [row[0] for row in c.execute(
+            'SELECT id FROM session WHERE id NOT IN (SELECT session_id FROM session_index)').fetchall()]
+
+        packed = 0
+        for session_id in session_ids:
+            c.execute("""SELECT 1 FROM sample JOIN datapoint ON datapoint.sample_id=sample.id
+                         WHERE sample.session_id = ? LIMIT 1""", (session_id,))
+            if c.fetchone() is None:
+                continue
+
+            Logger.info('DataStore: Packing session {} into columnar storage'.format(session_id))
+            names = self._get_row_channels(session_id)
+            try:
+                self._pack_session(session_id, names, self._read_row_samples(session_id, names))
+                self._conn.execute(
+                    """DELETE FROM datapoint WHERE sample_id in (select id from sample where session_id = ?)""", (session_id,))
+                self._conn.commit()
+            except:  # rollback under any exception, then re-raise exception
+                self._conn.rollback()
+                raise
+            packed += 1
+
+        if not packed:
+            return
+
+        c.execute('SELECT COUNT(*) FROM datapoint')
+        if c.fetchone()[0] == 0:
+            self._conn.execute('DROP TABLE datapoint')
+            self._conn.execute("""CREATE TABLE datapoint
+                (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sample_id INTEGER NOT NULL)""")
+            self._conn.execute('CREATE INDEX datapoint_sample_id_index_id on datapoint(sample_id)')
+            self._conn.commit()
+        self._conn.execute('VACUUM')
+
+    def _get_columnar_sessions(self, sessions=None):
+        """
+        Returns the ids of the specified sessions, or all sessions, that are in columnar storage
+        """
+        columnar = set(self._staged_sessions.keys())
+        for row in self._conn.execute('SELECT session_id FROM session_index'):
+            columnar.add(row[0])
+        if sessions:
+            columnar &= set(sessions)
+        return columnar
+
+    def _use_columns(self, sessions=None):
+        """
+        Indicates if queries over the specified sessions must be evaluated against
+        columns rather than in SQL against the datapoint table
+        """
+        return self._columnar or len(self._get_columnar_sessions(sessions)) > 0
+
+    def _load_session_columns(self, session_id, channels):
+        """
+        Loads channels of a session as arrays of values, however the session is stored.
+        Gaps are NaN, and a channel the session doesn't have is all gaps.
+        :param session_id the session to load
+        :type session_id int
+        :param channels the channel names to load
+        :type channels list
+        :return tuple of the session's sample ids and a dict of channel name to values
+        """
+        c = self._conn.cursor()
+        c.execute('SELECT sample_ids FROM session_index WHERE session_id = ?', (session_id,))
+        row = c.fetchone()
+        columns = {}
+        if row is not None:
+            sample_ids = _column_from_bytes(zlib.decompress(row[0]), 'i')
+            if len(channels):
+                sql = 'SELECT name, data FROM channel_data WHERE session_id = ? AND name IN ({})'.format(
+                    ','.join(['?'] * len(channels)))
+                for name, data in c.execute(sql, [session_id] + list(channels)):
+                    columns[name] = _column_from_bytes(zlib.decompress(data))
+        else:
+            if session_id in self._staged_sessions:
+                names = self._staged_sessions[session_id][0]
+                sample_chunks = self._read_staged_samples(session_id)
+            else:
+                names = [name for name in self._get_row_channels(session_id) if name in channels]
+                sample_chunks = self._read_row_samples(session_id, names)
+
+            wanted = [(index, name) for index, name in enumerate(names) if name in channels]
+            sample_ids = array.array('i')
+            for index, name in wanted:
+                columns[name] = array.array('d')
+            for ids, chunk in sample_chunks:
+                sample_ids.extend(ids)
+                for index, name in wanted:
+                    column = chunk[index]
+                    if None in column:
+                        column = [_GAP if value is None else value for value in column]
+                    columns[name].extend(array.array('d', column))
+
+        for name in channels:
+            if name not in columns:
+                columns[name] = array.array('d', [_GAP]) * len(sample_ids)
+        return sample_ids, columns
+
+    def _iter_session_columns(self, sessions, channels):
+        """
+        Loads the specified channels of the sessions, or all sessions, one session at a time
+        :return generator of (session id, sample ids, dict of channel name to values)
+        """
+        session_ids = sessions if sessions else [s.session_id for s in self.get_sessions()]
+        for session_id in sorted(set(session_ids)):
+            sample_ids, columns = self._load_session_columns(session_id, channels)
+            yield session_id, sample_ids, columns
+
+    def _query_columns(self, sessions, channels, data_filter, distinct_records, sample_ranges=None):
+        """
+        Evaluates a query against session columns
+        :return tuple of the result channel names and a dict of channel name to values
+        """
+        names = ['session_id'] + channels
+        load = set(channels)
+        if data_filter is not None:
+            load.update(data_filter.channels)
+
+        pieces = dict((name, []) for name in names)
+        for session_id, sample_ids, columns in self._iter_session_columns(sessions, load):
+            if sample_ranges is not None:
+                sample_ids, columns = _slice_sample_ranges(sample_ids, columns, sample_ranges)
+            count = len(sample_ids)
+            matches = None
+            if data_filter is not None:
+                matches = data_filter.evaluate(columns, count)
+                count = matches.count(True)
+
+            pieces['session_id'].append([session_id] * count)
+            for name in channels:
+                column = columns[name]
+                if matches is not None:
+                    column = array.array('d', compress(column, matches))
+                pieces[name].append(_gaps_to_none(column))
+
+        results = {}
+        for name in names:
+            parts = pieces[name]
+            results[name] = parts[0] if len(parts) == 1 else list(chain(*parts))
+
+        if distinct_records:
+            seen = set()
+            records = []
+            for record in izip(*[results[name] for name in names]):
+                if record not in seen:
+                    seen.add(record)
+                    records.append(record)
+            columns = zip(*records) if len(records) else [[] for name in names]
+            results = dict(zip(names, [list(column) for column in columns]))
+
+        return names, results
 
     def get_location_center(self, sessions=None):
 
         if not (self.channel_exists('Latitude') and self.channel_exists('Longitude')):
             return (0, 0)
 
+        if self._use_columns(sessions):
+            lat_total = lon_total = 0.0
+            lat_count = lon_count = 0
+            for session_id, sample_ids, columns in self._iter_session_columns(sessions, ['Latitude', 'Longitude']):
+                points = izip(columns['Latitude'], columns['Longitude'])
+                if type(sessions) == list and len(sessions) > 0:
+                    points = [(lat, lon) for lat, lon in points if lat != 0 and lon != 0 and lat == lat and lon == lon]
+                    lats = [point[0] for point in points]
+                    lons = [point[1] for point in points]
+                else:
+                    lats = [lat for lat in columns['Latitude'] if lat == lat]
+                    lons = [lon for lon in columns['Longitude'] if lon == lon]
+                lat_total += sum(lats)
+                lat_count += len(lats)
+                lon_total += sum(lons)
+                lon_count += len(lons)
+
+            return (lat_total / lat_count if lat_count else None,
+                    lon_total / lon_count if lon_count else None)
+
         c = self._conn.cursor()
 
         base_sql = 'SELECT AVG(Latitude), AVG(Longitude) from datapoint'
@@ -916,6 +1873,15 @@ class DataStore(object):
         return sql
 
     def get_channel_average(self, channel, sessions=None):
+        if self._use_columns(sessions):
+            total = 0.0
+            count = 0
+            for session_id, sample_ids, columns in self._iter_session_columns(sessions, [channel]):
+                values = [value for value in columns[channel] if value == value]
+                total += sum(values)
+                count += len(values)
+            return total / count if count else None
+
         c = self._conn.cursor()
         params = []
 
@@ -946,6 +1912,9 @@ class DataStore(object):
         if not self.channel_exists(channel):
             raise InvalidChannelException()
 
+        if self._use_columns(sessions):
+            return self._get_channel_aggregate_columns(aggregate, channel, sessions, extra_channels, exclude_zero)
+
         base_sql = "SELECT {}({}) {} from datapoint {} {};".format(aggregate, _scrub_sql_value(channel),
                                                                    self._extra_channels(
                                                                        extra_channels),
@@ -959,6 +1928,27 @@ class DataStore(object):
         res = c.fetchone()
         return None if res == None else res if extra_channels else res[0]
 
+    def _get_channel_aggregate_columns(self, aggregate, channel, sessions, extra_channels, exclude_zero):
+        select = min if aggregate == 'MIN' else max
+        extra_channels = extra_channels if type(extra_channels) == list else []
+        best = None
+        extras = [None] * len(extra_channels)
+
+        for session_id, sample_ids, columns in self._iter_session_columns(sessions, [channel] + extra_channels):
+            column = columns[channel]
+            # NaN fails both comparisons, so gaps are skipped either way
+            values = [value for value in column if value > 0] if exclude_zero else [value for value in column if value == value]
+            if not len(values):
+                continue
+            value = select(values)
+            if best is None or select(best, value) != best:
+                best = value
+                index = column.index(value)
+                extras = [columns[name][index] for name in extra_channels]
+                extras = [None if extra != extra else extra for extra in extras]
+
+        return tuple([best] + extras) if len(extra_channels) else best
+
     def get_channel_max(self, channel, sessions=None, extra_channels=None):
         return self._get_channel_aggregate('MAX', channel, sessions=sessions, extra_channels=extra_channels)
 
@@ -985,6 +1975,7 @@ class DataStore(object):
 
         self._conn.execute(
             'UPDATE channel SET smoothing = ? WHERE name = ?', params)
+        self._conn.commit()
 
     def get_channel_smoothing(self, channel):
         if not channel in [x.name for x in self._channels]:
@@ -1015,17 +2006,36 @@ class DataStore(object):
 
         header = dl.readline()
         channels = self._parse_datalog_headers(header)
-        self._extend_datalog_channels(channels)
+        if not self._columnar:
+            self._extend_datalog_channels(channels)
 
         # Create an event to be tagged to these records
         session_id = self.create_session(name, notes)
         self._add_session_channels(session_id, channels)
-        self._handle_data(dl, channels, session_id, warnings, progress_cb)
+        if self._columnar:
+            self._handle_data_columnar(dl, channels, session_id, warnings, progress_cb)
+        else:
+            self._handle_data(dl, channels, session_id, warnings, progress_cb)
 
         self._populate_channel_list()
         return session_id
 
-    def query(self, sessions=[], channels=[], data_filter=None, distinct_records=False):
+    def query(self, sessions=[], channels=[], data_filter=None, distinct_records=False, sample_ranges=None):
+        '''
+        Queries channel data from sessions
+        :param sessions the sessions to query
+        :type sessions list
+        :param channels the channels to select, or all channels if empty
+        :type channels list
+        :param data_filter a Filter the samples must match
+        :type data_filter Filter
+        :param distinct_records True to drop duplicate records
+        :type distinct_records bool
+        :param sample_ranges limits the query to samples within (first sample id, last sample id) ranges,
+        such as those from get_lap_sample_ranges()
+        :type sample_ranges list
+        :returns DataSet
+        '''
         # Build our select statement
         sel_st = 'SELECT '
 
@@ -1041,6 +2051,15 @@ class DataStore(object):
             raise DatastoreException(
                 "Must provide a list of sessions to query!")
 
+        if data_filter is not None and not 'Filter' in type(data_filter).__name__:
+            raise TypeError("data_filter must be of class Filter")
+
+        if self._use_columns(sessions):
+            if len(channels) == 0 or '*' in channels:
+                channels = [x.name for x in self._channels]
+            names, columns = self._query_columns(sessions, channels, data_filter, distinct_records, sample_ranges)
+            return ColumnDataSet(names, columns, self._get_smoothing_map(channels))
+
         # If there are no channels, or if a '*' is passed, select all
         # of the channels
         if len(channels) == 0 or '*' in channels:
@@ -1068,11 +2087,9 @@ class DataStore(object):
 
         if data_filter is not None:
             # Add our filter
-            sel_st += 'WHERE '
-            if not 'Filter' in type(data_filter).__name__:
-                raise TypeError("data_filter must be of class Filter")
-
+            sel_st += 'WHERE ('
             sel_st += str(data_filter)
+            sel_st += ') '
             params = params + data_filter.params
 
         # create the session filter
@@ -1086,15 +2103,25 @@ class DataStore(object):
             ses_filters.append('sample.session_id = ?')
             params.append(s)
 
-        ses_st += 'OR '.join(ses_filters)
+        ses_st += '(' + 'OR '.join(ses_filters) + ') '
 
         # Now add the session filter to the select statement
         sel_st += ses_st
 
+        if sample_ranges is not None:
+            range_filters = []
+            for first_sample_id, last_sample_id in sample_ranges:
+                range_filters.append('sample.id BETWEEN ? AND ? ')
+                params += [first_sample_id, last_sample_id]
+            sel_st += 'AND (' + ('OR '.join(range_filters) if len(range_filters) else '0') + ')'
+
         Logger.debug('[datastore] Query execute: {}'.format(sel_st))
         c = self._conn.cursor()
         c.execute(sel_st, params)
 
+        return DataSet(c, self._get_smoothing_map(channels))
+
+    def _get_smoothing_map(self, channels):
         smoothing_map = {}
         # Put together the smoothing map
         for ch in channels:
@@ -1104,8 +2131,7 @@ class DataStore(object):
         # add the session_id to the smoothing map with a smoothing rate
         # of 0
         smoothing_map['session_id'] = 0
-
-        return DataSet(c, smoothing_map)
+        return smoothing_map
 
     def get_session_by_id(self, session_id, sessions=None):
         sessions = self.get_sessions() if not sessions else sessions
@@ -1129,15 +2155,9 @@ class DataStore(object):
         :returns True if the session has lap information
         :type Boolean
         '''
-        if not (self.channel_exists('CurrentLap') and self.channel_exists('LapCount')):
-            return False
-
         c = self._conn.cursor()
-        for row in c.execute('''SELECT s.session_id, d.LapCount, d.CurrentLap FROM sample s, 
-                             datapoint d WHERE s.session_id = ? AND d.sample_id = s.id ORDER BY d.LapCount DESC LIMIT 1;''',
-                             (session_id,)):
-            return row[1] is not None and row[2] is not None
-        return False
+        c.execute('SELECT 1 FROM lap WHERE session_id = ? AND lap > 0 LIMIT 1', (session_id,))
+        return c.fetchone() is not None
 
     def get_laps(self, session_id):
         '''
@@ -1147,52 +2167,34 @@ class DataStore(object):
         :returns list of Lap objects
         :type list 
         '''
+        # Transform into an ordered dict so lap IDs are preserved as keys.
+        # Lap 0 holds the samples before the first start/finish crossing, so
+        # it isn't offered as a lap
+        laps_dict = OrderedDict()
+        for row in self._conn.execute('SELECT lap, lap_time FROM lap WHERE session_id = ? AND lap > 0 ORDER BY lap, first_sample_id',
+                                      (session_id,)):
+            laps_dict[row[0]] = Lap(session_id=session_id, lap=row[0], lap_time=row[1])
 
         # if there is no lap information then just return a default single lap.
-        if not self.session_has_laps(session_id):
-            laps_dict = OrderedDict()
+        if not len(laps_dict):
             laps_dict[1] = Lap(session_id=session_id, lap=1, lap_time=None)
-            return laps_dict
-
-        laps = []
-        c = self._conn.cursor()
-        for row in c.execute('''SELECT DISTINCT sample.session_id AS session_id, 
-                                datapoint.CurrentLap AS CurrentLap,
-                                LapTime
-                                FROM sample
-                                JOIN datapoint ON datapoint.sample_id=sample.id
-                                AND sample.session_id = ?
-                                GROUP BY LapCount, session_id
-                                ORDER BY datapoint.LapCount ASC;''',
-                             (session_id,)):
-            lap = row[1]
-            lap = 1 if lap is None else lap
-            laps.append(Lap(session_id=row[0], lap=lap - 1, lap_time=row[2]))
-
-        # Figure out if there are samples beyond the last lap
-        extra_lap_query = '''SELECT COUNT(*) FROM sample JOIN datapoint ON datapoint.sample_id=sample.id
-                             AND sample.session_id = ? WHERE datapoint.CurrentLap > ? LIMIT 1'''
-
-        # If there are samples beyond the last actual timed lap (crossed start/finish), add that lap to the end
-        # so users can view that data if needed
-        if len(laps) > 0:
-            c = self._conn.cursor()
-
-            for row in c.execute(extra_lap_query, [session_id, laps[-1].lap]):
-                laps.append(
-                    Lap(session_id=session_id, lap=(laps[-1].lap + 1), lap_time=None))
-                break
-
-        # Filter so we only include valid laps
-        laps = [lap for lap in laps if lap.lap >= 0]
-
-        # Transform into an ordered dict so lap IDs are preserved as keys.
-        laps_dict = OrderedDict()
-        for lap in laps:
-            laps_dict[lap.lap] = lap
 
         return laps_dict
 
+    def get_lap_sample_ranges(self, session_id, lap):
+        '''
+        Fetches the range of samples recorded during a lap, for use with query()
+        :param session_id the session id
+        :type session_id int
+        :param lap the lap number
+        :type lap int
+        :returns list of (first sample id, last sample id) tuples
+        :type list
+        '''
+        return [(row[0], row[1]) for row in self._conn.execute(
+            'SELECT first_sample_id, last_sample_id FROM lap WHERE session_id = ? AND lap = ? ORDER BY first_sample_id',
+            (session_id, lap))]
+
     def update_session(self, session):
         self._conn.execute("""UPDATE session SET name=?, notes=?, date=? WHERE id=?;""", (
             session.name, session.notes, unix_time(datetime.datetime.now()), session.session_id,))
@@ -1217,6 +2219,11 @@ class DataStore(object):
         :type progress_callback function
         :return the number of rows exported
         """
+        # Exporting takes a while, so read through a connection of its own
+        with self.reader():
+            return self._export_session(session_id, export_file, progress_callback)
+
+    def _export_session(self, session_id, export_file, progress_callback):
 
         def _do_progress_cb(progress):
             if progress_callback is not None:
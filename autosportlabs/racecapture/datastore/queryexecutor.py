@@ -0,0 +1,309 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ('QueryCancelledException', 'QueryTimeoutException', 'QueryFuture', 'QueryExecutor', 'gather_futures')
+import threading
+import traceback
+from Queue import Queue
+from kivy.logger import Logger
+from autosportlabs.util.threadutil import safe_thread_exit
+
+
+class QueryCancelledException(Exception):
+    pass
+
+
+class QueryTimeoutException(Exception):
+    pass
+
+
+class QueryFuture(object):
+    """
+    The pending result of a query. Done callbacks are called on the thread that
+    completes the future, or right away if it is already done.
+    """
+
+    def __init__(self, on_cancel=None):
+        """
+        :param on_cancel function called with the future when it is cancelled
+        :type on_cancel function
+        """
+        self._on_cancel = on_cancel
+        self._lock = threading.Lock()
+        self._done_event = threading.Event()
+        self._callbacks = []
+        self._result = None
+        self._exception = None
+        self._traceback = None
+        self._cancelled = False
+
+    def done(self):
+        return self._done_event.is_set()
+
+    def cancelled(self):
+        return self._cancelled
+
+    def cancel(self):
+        """
+        Cancels the future, unless it is already done
+        :return True if the future was cancelled
+        """
+        if not self._complete(cancelled=True):
+            return False
+        if self._on_cancel is not None:
+            self._on_cancel(self)
+        return True
+
+    def set_result(self, result):
+        return self._complete(result=result)
+
+    def set_exception(self, exception, exception_traceback=None):
+        """
+        :param exception the exception the query failed with
+        :type exception Exception
+        :param exception_traceback the formatted traceback of the exception
+        :type exception_traceback string
+        """
+        return self._complete(exception=exception, exception_traceback=exception_traceback)
+
+    def _complete(self, result=None, exception=None, exception_traceback=None, cancelled=False):
+        with self._lock:
+            if self._done_event.is_set():
+                return False
+            self._result = result
+            self._exception = exception
+            self._traceback = exception_traceback
+            self._cancelled = cancelled
+            self._done_event.set()
+            callbacks = self._callbacks
+            self._callbacks = []
+
+        for callback in callbacks:
+            self._run_callback(callback)
+        return True
+
+    def _run_callback(self, callback):
+        try:
+            callback(self)
+        except Exception as e:
+            Logger.error('QueryFuture: Error in done callback: {}'.format(e))
+            Logger.debug(traceback.format_exc())
+
+    def add_done_callback(self, callback):
+        """
+        :param callback function called with the future once it is done or cancelled
+        :type callback function
+        """
+        with self._lock:
+            if not self._done_event.is_set():
+                self._callbacks.append(callback)
+                return
+        self._run_callback(callback)
+
+    def result(self, timeout=None):
+        """
+        Waits for the result of the query
+        :param timeout seconds to wait, or None to wait indefinitely
+        :type timeout float
+        :return the result. Raises the query's exception if it failed,
+        QueryCancelledException if it was cancelled, or QueryTimeoutException
+        """
+        if not self._done_event.wait(timeout):
+            raise QueryTimeoutException('Timed out waiting for query')
+        if self._cancelled:
+            raise QueryCancelledException('Query was cancelled')
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self):
+        return self._exception
+
+    def exception_traceback(self):
+        """
+        :return the formatted traceback of the query's exception, or None if not known
+        """
+        return self._traceback
+
+
+def gather_futures(futures):
+    """
+    Combines futures into one whose result is the list of their results.
+    Cancelling the combined future cancels the others, and it fails with the
+    first of them to fail.
+    :param futures the futures to combine
+    :type futures list
+    :return QueryFuture
+    """
+    combined = QueryFuture(on_cancel=lambda f: [future.cancel() for future in futures])
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def future_done(future):
+        if future.cancelled():
+            combined.cancel()
+        elif future.exception() is not None:
+            combined.set_exception(future.exception(), future.exception_traceback())
+        else:
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] > 0:
+                    return
+            combined.set_result([f.result() for f in futures])
+
+    if len(futures) == 0:
+        combined.set_result([])
+    for future in futures:
+        future.add_done_callback(future_done)
+    return combined
+
+
+class _QueryTask(object):
+
+    def __init__(self, keys, function, args):
+        self.keys = keys
+        self.function = function
+        self.args = args
+        self.running = False
+        self.futures = []
+
+
+class QueryExecutor(object):
+    """
+    Runs queries against a DataStore on a pool of worker threads, each with a
+    read-only connection of its own, so queries don't hold up the UI thread.
+
+    Queries are identified by keys. A query for keys that are already being
+    queried can join that query rather than repeating it.
+    """
+    DEFAULT_WORKERS = 2
+
+    def __init__(self, datastore, workers=DEFAULT_WORKERS):
+        """
+        :param datastore the open DataStore to query
+        :type datastore DataStore
+        :param workers the number of worker threads
+        :type workers int
+        """
+        self._datastore = datastore
+        self._queue = Queue()
+        self._lock = threading.Lock()
+        self._tasks = {}
+        self._threads = []
+        for index in range(workers):
+            t = threading.Thread(target=self._query_worker, name='QueryExecutor-{}'.format(index))
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, keys, function, *args):
+        """
+        Queues a query
+        :param keys the keys identifying what the query fetches
+        :type keys list
+        :param function the query, called on a worker thread with args
+        :type function function
+        :return QueryFuture for the query's result
+        """
+        task = _QueryTask(keys, function, args)
+        with self._lock:
+            for key in keys:
+                self._tasks[key] = task
+            future = self._add_future(task)
+        self._queue.put(task)
+        return future
+
+    def join(self, key):
+        """
+        Joins a query that is already queued or running
+        :param key a key of the query
+        :return QueryFuture for the query's result, or None if nothing is querying the key
+        """
+        with self._lock:
+            task = self._tasks.get(key)
+            return self._add_future(task) if task is not None else None
+
+    def _add_future(self, task):
+        future = QueryFuture(on_cancel=lambda f: self._future_cancelled(task, f))
+        task.futures.append(future)
+        return future
+
+    def _future_cancelled(self, task, future):
+        with self._lock:
+            if future in task.futures:
+                task.futures.remove(future)
+            # A query nobody is waiting for is dropped, unless it is already running
+            if not task.futures and not task.running:
+                self._remove_task(task)
+
+    def _remove_task(self, task):
+        for key in task.keys:
+            if self._tasks.get(key) is task:
+                self._tasks.pop(key)
+
+    def _query_worker(self):
+        connection = self._datastore.open_reader()
+        self._datastore.use_connection(connection)
+        try:
+            while True:
+                task = self._queue.get()
+                if task is None:
+                    break
+
+                with self._lock:
+                    if not task.futures:
+                        continue
+                    task.running = True
+
+                result = None
+                exception = None
+                exception_traceback = None
+                try:
+                    result = task.function(*task.args)
+                except Exception as e:
+                    exception = e
+                    exception_traceback = traceback.format_exc()
+
+                with self._lock:
+                    self._remove_task(task)
+                    futures = list(task.futures)
+
+                for future in futures:
+                    if exception is not None:
+                        future.set_exception(exception, exception_traceback)
+                    else:
+                        future.set_result(result)
+        finally:
+            self._datastore.use_connection(None)
+            connection.close()
+            safe_thread_exit()
+
+    def shutdown(self, wait=True):
+        """
+        Stops the worker threads once the queued queries have run
+        :param wait True to wait for the worker threads to finish
+        :type wait bool
+        """
+        for t in self._threads:
+            self._queue.put(None)
+        if wait:
+            for t in self._threads:
+                t.join()
+        self._threads = []
@@ -0,0 +1,231 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ('GridIndex', 'distance_meters')
+import heapq
+import math
+from autosportlabs.racecapture.geo.geopoint import RADIUS_EARTH_KM
+
+RADIUS_EARTH_METERS = RADIUS_EARTH_KM * 1000.0
+METERS_PER_DEGREE = math.radians(1) * RADIUS_EARTH_METERS
+DEFAULT_CELL_SIZE_DEGREES = 0.1
+
+
+def distance_meters(latitude1, longitude1, latitude2, longitude2):
+    """
+    The great circle distance between two points, by the haversine formula
+    :return the distance in meters
+    """
+    lat1 = math.radians(latitude1)
+    lat2 = math.radians(latitude2)
+    hav_lat = math.sin((lat2 - lat1) / 2.0) ** 2
+    hav_lon = math.sin(math.radians(longitude2 - longitude1) / 2.0) ** 2
+    a = min(1.0, hav_lat + math.cos(lat1) * math.cos(lat2) * hav_lon)
+    return 2.0 * RADIUS_EARTH_METERS * math.asin(math.sqrt(a))
+
+
+class GridIndex(object):
+    """
+    Finds the points near a location without looking at every point. Points are kept
+    in cells of a fixed latitude / longitude grid, so a search only needs to look at
+    the cells that the search area overlaps.
+    """
+
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE_DEGREES):
+        """
+        :param cell_size the size of the grid's cells, in degrees
+        :type cell_size float
+        """
+        self._cell_size = cell_size
+        self._lon_cells = int(math.ceil(360.0 / cell_size))
+        # (latitude cell, longitude cell) -> {key: (latitude, longitude)}
+        self._cells = {}
+        # key -> cell
+        self._keys = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _cell(self, latitude, longitude):
+        size = self._cell_size
+        return (int(math.floor(latitude / size)), int(math.floor(longitude / size)) % self._lon_cells)
+
+    def insert(self, key, latitude, longitude):
+        """
+        Adds a point, replacing any point already added with the same key
+        :param key identifies the point
+        :param latitude the point's latitude
+        :type latitude float
+        :param longitude the point's longitude
+        :type longitude float
+        """
+        self.remove(key)
+        cell = self._cell(latitude, longitude)
+        self._cells.setdefault(cell, {})[key] = (latitude, longitude)
+        self._keys[key] = cell
+
+    def remove(self, key):
+        """
+        Removes a point, if it was added
+        :param key identifies the point
+        """
+        cell = self._keys.pop(key, None)
+        if cell is None:
+            return
+        points = self._cells[cell]
+        del points[key]
+        if not points:
+            del self._cells[cell]
+
+    def clear(self):
+        self._cells.clear()
+        self._keys.clear()
+
+    def _ring(self, center, radius):
+        """
+        The cells at exactly radius cells from center, in either direction
+        """
+        lat_cell, lon_cell = center
+        lon_cells = self._lon_cells
+        if radius == 0:
+            yield center
+            return
+        # wrapping around the antimeridian, a ring as wide as the world only covers each cell once
+        lon_range = range(lon_cell - radius, lon_cell + radius + 1)
+        if len(lon_range) > lon_cells:
+            lon_range = range(lon_cells)
+        lon_range = set([c % lon_cells for c in lon_range])
+        for lon in lon_range:
+            yield (lat_cell - radius, lon)
+            yield (lat_cell + radius, lon)
+        west = (lon_cell - radius) % lon_cells
+        east = (lon_cell + radius) % lon_cells
+        for lat in range(lat_cell - radius + 1, lat_cell + radius):
+            yield (lat, west)
+            if east != west:
+                yield (lat, east)
+
+    def _min_distance_outside(self, latitude, radius):
+        """
+        A lower bound on the distance from a point to anything outside the cells
+        within radius cells of its own
+        """
+        if radius == 0:
+            return 0.0
+        # the point can be anywhere in its cell, so only radius - 1 whole cells separate it from the next ring
+        span = math.radians((radius - 1) * self._cell_size)
+        lat = math.radians(abs(latitude))
+        # a point further away in latitude is at least that far away
+        lat_bound = span * RADIUS_EARTH_METERS
+        # a point further away in longitude, while within span in latitude, is at least this far away
+        lat_far = min(math.pi / 2.0, lat + span)
+        a = math.cos(lat) * math.cos(lat_far) * math.sin(min(span, math.pi) / 2.0) ** 2
+        lon_bound = 2.0 * RADIUS_EARTH_METERS * math.asin(math.sqrt(min(1.0, a)))
+        return min(lat_bound, lon_bound)
+
+    def within_radius(self, latitude, longitude, meters):
+        """
+        Finds the points within a distance of a location
+        :param latitude the location's latitude
+        :type latitude float
+        :param longitude the location's longitude
+        :type longitude float
+        :param meters the distance
+        :type meters float
+        :return list of (distance in meters, key), nearest first
+        """
+        size = self._cell_size
+        lat_span = meters / METERS_PER_DEGREE
+        min_lat_cell = int(math.floor((latitude - lat_span) / size))
+        max_lat_cell = int(math.floor((latitude + lat_span) / size))
+
+        # longitude degrees shrink towards the poles; near one, search every longitude
+        max_abs_lat = min(90.0, abs(latitude) + lat_span)
+        cos_lat = math.cos(math.radians(max_abs_lat))
+        lon_span = 360.0 if cos_lat < 1e-6 else lat_span / cos_lat
+        lon_cells = self._lon_cells
+        if lon_span >= 180.0:
+            lon_cell_range = range(lon_cells)
+        else:
+            min_lon_cell = int(math.floor((longitude - lon_span) / size))
+            max_lon_cell = int(math.floor((longitude + lon_span) / size))
+            lon_cell_range = set([c % lon_cells for c in range(min_lon_cell, max_lon_cell + 1)])
+
+        found = []
+        cells = self._cells
+        if len(cells) < (max_lat_cell - min_lat_cell + 1) * len(lon_cell_range):
+            # fewer cells are occupied than would be searched
+            candidates = cells.itervalues()
+        else:
+            candidates = (cells[(lat, lon)] for lat in range(min_lat_cell, max_lat_cell + 1)
+                          for lon in lon_cell_range if (lat, lon) in cells)
+        for points in candidates:
+            for key, (lat, lon) in points.iteritems():
+                distance = distance_meters(latitude, longitude, lat, lon)
+                if distance <= meters:
+                    found.append((distance, key))
+        found.sort()
+        return found
+
+    def nearest(self, latitude, longitude, count=1, max_meters=None):
+        """
+        Finds the points nearest to a location
+        :param latitude the location's latitude
+        :type latitude float
+        :param longitude the location's longitude
+        :type longitude float
+        :param count the number of points to find
+        :type count int
+        :param max_meters only find points within this distance, if specified
+        :type max_meters float
+        :return list of (distance in meters, key), nearest first
+        """
+        if max_meters is not None:
+            return self.within_radius(latitude, longitude, max_meters)[:count]
+
+        cells = self._cells
+        center = self._cell(latitude, longitude)
+        # the furthest ring that can hold anything
+        max_radius = int(math.ceil(180.0 / self._cell_size))
+        nearest = []
+        radius = 0
+        while radius <= max_radius:
+            if len(nearest) >= count and -nearest[0][0] <= self._min_distance_outside(latitude, radius):
+                break
+            if (2 * radius + 1) ** 2 > 2 * len(cells):
+                # the rings now reach more cells than are occupied; look at what's left directly
+                return sorted(self._distances(latitude, longitude, cells.itervalues()))[:count]
+            for cell in self._ring(center, radius):
+                points = cells.get(cell)
+                if points is None:
+                    continue
+                for distance, key in self._distances(latitude, longitude, (points,)):
+                    # a max heap of the nearest points found so far
+                    if len(nearest) < count:
+                        heapq.heappush(nearest, (-distance, key))
+                    elif distance < -nearest[0][0]:
+                        heapq.heapreplace(nearest, (-distance, key))
+            radius += 1
+        return sorted((-distance, key) for distance, key in nearest)
+
+    def _distances(self, latitude, longitude, cell_points):
+        for points in cell_points:
+            for key, (lat, lon) in points.iteritems():
+                yield (distance_meters(latitude, longitude, lat, lon), key)
@@ -21,19 +21,18 @@
 import uuid
 from datetime import datetime
 import json
-import time
 import copy
 import errno
+import hashlib
 import string
 from threading import Thread, Lock
-import urllib2
 import os
 import os.path
 import traceback
-from StringIO import StringIO
-import gzip
 import zipfile
 from autosportlabs.util.timeutil import time_to_epoch, epoch_to_time
+from autosportlabs.util.threadutil import imap_unordered
+from autosportlabs.util.jsonclient import JsonClient
 from kivy.logger import Logger
 from collections import OrderedDict
 
@@ -94,6 +93,11 @@ class PresetManager(object):
     READ_RETRIES = 3
     RETRY_DELAY = 1.0
     PRESET_DOWNLOAD_TIMEOUT = 30
+    PRESET_PAGE_SIZE = 100
+    # the most preset and image requests made at once
+    MAX_DOWNLOAD_WORKERS = 4
+    # what is known about each downloaded preview image, to tell if it needs downloading again
+    IMAGE_CACHE_FILE = 'image_cache.json'
 
     def __init__(self, **kwargs):
         self.on_progress = lambda self, value: value
@@ -104,12 +108,33 @@ class PresetManager(object):
 
         self.update_lock = Lock()
         self.presets = OrderedDict()
+        # mapping_type -> OrderedDict of the presets of that type
+        self._presets_by_type = {}
+        # preset file name -> (modified time, size, preset), so unchanged files aren't parsed again
+        self._preset_files = {}
+        self._image_cache_lock = Lock()
+        self._image_cache = None
+        self._json_client = JsonClient('PresetManager', PresetManager.READ_RETRIES, PresetManager.RETRY_DELAY, PresetManager.PRESET_DOWNLOAD_TIMEOUT)
 
     def get_preset_by_id(self, id):
         return self.presets.get(id)
 
     def get_presets_by_type(self, type):
-        return OrderedDict ((k, v) for k, v in self.presets.items() if v.mapping_type == type).items()
+        return self._presets_by_type.get(type, {}).items()
+
+    def _set_preset(self, preset):
+        """
+        Adds a preset, or replaces the one with the same id, keeping the index by type up to date
+        """
+        existing = self.presets.get(preset.mapping_id)
+        if existing is not None and existing.mapping_type != preset.mapping_type:
+            self._presets_by_type[existing.mapping_type].pop(preset.mapping_id, None)
+        self.presets[preset.mapping_id] = preset
+        self._presets_by_type.setdefault(preset.mapping_type, OrderedDict())[preset.mapping_id] = preset
+
+    def _clear_presets(self):
+        self.presets.clear()
+        self._presets_by_type.clear()
 
     def set_presets_user_dir(self, path):
         try:
@@ -126,25 +151,7 @@ class PresetManager(object):
     def load_json(self, uri):
         """Semi-generic method for fetching JSON data
         """
-        retries = 0
-        while retries < self.READ_RETRIES:
-            try:
-                opener = urllib2.build_opener()
-                opener.addheaders = [('Accept', 'application/json'), ('Accept-encoding', 'gzip')]
-                response = opener.open(uri, timeout=PresetManager.PRESET_DOWNLOAD_TIMEOUT)
-                data = response.read()
-                if response.info().get('Content-Encoding') == 'gzip':
-                    string_buffer = StringIO(data)
-                    data = gzip.GzipFile(fileobj=string_buffer).read()
-                j = json.loads(data)
-                return j
-            except Exception as detail:
-                Logger.warning('PresetManager: Failed to read: from {} : {}'.format(uri, traceback.format_exc()))
-                if retries < self.READ_RETRIES:
-                    Logger.warning('PresetManager: retrying in ' + str(self.RETRY_DELAY) + ' seconds...')
-                    retries += 1
-                    time.sleep(self.RETRY_DELAY)
-        raise Exception('Error reading json doc from: ' + uri)
+        return self._json_client.get_json(uri)
 
     def download_all_presets(self):
         """Downloads all presets, then turns them into Preset objects
@@ -159,41 +166,44 @@ class PresetManager(object):
 
         return presets
 
+    def _fetch_preset_page(self, uri):
+        response = self.load_json(uri)
+        total_mappings = response.get('total', None)
+        mappings = response.get('mappings', None)
+        if total_mappings is None:
+            raise MissingKeyException('Mapping list JSON: could not get total preset count')
+        if mappings is None:
+            raise MissingKeyException('Mapping list JSON: could not get preset list')
+        return int(total_mappings), mappings
+
     def fetch_preset_list(self, full_response=False):
         """Fetches all presets from RCL's API and returns them as an array of dicts. RCL's API normally returns minimal
         object information when listing multiple objects. The 'full_response' arg tells this function to expand
         all objects to contain all their data. This allows us to quickly get basic information about presets or pull
         down everything if we have no presets locally.
+        The first page gives the number of presets; the rest of the pages are then fetched at once.
         """
-
-        total_mappings = None
-        next_uri = self.PRESET_URL + "?start=0&per_page=100"
-
+        page_uri = self.PRESET_URL + '?start={}&per_page=' + str(self.PRESET_PAGE_SIZE)
         if full_response:
-            next_uri += '&expand=1'
+            page_uri += '&expand=1'
 
-        mappings_list = []
-
-        while next_uri:
-            Logger.info('PresetManager: Fetching preset data: {}'.format(next_uri))
-            response = self.load_json(next_uri)
+        def fetch_page(start):
+            uri = page_uri.format(start)
+            Logger.info('PresetManager: Fetching preset data: {}'.format(uri))
             try:
-                if total_mappings is None:
-                    total_mappings = int(response.get('total', None))
-                    if total_mappings is None:
-                        raise MissingKeyException('Mapping list JSON: could not get total preset count')
-
-                mappings = response.get('mappings', None)
-
-                if mappings is None:
-                    raise MissingKeyException('Mapping list JSON: could not get preset list')
-
-                mappings_list += mappings
-                next_uri = response.get('nextURI')
-
+                return self._fetch_preset_page(uri)[1]
             except MissingKeyException as detail:
-                Logger.error('PresetManager: Malformed venue JSON from url ' + next_uri + '; json =  ' + str(response) +
-                             ' ' + str(detail))
+                Logger.error('PresetManager: Malformed preset JSON from url ' + uri + '; ' + str(detail))
+                return []
+
+        total_mappings, mappings_list = self._fetch_preset_page(page_uri.format(0))
+        page_size = len(mappings_list) or self.PRESET_PAGE_SIZE
+        pages = {}
+        for start, mappings in imap_unordered(fetch_page, range(page_size, total_mappings, page_size), self.MAX_DOWNLOAD_WORKERS):
+            pages[start] = mappings
+        # keep the order the API lists the presets in
+        for start in sorted(pages.keys()):
+            mappings_list += pages[start]
 
         Logger.info('PresetManager: fetched list of ' + str(len(mappings_list)) + ' presets')
 
@@ -219,7 +229,7 @@ class PresetManager(object):
         :type preset Preset
         """
         self._save_preset(preset)
-        self.presets[preset.mapping_id] = preset
+        self._set_preset(preset)
 
     def _save_preset(self, preset):
         path = os.path.join(self.presets_user_dir, str(preset.mapping_id) + '.json')
@@ -227,20 +237,83 @@ class PresetManager(object):
         with open(path, 'w') as text_file:
             text_file.write(preset_json_string)
 
-    def _download_preset_image(self, preset):
-        image_url = preset.image_url
-        if image_url:
-            extension = None
-            extension = '.jpg' if '.jpg' in image_url else extension
-            extension = '.png' if '.png' in image_url else extension
+    def _load_image_cache(self):
+        if self._image_cache is None:
+            self._image_cache = {}
+            path = os.path.join(self.presets_user_dir, PresetManager.IMAGE_CACHE_FILE)
+            if os.path.isfile(path):
+                try:
+                    with open(path) as cache_file:
+                        self._image_cache = json.load(cache_file)
+                except (IOError, ValueError) as e:
+                    Logger.warning('PresetManager: could not load image cache: {}'.format(e))
+        return self._image_cache
+
+    def _save_image_cache(self):
+        with self._image_cache_lock:
+            if self._image_cache is None:
+                return
+            cache_json_string = json.dumps(self._image_cache, sort_keys=True, separators=(',', ':'))
+        path = os.path.join(self.presets_user_dir, PresetManager.IMAGE_CACHE_FILE)
+        with open(path, 'w') as text_file:
+            text_file.write(cache_json_string)
 
-            request = urllib2.Request(image_url, headers={'User-Agent': 'ASL mapping builder'})
-            response = urllib2.urlopen(request, timeout=PresetManager.PRESET_DOWNLOAD_TIMEOUT)
-            data = response.read()
+    def _cached_image_entry(self, preset, path):
+        """
+        Gets what is known about a preset's downloaded image, if the image on disk is still the one downloaded
+        """
+        with self._image_cache_lock:
+            entry = self._load_image_cache().get(str(preset.mapping_id))
+        if entry is None or entry.get('url') != preset.image_url:
+            return None
+        try:
+            if os.path.getsize(path) != entry.get('size'):
+                return None
+            with open(path, 'rb') as image_file:
+                if hashlib.sha1(image_file.read()).hexdigest() != entry.get('sha1'):
+                    return None
+        except (IOError, OSError):
+            return None
+        return entry
 
-            image_file = '{}{}'.format(preset.mapping_id, extension)
-            path = os.path.join(self.presets_user_dir, image_file)
-            open(path, 'wb').write(data)
+    def _download_preset_image(self, preset):
+        """
+        Downloads a preset's preview image, unless the copy already downloaded is still current
+        :param preset the preset
+        :type preset Preset
+        :return True if the image was downloaded
+        """
+        image_file = self._image_url_to_local_path(preset.mapping_id, preset.image_url)
+        if not image_file:
+            return False
+        path = os.path.join(self.presets_user_dir, image_file)
+
+        headers = {'User-Agent': 'ASL mapping builder'}
+        entry = self._cached_image_entry(preset, path)
+        if entry is not None:
+            if not entry.get('etag'):
+                # without a validator, an intact copy of the same image url is taken as current
+                return False
+            headers['If-None-Match'] = entry['etag']
+
+        status, response_headers, data = self._json_client.get(preset.image_url, headers)
+        if status == 304:
+            return False
+
+        # write a new file and swap it in, so a partial write never replaces a good image
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as image_file:
+            image_file.write(data)
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(temp_path, path)
+
+        with self._image_cache_lock:
+            self._load_image_cache()[str(preset.mapping_id)] = {'url': preset.image_url,
+                                                                'etag': response_headers.get('etag'),
+                                                                'size': len(data),
+                                                                'sha1': hashlib.sha1(data).hexdigest()}
+        return True
 
     def _load_current_mappings_worker(self, success_cb, fail_cb, progress_cb=None):
         """Method for loading local preset files in a separate thread
@@ -273,28 +346,37 @@ class PresetManager(object):
             t.daemon = True
             t.start()
         else:
-            preset_file_names = [f for f in os.listdir(self.presets_user_dir) if f.endswith('.json')]
-            self.presets.clear()
+            preset_file_names = [f for f in os.listdir(self.presets_user_dir) if f.endswith('.json') and f != PresetManager.IMAGE_CACHE_FILE]
+            self._clear_presets()
             preset_count = len(preset_file_names)
             count = 0
+            preset_files = {}
 
             for preset_path in preset_file_names:
                 try:
-                    json_data = open(os.path.join(self.presets_user_dir, preset_path))
-                    preset_dict = json.load(json_data)
-
-                    if preset_dict is not None:
+                    path = os.path.join(self.presets_user_dir, preset_path)
+                    stat = os.stat(path)
+                    loaded = self._preset_files.get(preset_path)
+                    if loaded is not None and loaded[0] == stat.st_mtime and loaded[1] == stat.st_size:
+                        preset = loaded[2]
+                    else:
+                        with open(path) as json_data:
+                            preset_dict = json.load(json_data)
+                        if preset_dict is None:
+                            continue
                         preset = Preset()
                         preset.from_dict(preset_dict)
                         self._set_preset_local_path(preset)
+                    preset_files[preset_path] = (stat.st_mtime, stat.st_size, preset)
 
-                        self.presets[preset.mapping_id] = preset
-                        count += 1
-                        if progress_cb:
-                            progress_cb(count=preset.count, total=preset_count, message=preset.name)
+                    self._set_preset(preset)
+                    count += 1
+                    if progress_cb:
+                        progress_cb(count=count, total=preset_count, message=preset.name)
                 except Exception as detail:
                     Logger.warning('PresetManager: failed to read preset file ' + preset_path + ';\n' + str(detail))
                     raise
+            self._preset_files = preset_files
 
 
     def _set_preset_local_path(self, preset):
@@ -343,48 +425,48 @@ class PresetManager(object):
         else:
             if len(self.presets) == 0:
                 Logger.info("PresetManager: No presets found locally, fetching all presets")
-                preset_list = self.download_all_presets()
-                count = 0
-                total = len(preset_list)
+                preset_list = self.download_all_presets().values()
 
-                for mapping_id, preset in preset_list.iteritems():
-                    count += 1
-                    if progress_cb:
-                        progress_cb(count=count, total=total, message=preset.name)
+                def sync_preset(preset):
                     self._save_preset(preset)
                     self._download_preset_image(preset)
-                    self._set_preset_local_path(preset)
-                    self.presets[mapping_id] = preset
+                    return preset
             else:
                 Logger.info("PresetManager: refreshing presets")
-                venues = self.fetch_preset_list(full_response=False)
-
-                preset_count = len(venues)
-                count = 0
+                mappings = self.fetch_preset_list(full_response=False)
 
-                for venue in venues:
-                    update = False
-                    count += 1
-                    preset_id = venue.get('id')
-
-                    if self.presets.get(preset_id) is None:
+                preset_list = []
+                for mapping in mappings:
+                    preset_id = mapping.get('id')
+                    preset = self.presets.get(preset_id)
+                    if preset is None:
                         Logger.info('PresetManager: new preset detected: {}'.format(preset_id))
-                        update = True
-                    elif not self.presets[preset_id].updated == venue['updated']:
+                        preset_list.append(preset_id)
+                    elif not preset.updated == mapping['updated']:
                         Logger.info('PresetManager: existing preset changed: {}'.format(preset_id))
-                        update = True
-
-                    if update:
-                        updated_preset = self.download_preset(preset_id)
-                        if updated_preset is not None:
-                            self._save_preset(updated_preset)
-                            self._download_preset_image(updated_preset)
-                            self._set_preset_local_path(updated_preset)
-                            self.presets[preset_id] = updated_preset
-                            if progress_cb:
-                                progress_cb(count=count, total=preset_count, message=updated_preset.name)
-                    else:
-                        progress_cb(count=count, total=preset_count)
+                        preset_list.append(preset_id)
+                Logger.info('PresetManager: downloading {} of {} presets'.format(len(preset_list), len(mappings)))
+
+                def sync_preset(preset_id):
+                    preset = self.download_preset(preset_id)
+                    if preset is not None:
+                        self._save_preset(preset)
+                        self._download_preset_image(preset)
+                    return preset
+
+            # presets and their images are fetched a few at a time, over shared connections
+            total = len(preset_list)
+            count = 0
+            try:
+                for item, preset in imap_unordered(sync_preset, preset_list, self.MAX_DOWNLOAD_WORKERS):
+                    count += 1
+                    if preset is not None:
+                        self._set_preset_local_path(preset)
+                        self._set_preset(preset)
+                        if progress_cb:
+                            progress_cb(count=count, total=total, message=preset.name)
+            finally:
+                self._save_image_cache()
 
 
 class MissingKeyException(Exception):
@@ -192,6 +192,9 @@ class UserPrefs(EventDispatcher):
         self.config.setdefault('dashboard_preferences', 'pitstoptimer_trigger_speed', 5)
         self.config.setdefault('dashboard_preferences', 'pitstoptimer_alert_speed', 25)
         self.config.setdefault('dashboard_preferences', 'pitstoptimer_exit_speed', 55)
+        # the slowest and fastest rates gauges are updated at, in Hz
+        self.config.setdefault('dashboard_preferences', 'min_update_rate', 10)
+        self.config.setdefault('dashboard_preferences', 'max_update_rate', 50)
 
         # Track detection pref
         self.config.adddefaultsection('track_detection')
@@ -21,20 +21,20 @@
 import uuid
 from datetime import datetime
 import json
-import time
 import copy
 import errno
 import string
 from threading import Thread, Lock
-import urllib2
 import os
 import traceback
-from StringIO import StringIO
-import gzip
 import zipfile
 from autosportlabs.racecapture.geo.geopoint import GeoPoint, Region
+from autosportlabs.racecapture.geo.spatialindex import GridIndex
+from autosportlabs.racecapture.tracks.trackstore import TrackStore
 from autosportlabs.racecapture.config.rcpconfig import Track
 from autosportlabs.util.timeutil import time_to_epoch, epoch_to_time
+from autosportlabs.util.threadutil import imap_unordered
+from autosportlabs.util.jsonclient import JsonClient
 from kivy.logger import Logger
 
 
@@ -46,7 +46,10 @@ class TrackMap(object):
 
     def __init__(self):
         self.custom = False
-        self.map_points = []
+        self._map_points = []
+        # reads the map points when they're first used, for tracks loaded from the track store
+        self._map_points_loader = None
+        self._center = None
         self.sector_points = []
         self.name = TrackMap.DEFAULT_TRACK_NAME
         self.configuration = TrackMap.DEFAULT_CONFIGURATION
@@ -92,13 +95,39 @@ class TrackMap(object):
         """
         return '{} {}'.format(self.name, '' if self.configuration is None or self.configuration.strip() == '' else '({})'.format(self.configuration))
 
+    @property
+    def map_points(self):
+        loader = self._map_points_loader
+        if loader is not None:
+            self._map_points_loader = None
+            self._map_points = loader(self.track_id)
+        return self._map_points
+
+    @map_points.setter
+    def map_points(self, map_points):
+        self._map_points_loader = None
+        self._map_points = map_points
+
+    def set_map_points_loader(self, loader, center):
+        """
+        Defers reading the map points until they're first used
+        :param loader called with the track id to read the map points
+        :type loader function
+        :param center the first map point, which stands in as the centerpoint until then
+        :type center GeoPoint
+        """
+        self._map_points_loader = loader
+        self._center = center
+
     @property
     def centerpoint(self):
         """
         Return the a reference point for the map
         """
-        if len(self.map_points) > 0:
-            return self.map_points[0]
+        if self._map_points_loader is not None:
+            return self._center
+        if len(self._map_points) > 0:
+            return self._map_points[0]
         return None
 
     @property
@@ -181,17 +210,26 @@ class TrackManager(object):
     TRACK_DEFAULT_SEARCH_RADIUS_METERS = 2000
     TRACK_DEFAULT_SEARCH_BEARING_DEGREES = 360
     TRACK_DOWNLOAD_TIMEOUT = 30
+    VENUE_PAGE_SIZE = 100
+    # the most venue requests made at once
+    MAX_DOWNLOAD_WORKERS = 4
+    TRACK_STORE_FILE = 'tracks.db'
 
     def __init__(self, **kwargs):
         self.on_progress = lambda self, value: value
         self.tracks_user_dir = '.'
         self.track_user_subdir = '/venues'
-        self.set_tracks_user_dir(kwargs.get('user_dir', self.tracks_user_dir) + self.track_user_subdir)
+        user_dir = kwargs.get('user_dir', self.tracks_user_dir)
+        self.set_tracks_user_dir(user_dir + self.track_user_subdir)
+        self._track_store = TrackStore(os.path.join(user_dir, TrackManager.TRACK_STORE_FILE))
         self.update_lock = Lock()
         self.regions = []
+        self._json_client = JsonClient('TrackManager', TrackManager.READ_RETRIES, TrackManager.RETRY_DELAY, TrackManager.TRACK_DOWNLOAD_TIMEOUT)
 
         # Tracks are stored as key/object pairs to aid in finding a particular track quickly
         self.tracks = {}
+        # the tracks' centerpoints, indexed by location
+        self._track_index = GridIndex()
         self.track_ids_in_region = []
         self.base_dir = kwargs.get('base_dir')
 
@@ -237,6 +275,14 @@ class TrackManager(object):
                 return track
         return None
 
+    def _set_track(self, track):
+        self.tracks[track.track_id] = track
+        center = track.centerpoint
+        if center is not None:
+            self._track_index.insert(track.track_id, center.latitude, center.longitude)
+        else:
+            self._track_index.remove(track.track_id)
+
     def find_nearby_tracks(self, point, searchRadius=None, searchBearing=None):
         """
         find a list of nearby tracks near the specified point, ordered by most recent first.
@@ -244,26 +290,33 @@ class TrackManager(object):
         :type point GeoPoint
         :param searchRadius the search radius in meters. Defaults to TRACK_DEFAULT_SEARCH_RADIUS_METERS
         :type searchRadius float
-        :param searchBearing the bearing in degrees to search. 
-        :type searchBearing float. Defaults to TRACK_DEFAULT_SEARCH_BEARING_DEGREES
+        :param searchBearing no longer used; the search covers a true circle around the point
+        :type searchBearing float
         """
         if searchRadius is None:
             searchRadius = TrackManager.TRACK_DEFAULT_SEARCH_RADIUS_METERS
-        if searchBearing is None:
-            searchBearing = TrackManager.TRACK_DEFAULT_SEARCH_BEARING_DEGREES
 
-        tracks = []
-        radius = point.metersToDegrees(searchRadius, searchBearing)
-        for trackId in self.tracks.keys():
-            track = self.tracks[trackId]
-            trackCenter = track.centerpoint
-            if trackCenter and trackCenter.withinCircle(point, radius):
-                tracks.append(track)
+        tracks = [self.tracks[track_id] for distance, track_id in
+                  self._track_index.within_radius(point.latitude, point.longitude, searchRadius)]
 
         # order by short id, which is timestamp
         tracks.sort(key=lambda x: x.short_id, reverse=True)
         return tracks
 
+    def find_nearest_tracks(self, point, count=1, max_distance=None):
+        """
+        find the tracks nearest to the specified point, nearest first.
+        :param point the point to reference
+        :type point GeoPoint
+        :param count the number of tracks to find
+        :type count int
+        :param max_distance only find tracks within this many meters, if specified
+        :type max_distance float
+        :return list of (distance in meters, track)
+        """
+        return [(distance, self.tracks[track_id]) for distance, track_id in
+                self._track_index.nearest(point.latitude, point.longitude, count, max_distance)]
+
     def filter_tracks_by_name(self, name, track_ids=None):
         if track_ids is None:
             track_ids = self.tracks.keys()
@@ -315,74 +368,69 @@ class TrackManager(object):
     def load_json(self, uri):
         """Semi-generic method for fetching JSON data
         """
-        retries = 0
-        while retries < self.READ_RETRIES:
-            try:
-                opener = urllib2.build_opener()
-                opener.addheaders = [('Accept', 'application/json'), ('Accept-encoding', 'gzip')]
-                response = opener.open(uri, timeout=TrackManager.TRACK_DOWNLOAD_TIMEOUT)
-                data = response.read()
-                if response.info().get('Content-Encoding') == 'gzip':
-                    string_buffer = StringIO(data)
-                    data = gzip.GzipFile(fileobj=string_buffer).read()
-                j = json.loads(data)
-                return j
-            except Exception as detail:
-                Logger.warning('TrackManager: Failed to read: from {} : {}'.format(uri, traceback.format_exc()))
-                if retries < self.READ_RETRIES:
-                    Logger.warning('TrackManager: retrying in ' + str(self.RETRY_DELAY) + ' seconds...')
-                    retries += 1
-                    time.sleep(self.RETRY_DELAY)
-        raise Exception('Error reading json doc from: ' + uri)
-
-    def download_all_tracks(self):
+        return self._json_client.get_json(uri)
+
+    def download_all_tracks(self, on_tracks=None):
         """Downloads all venues from RCL, then turns them into Track objects
+        :param on_tracks called with each page of tracks as it arrives, and the number of tracks
+        :type on_tracks function
         """
         tracks = {}
-        venues = self.fetch_venue_list(True)
 
-        for venue in venues:
+        def add_venues(venues, total):
+            page = []
+            for venue in venues:
                 track = TrackMap()
                 track.from_dict(venue)
                 tracks[track.track_id] = track
+                page.append(track)
+            if on_tracks:
+                on_tracks(page, total)
 
+        self.fetch_venue_list(True, add_venues)
         return tracks
 
-    def fetch_venue_list(self, full_response=False):
+    def _fetch_venue_page(self, uri):
+        response = self.load_json(uri)
+        total_venues = response.get('total', None)
+        venues = response.get('venues', None)
+        if total_venues is None:
+            raise MissingKeyException('Venue list JSON: could not get total venue count')
+        if venues is None:
+            raise MissingKeyException('Venue list JSON: could not get venue list')
+        return int(total_venues), venues
+
+    def fetch_venue_list(self, full_response=False, on_venues=None):
         """Fetches all venues from RCL's API and returns them as an array of dicts. RCL's API normally returns minimal
         object information when listing multiple objects. The 'full_response' arg tells this function to expand
         all objects to contain all their data. This allows us to quickly get basic information about tracks or pull
         down everything if we have no tracks locally.
+        The first page gives the number of venues; the rest of the pages are then fetched at once.
+        :param on_venues called with each page of venues as it arrives, and the number of venues
+        :type on_venues function
         """
-
-        total_venues = None
-        next_uri = self.RCP_VENUE_URL + "?start=0&per_page=100"
-
+        page_uri = self.RCP_VENUE_URL + '?start={}&per_page=' + str(self.VENUE_PAGE_SIZE)
         if full_response:
-            next_uri += '&expand=1'
+            page_uri += '&expand=1'
 
-        venues_list = []
-
-        while next_uri:
-            Logger.info('TrackManager: Fetching venue data: {}'.format(next_uri))
-            response = self.load_json(next_uri)
+        def fetch_page(start):
+            uri = page_uri.format(start)
+            Logger.info('TrackManager: Fetching venue data: {}'.format(uri))
             try:
-                if total_venues is None:
-                    total_venues = int(response.get('total', None))
-                    if total_venues is None:
-                        raise MissingKeyException('Venue list JSON: could not get total venue count')
-
-                venues = response.get('venues', None)
-
-                if venues is None:
-                    raise MissingKeyException('Venue list JSON: could not get venue list')
+                return self._fetch_venue_page(uri)[1]
+            except MissingKeyException as detail:
+                Logger.error('TrackManager: Malformed venue JSON from url ' + uri + '; ' + str(detail))
+                return []
 
-                venues_list += venues
-                next_uri = response.get('nextURI')
+        total_venues, venues_list = self._fetch_venue_page(page_uri.format(0))
+        if on_venues:
+            on_venues(venues_list, total_venues)
 
-            except MissingKeyException as detail:
-                Logger.error('TrackManager: Malformed venue JSON from url ' + next_uri + '; json =  ' + str(response) +
-                             ' ' + str(detail))
+        page_size = len(venues_list) or self.VENUE_PAGE_SIZE
+        for start, venues in imap_unordered(fetch_page, range(page_size, total_venues, page_size), self.MAX_DOWNLOAD_WORKERS):
+            venues_list += venues
+            if on_venues:
+                on_venues(venues, total_venues)
 
         Logger.info('TrackManager: fetched list of ' + str(len(venues_list)) + ' tracks')
 
@@ -408,13 +456,10 @@ class TrackManager(object):
         :type track TrackMap
         """
         self.save_track(track)
-        self.tracks[track.track_id] = track
+        self._set_track(track)
 
     def save_track(self, track):
-        path = os.path.join(self.tracks_user_dir, track.track_id + '.json')
-        track_json_string = json.dumps(track.to_dict(), sort_keys=True, indent=2, separators=(',', ': '))
-        with open(path, 'w') as text_file:
-            text_file.write(track_json_string)
+        self._track_store.save_track(track)
 
     def load_current_tracks_worker(self, success_cb, fail_cb, progress_cb=None):
         """Method for loading local tracks files in a separate thread
@@ -430,6 +475,8 @@ class TrackManager(object):
             self.update_lock.release()
 
     def check_load_default_tracks(self):
+        if len(self._track_store) > 0:
+            return
         track_file_names = os.listdir(self.tracks_user_dir)
         if (len(track_file_names) == 0):
             Logger.info("TrackManager: No tracks found; loading defaults")
@@ -447,38 +494,58 @@ class TrackManager(object):
             t.daemon = True
             t.start()
         else:
-            track_file_names = os.listdir(self.tracks_user_dir)
+            track_store = self._track_store
+            if len(track_store) == 0:
+                self._import_track_files()
+
+            track_dicts = track_store.load_metadata()
             self.tracks.clear()
-            track_count = len(track_file_names)
+            self._track_index.clear()
+            track_count = len(track_dicts)
             count = 0
 
-            for trackPath in track_file_names:
+            for track_dict in track_dicts:
                 try:
-                    json_data = open(os.path.join(self.tracks_user_dir, trackPath))
-                    track_dict = json.load(json_data)
-                    resave = False
-
-                    # Backwards compatible-check for old format of track files
-                    if 'venue' in track_dict:
-                        track_dict = track_dict.get('venue')
-                        resave = True
-
-                    if track_dict is not None:
-                        track = TrackMap()
-                        track.from_dict(track_dict)
-                        if resave:
-                            self.save_track(track)
-
-                        self.tracks[track.track_id] = track
-                        count += 1
-                        if progress_cb:
-                            progress_cb(count=track.count, total=track_count, message=track.name)
+                    track = TrackMap()
+                    track.from_dict(track_dict)
+                    track.set_map_points_loader(track_store.load_map_points, GeoPoint.fromPointJson(track_dict.get('center')))
+                    self._set_track(track)
+                    count += 1
+                    if progress_cb:
+                        progress_cb(count=count, total=track_count, message=track.name)
                 except Exception as detail:
-                    Logger.warning('TrackManager: failed to read track file ' + trackPath + ';\n' + str(detail))
+                    Logger.warning('TrackManager: failed to read track ' + str(track_dict.get('id')) + ';\n' + str(detail))
 
             del self.track_ids_in_region[:]
             self.track_ids_in_region.extend(self.track_ids)
 
+    def _import_track_files(self):
+        """
+        Copies the tracks saved as a JSON file each, as earlier versions kept them, into the track store.
+        The files are left in place, but are no longer read once the store holds tracks.
+        """
+        track_file_names = [name for name in os.listdir(self.tracks_user_dir) if name.endswith('.json')]
+        if len(track_file_names) == 0:
+            return
+        Logger.info('TrackManager: importing {} track files'.format(len(track_file_names)))
+        tracks = []
+        for trackPath in track_file_names:
+            try:
+                with open(os.path.join(self.tracks_user_dir, trackPath)) as json_data:
+                    track_dict = json.load(json_data)
+
+                # Backwards compatible-check for old format of track files
+                if 'venue' in track_dict:
+                    track_dict = track_dict.get('venue')
+
+                if track_dict is not None:
+                    track = TrackMap()
+                    track.from_dict(track_dict)
+                    tracks.append(track)
+            except Exception as detail:
+                Logger.warning('TrackManager: failed to read track file ' + trackPath + ';\n' + str(detail))
+        self._track_store.save_tracks(tracks)
+
     def update_all_tracks_worker(self, success_cb, fail_cb, progress_cb=None):
         """Method for updating all tracks in a separate thread
         """
@@ -505,46 +572,46 @@ class TrackManager(object):
             t.daemon = True
             t.start()
         else:
+            # each track is saved as soon as it arrives, so a refresh that's interrupted
+            # picks up where it stopped: the tracks it saved are up to date the next time
             if len(self.tracks) == 0:
                 Logger.info("TrackManager: No tracks found locally, fetching all tracks")
-                track_list = self.download_all_tracks()
-                count = 0
-                total = len(track_list)
+                progress = {'count': 0}
 
-                for track_id, track in track_list.iteritems():
-                    count += 1
-                    if progress_cb:
-                        progress_cb(count=count, total=total, message=track.name)
-                    self.save_track(track)
-                    self.tracks[track_id] = track
+                def add_tracks(tracks, total):
+                    self._track_store.save_tracks(tracks)
+                    for track in tracks:
+                        progress['count'] += 1
+                        if progress_cb:
+                            progress_cb(count=progress['count'], total=total, message=track.name)
+                        self._set_track(track)
+
+                self.download_all_tracks(add_tracks)
             else:
                 Logger.info("TrackManager: refreshing tracks")
                 venues = self.fetch_venue_list()
 
-                track_count = len(venues)
-                count = 0
-
+                changed_ids = []
                 for venue in venues:
-                    update = False
-                    count += 1
                     venue_id = venue.get('id')
-
-                    if self.tracks.get(venue_id) is None:
+                    track = self.tracks.get(venue_id)
+                    if track is None:
                         Logger.info('TrackManager: new track detected ' + venue_id)
-                        update = True
-                    elif not self.tracks[venue_id].updated == venue['updated']:
+                        changed_ids.append(venue_id)
+                    elif not track.updated == venue['updated']:
                         Logger.info('TrackManager: existing map changed ' + venue_id)
-                        update = True
-
-                    if update:
-                        updated_track = self.download_track(venue_id)
-                        if updated_track is not None:
-                            self.save_track(updated_track)
-                            self.tracks[venue_id] = updated_track
-                            if progress_cb:
-                                progress_cb(count=count, total=track_count, message=updated_track.name)
-                    else:
-                        progress_cb(count=count, total=track_count)
+                        changed_ids.append(venue_id)
+
+                track_count = len(changed_ids)
+                Logger.info('TrackManager: downloading {} of {} tracks'.format(track_count, len(venues)))
+                count = 0
+                for venue_id, updated_track in imap_unordered(self.download_track, changed_ids, self.MAX_DOWNLOAD_WORKERS):
+                    count += 1
+                    if updated_track is not None:
+                        self.save_track(updated_track)
+                        self._set_track(updated_track)
+                        if progress_cb:
+                            progress_cb(count=count, total=track_count, message=updated_track.name)
 
 
 class MissingKeyException(Exception):
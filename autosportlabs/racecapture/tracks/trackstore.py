@@ -0,0 +1,105 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ('TrackStore',)
+import json
+import sqlite3
+from array import array
+from threading import Lock
+from autosportlabs.racecapture.geo.geopoint import GeoPoint
+
+
+class TrackStore(object):
+    """
+    Keeps every track in a single SQLite file. Each track has a compact record of
+    the metadata needed to list and search for it, while its map points are kept
+    apart, packed as doubles, so they are only read and decoded when the track is drawn.
+    """
+
+    def __init__(self, path):
+        """
+        :param path the file to keep the tracks in
+        :type path string
+        """
+        # tracks are loaded and refreshed on worker threads, and drawn on the UI thread
+        self._lock = Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS track (id TEXT PRIMARY KEY, metadata TEXT NOT NULL, map_points BLOB)')
+        self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM track').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def load_metadata(self):
+        """
+        Reads the metadata of every track, without their map points
+        :return list of track dicts, as TrackMap.to_dict() makes them, without 'track_map_array'
+        and with the first map point as 'center'
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT metadata FROM track').fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def load_map_points(self, track_id):
+        """
+        Reads the map points of a track
+        :param track_id the track's id
+        :type track_id string
+        :return list of GeoPoint
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT map_points FROM track WHERE id = ?', (track_id,)).fetchone()
+        points = []
+        if row is None or row[0] is None:
+            return points
+        coords = array('d')
+        coords.fromstring(str(row[0]))
+        for i in xrange(0, len(coords) - 1, 2):
+            points.append(GeoPoint.fromPoint(coords[i], coords[i + 1]))
+        return points
+
+    def save_track(self, track):
+        """
+        :param track the track to save, replacing any saved with the same id
+        :type track TrackMap
+        """
+        self.save_tracks([track])
+
+    def save_tracks(self, tracks):
+        """
+        Saves a number of tracks together
+        :param tracks the tracks to save, replacing any saved with the same ids
+        :type tracks list of TrackMap
+        """
+        rows = []
+        for track in tracks:
+            track_dict = track.to_dict()
+            map_points = track_dict.pop('track_map_array')
+            track_dict['center'] = map_points[0] if map_points else None
+            coords = array('d', [coord for point in map_points for coord in point])
+            rows.append((track.track_id, json.dumps(track_dict, separators=(',', ':')), sqlite3.Binary(coords.tostring())))
+        with self._lock:
+            with self._conn:
+                self._conn.executemany('INSERT OR REPLACE INTO track (id, metadata, map_points) VALUES (?, ?, ?)', rows)
@@ -18,11 +18,28 @@
 # have received a copy of the GNU General Public License along with
 # this code. If not, see <http://www.gnu.org/licenses/>.
 
-from autosportlabs.racecapture.datastore import DataStore, Filter, timing
+import sys
+import threading
+from autosportlabs.racecapture.datastore import DataStore, Filter, QueryExecutor, gather_futures, timing
 from autosportlabs.racecapture.geo.geopoint import GeoPoint
+from autosportlabs.util.lrucache import LRUCache
 from kivy.logger import Logger
 from kivy.clock import Clock
 
+# Approximate memory used by each value held in a cached list
+_FLOAT_BYTES = sys.getsizeof(0.0)
+_GEOPOINT_BYTES = sys.getsizeof(GeoPoint()) + sys.getsizeof(GeoPoint().__dict__) + 2 * _FLOAT_BYTES
+
+
+def _channel_data_size(channel_data):
+    values = channel_data.values
+    return sys.getsizeof(values) + len(values) * _FLOAT_BYTES if values is not None else 0
+
+
+def _location_data_size(points):
+    return sys.getsizeof(points) + len(points) * _GEOPOINT_BYTES
+
+
 class ChannelStats(object):
     def __init__(self, **kwargs):
         self.values = kwargs.get('values')
@@ -45,12 +62,85 @@ class ChannelData(object):
         self.source = kwargs.get('source', None)
 
 class CachingAnalysisDatastore(DataStore):
+    # Default memory budget for cached channel and location data
+    DEFAULT_CACHE_BYTES = 32 * 1024 * 1024
 
-    def __init__(self, **kwargs):
+    def __init__(self, cache_bytes=DEFAULT_CACHE_BYTES, query_workers=QueryExecutor.DEFAULT_WORKERS, **kwargs):
+        """
+        :param cache_bytes the memory budget for cached channel and location data
+        :type cache_bytes int
+        :param query_workers the number of threads querying channel and location data
+        :type query_workers int
+        """
         super(CachingAnalysisDatastore, self).__init__(**kwargs)
-        self._channel_data_cache = {}
-        self._session_location_cache = {}
+        # Channel data is keyed by ('channel', session, lap, channel name) and
+        # location data by ('location', session, lap). The same keys identify
+        # queries in progress, so requests for the same data share a query
+        self._data_cache = LRUCache(cache_bytes)
         self._session_info_cache = {}
+        self._query_workers = query_workers
+        self._query_executor = None
+        # queries not yet complete by (session, lap), so they can be cancelled
+        self._pending_queries = {}
+        self._pending_lock = threading.Lock()
+
+    def close(self):
+        if self._query_executor is not None:
+            self._query_executor.shutdown()
+            self._query_executor = None
+        super(CachingAnalysisDatastore, self).close()
+
+    def _get_query_executor(self):
+        if self._query_executor is None:
+            self._query_executor = QueryExecutor(self, self._query_workers)
+        return self._query_executor
+
+    def _track_query(self, source_ref, future):
+        lap_key = (source_ref.session, source_ref.lap)
+        with self._pending_lock:
+            self._pending_queries.setdefault(lap_key, set()).add(future)
+
+        def query_done(f):
+            with self._pending_lock:
+                pending = self._pending_queries.get(lap_key)
+                if pending is not None:
+                    pending.discard(f)
+                    if not pending:
+                        self._pending_queries.pop(lap_key)
+
+        future.add_done_callback(query_done)
+
+    def cancel_queries(self, source_ref):
+        """
+        Cancels the channel and location data requests for a session / lap that
+        haven't completed. Their callbacks will not be called.
+        :param source_ref the session / lap reference
+        :type source_ref SourceRef
+        :return the number of requests cancelled
+        """
+        with self._pending_lock:
+            futures = self._pending_queries.pop((source_ref.session, source_ref.lap), set())
+        for future in futures:
+            future.cancel()
+        return len(futures)
+
+    def _cancel_session_queries(self, session_id):
+        with self._pending_lock:
+            lap_keys = [lap_key for lap_key in self._pending_queries.keys() if lap_key[0] == session_id]
+            futures = [future for lap_key in lap_keys for future in self._pending_queries.pop(lap_key)]
+        for future in futures:
+            future.cancel()
+
+    @property
+    def cache_stats(self):
+        """
+        Usage of the channel and location data cache
+        @return dict of hits, misses, evictions, entries, bytes and max_bytes
+        """
+        return self._data_cache.stats
+
+    def _invalidate_session_data(self, session_id):
+        self._data_cache.invalidate(lambda key: key[1] == session_id)
 
     @property
     def session_info_cache(self):
@@ -70,8 +160,8 @@ class CachingAnalysisDatastore(DataStore):
         Logger.info('CachingAnalysisDatastore: querying {} {}'.format(source_ref, channels))
         lap = source_ref.lap
         session = source_ref.session
-        f = Filter().eq('CurrentLap', lap) if self.session_has_laps(session) else None
-        dataset = self.query(sessions=[session], channels=channels, data_filter=f)
+        sample_ranges = self.get_lap_sample_ranges(session, lap) if self.session_has_laps(session) else None
+        dataset = self.query(sessions=[session], channels=channels, sample_ranges=sample_ranges)
         records = dataset.fetch_records()
 
         for index in range(len(channels)):
@@ -85,30 +175,74 @@ class CachingAnalysisDatastore(DataStore):
             channel_data = ChannelData(values=values, channel=channel, min=channel_meta.min, max=channel_meta.max, source=source_ref)
             combined_channel_data[channel] = channel_data
 
-    def _get_channel_data(self, source_ref, channels, callback):
+    def _fetch_channel_data(self, source_ref, channels):
+        channel_data = {}
+        self._query_channel_data(source_ref, channels, channel_data)
+        for channel, channel_d in channel_data.iteritems():
+            self._data_cache.put(('channel', source_ref.session, source_ref.lap, channel),
+                                 channel_d, _channel_data_size(channel_d))
+        return channel_data
+
+    def _report_query_error(self, source_ref, future, error_callback):
+        exception = future.exception()
+        Logger.error('CachingAnalysisDatastore: Error querying {}: {}'.format(source_ref, exception))
+        exception_traceback = future.exception_traceback()
+        if exception_traceback is not None:
+            Logger.error(exception_traceback)
+        if error_callback is not None:
+            Clock.schedule_once(lambda dt: error_callback(exception))
+
+    def _get_channel_data(self, source_ref, channels, callback, error_callback=None):
         '''
         Retrieve cached or query channel data as appropriate.
         '''
-        source_key = str(source_ref)
-        channel_data = self._channel_data_cache.get(str(source_key))
-        if not channel_data:
-            channel_data = {}
-            self._channel_data_cache[source_key] = channel_data
+        # Report unknown channels to the caller right away
+        for channel in channels:
+            self.get_channel(channel)
 
+        executor = self._get_query_executor()
+        channel_data = {}
         channels_to_query = []
+        futures = []
         for channel in channels:
-            channel_d = channel_data.get(channel)
-            if not channel_d:
+            key = ('channel', source_ref.session, source_ref.lap, channel)
+            channel_d = self._data_cache.get(key)
+            if channel_d is not None:
+                channel_data[channel] = channel_d
+                continue
+
+            future = executor.join(key)
+            if future is not None:
+                futures.append(future)
+            else:
                 channels_to_query.append(channel)
 
         if len(channels_to_query) > 0:
-            channel_d = self._query_channel_data(source_ref, channels_to_query, channel_data)
+            keys = [('channel', source_ref.session, source_ref.lap, channel) for channel in channels_to_query]
+            futures.append(executor.submit(keys, self._fetch_channel_data, source_ref, channels_to_query))
+
+        def query_done(future):
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                self._report_query_error(source_ref, future, error_callback)
+                return
+            for results in future.result():
+                for channel, channel_d in results.iteritems():
+                    if channel in channels:
+                        channel_data[channel] = channel_d
+            Clock.schedule_once(lambda dt: callback(channel_data))
 
-        Clock.schedule_once(lambda dt: callback(channel_data))
+        future = gather_futures(futures)
+        self._track_query(source_ref, future)
+        future.add_done_callback(query_done)
+        return future
 
     @timing
     def import_datalog(self, path, name, notes='', progress_cb=None):
         session_id = super(CachingAnalysisDatastore, self).import_datalog(path, name, notes, progress_cb)
+        # Cached channel data carries channel limits, which the import may have changed
+        self._data_cache.clear()
         self._refresh_session_data()
         return session_id
 
@@ -158,49 +292,71 @@ class CachingAnalysisDatastore(DataStore):
         :param session_id The session to delete
         :type session_id int
         """
+        self._cancel_session_queries(session_id)
         super(CachingAnalysisDatastore, self).delete_session(session_id)
+        self._invalidate_session_data(session_id)
         self.session_info_cache.pop(session_id, None)
 
-    def get_channel_data(self, source_ref, channels, callback):
+    def get_channel_data(self, source_ref, channels, callback, error_callback=None):
         '''
         Retrieve channel data for the specified source (session / lap combo).
-        Data is returned with the specified callback function.
+        Data is queried in the background and returned with the specified callback function.
+        If the query fails, the error is logged and passed to error_callback, if specified.
+        :return QueryFuture for the request, which can be cancelled
         '''
-        self._get_channel_data(source_ref, channels, callback)
+        return self._get_channel_data(source_ref, channels, callback, error_callback)
 
-    def get_location_data(self, source_ref, callback=None):
+    def get_location_data(self, source_ref, callback=None, error_callback=None):
         '''
         Retrieve location data for the specified source (session / lap combo). 
         If immediately available, return it, otherwise use the callback for a later return after querying.
+        If the query fails, the error is logged and passed to error_callback, if specified.
         '''
-        cached = self._session_location_cache.get(str(source_ref))
+        cached = self._data_cache.get(('location', source_ref.session, source_ref.lap))
         if callback:
             if cached:
                 callback(cached)
             else:
-                self._get_location_data(source_ref, callback)
+                self._get_location_data(source_ref, callback, error_callback)
         return cached
 
-    def _get_location_data(self, source_ref, callback):
+    def _get_location_data(self, source_ref, callback, error_callback=None):
         '''
-        Retrieve cached or query Location data as appropriate.
+        Query Location data in the background.
         '''
+        key = ('location', source_ref.session, source_ref.lap)
+        executor = self._get_query_executor()
+        future = executor.join(key)
+        if future is None:
+            future = executor.submit([key], self._fetch_location_data, source_ref)
+
+        def query_done(f):
+            if f.cancelled():
+                return
+            if f.exception() is not None:
+                self._report_query_error(source_ref, f, error_callback)
+                return
+            Clock.schedule_once(lambda dt: callback(f.result()))
+
+        self._track_query(source_ref, future)
+        future.add_done_callback(query_done)
+
+    def _fetch_location_data(self, source_ref):
         session = source_ref.session
         lap = source_ref.lap
         f = Filter().neq('Latitude', 0).and_().neq('Longitude', 0)
-        if self.session_has_laps(session):
-            f.eq("CurrentLap", lap)
+        sample_ranges = self.get_lap_sample_ranges(session, lap) if self.session_has_laps(session) else None
         dataset = self.query(sessions=[session],
                                         channels=["Latitude", "Longitude"],
-                                        data_filter=f)
+                                        data_filter=f,
+                                        sample_ranges=sample_ranges)
         records = dataset.fetch_records()
         cache = []
         for r in records:
             lat = r[1]
             lon = r[2]
             cache.append(GeoPoint.fromPoint(lat, lon))
-        self._session_location_cache[str(source_ref)] = cache
-
-        Clock.schedule_once(lambda dt: callback(cache))
+        self._data_cache.put(('location', session, lap), cache, _location_data_size(cache))
+        return cache
 
 
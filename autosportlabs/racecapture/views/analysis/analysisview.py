@@ -176,6 +176,8 @@ class AnalysisView(Screen):
             self._datastore.get_location_data(source_ref, lambda x: self.ids.analysismap.add_map_path(source_ref, x, map_path_color))
 
         else:
+            # Drop any data still being queried for the lap
+            self._datastore.cancel_queries(source_ref)
             self.ids.mainchart.remove_lap(source_ref)
             self.ids.channelvalues.remove_lap(source_ref)
             self.ids.analysismap.remove_reference_mark(source_key)
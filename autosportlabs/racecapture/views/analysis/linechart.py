@@ -25,16 +25,15 @@ from kivy.uix.label import Label
 from kivy.clock import Clock
 from kivy.core.window import Window
 from kivy.properties import ObjectProperty
-from collections import OrderedDict
 from  kivy.metrics import MetricsBase, sp
 from kivy.logger import Logger
-import bisect
 import copy
 
 from autosportlabs.racecapture.views.util.alertview import alertPopup
 from autosportlabs.racecapture.views.analysis.analysiswidget import ChannelAnalysisWidget
 from autosportlabs.racecapture.views.analysis.markerevent import MarkerEvent
 from autosportlabs.racecapture.datastore import Filter
+from autosportlabs.racecapture.data.decimation import PlotPyramid
 from autosportlabs.racecapture.views.analysis.analysisdata import ChannelData
 from autosportlabs.uix.progressspinner import ProgressSpinner
 from autosportlabs.uix.options.optionsview import OptionsView, BaseOptionsScreen
@@ -52,7 +51,8 @@ class ChannelPlot(object):
 
     def __init__(self, plot, channel, min_value, max_value, sourceref):
         self.lap = None
-        self.chart_x_index = None
+        # the plot's samples at each resolution, by chart x value
+        self.pyramid = None
         self.plot = plot
         self.channel = channel
         self.min_value = min_value
@@ -96,6 +96,7 @@ class LineChart(ChannelAnalysisWidget):
     color_sequence = ObjectProperty(None)
     ZOOM_SCALING = 0.01
     TOUCH_ZOOM_SCALING = 0.000001
+    # the most points drawn for a plot, whatever range is shown
     MAX_SAMPLES_TO_DISPLAY = 1000
 
     # The meaningful distance is an approximate distance / time threshold to consider
@@ -130,6 +131,7 @@ class LineChart(ChannelAnalysisWidget):
         self.x_axis_value_label = None
 
         self._user_refresh_requested = False
+        self._resample_trigger = Clock.create_trigger(self._resample_plots)
 
     def add_option_buttons(self):
         '''
@@ -215,6 +217,7 @@ class LineChart(ChannelAnalysisWidget):
 
                 chart.xmax = self.current_x
                 chart.xmin = self.current_offset
+                self._resample_trigger()
             except:
                 pass  # no scrollwheel support
 
@@ -257,8 +260,7 @@ class LineChart(ChannelAnalysisWidget):
 
         for channel_plot in self._channel_plots.itervalues():
             try:
-                value_index = bisect.bisect_right(channel_plot.chart_x_index.keys(), data_index)
-                index = channel_plot.chart_x_index.values()[value_index]
+                index = channel_plot.pyramid.sample_index_at(data_index)
                 marker = MarkerEvent(int(index), channel_plot.sourceref)
                 self.dispatch('on_marker', marker)
             except IndexError:
@@ -303,6 +305,7 @@ class LineChart(ChannelAnalysisWidget):
                 chart = self.ids.chart
                 chart.xmax = self.current_x
                 chart.xmin = self.current_offset
+                self._resample_trigger()
             return True
 
     def on_mouse_pos(self, x, pos):
@@ -333,14 +336,9 @@ class LineChart(ChannelAnalysisWidget):
         max_chart_x = 0
         for plot in self._channel_plots.itervalues():
             # Find the largest chart_x for all of the active plots
-            chart_x_index = plot.chart_x_index
-            try:
-                last = next(reversed(chart_x_index))
-                chart_x = last
-                if chart_x and chart_x > max_chart_x:
-                    max_chart_x = chart_x
-            except StopIteration:  # iterator is empty so just continue
-                pass
+            chart_x = plot.pyramid.max_x
+            if chart_x and chart_x > max_chart_x:
+                max_chart_x = chart_x
 
         # update chart zoom range
         self.current_offset = 0
@@ -349,7 +347,16 @@ class LineChart(ChannelAnalysisWidget):
 
         self.ids.chart.xmin = self.current_offset
         self.ids.chart.xmax = self.current_x
+        self._resample_plots()
 
+    def _resample_plots(self, *args):
+        '''
+        Draw each plot from the level of detail that fits the visible range, so zooming
+        in brings back the samples left out when the whole plot is shown
+        '''
+        chart = self.ids.chart
+        for channel_plot in self._channel_plots.itervalues():
+            channel_plot.plot.points = channel_plot.pyramid.points(chart.xmin, chart.xmax, self.MAX_SAMPLES_TO_DISPLAY)
 
     def _add_channels_results_time(self, channels, query_data):
         try:
@@ -371,32 +378,23 @@ class LineChart(ChannelAnalysisWidget):
                                            channel_data_values.source)
 
                 chart.add_plot(plot)
-                points = []
-                time_index = OrderedDict()
-                sample_index = 0
+                times = []
                 time_data = time_data_values.values
-                sample_count = len(time_data)
-                interval = max(1, int(sample_count / self.MAX_SAMPLES_TO_DISPLAY))
-                Logger.info('LineChart: plot interval {}'.format(interval))
                 last_time = None
                 time = 0
                 last_time = time_data[0]
-                while sample_index < sample_count:
-                    current_time = time_data[sample_index]
+                for current_time in time_data:
                     if last_time > current_time:
                         Logger.warn('LineChart: interruption in interval channel, possible reset in data stream ({}->{})'.format(last_time, current_time))
                         last_time = current_time
-                    sample = channel_data[sample_index]
                     time += current_time - last_time
                     last_time = current_time
-                    points.append((time, sample))
-                    time_index[time] = sample_index
-                    sample_index += interval
+                    times.append(time)
 
-                channel_plot.chart_x_index = time_index
+                channel_plot.pyramid = PlotPyramid(times, channel_data)
+                Logger.info('LineChart: plot of {} samples at {} levels of detail'.format(len(times), channel_plot.pyramid.levels))
                 plot.ymin = channel_data_values.min
                 plot.ymax = channel_data_values.max
-                plot.points = points
                 self._channel_plots[str(channel_plot)] = channel_plot
 
                 # sync max chart x dimension
@@ -422,25 +420,12 @@ class LineChart(ChannelAnalysisWidget):
                                            channel_data_values.source)
 
                 chart.add_plot(plot)
-                points = []
-                distance_index = OrderedDict()
-                sample_index = 0
                 distance_data = distance_data_values.values
                 channel_data = channel_data_values.values
-                sample_count = len(distance_data)
-                interval = max(1, int(sample_count / self.MAX_SAMPLES_TO_DISPLAY))
-                Logger.info('LineChart: plot interval {}'.format(interval))
-                while sample_index < sample_count:
-                    sample = channel_data[sample_index]
-                    distance = distance_data[sample_index]
-                    points.append((distance, sample))
-                    distance_index[distance] = sample_index
-                    sample_index += interval
-
-                channel_plot.chart_x_index = distance_index
+                channel_plot.pyramid = PlotPyramid(distance_data, channel_data)
+                Logger.info('LineChart: plot of {} samples at {} levels of detail'.format(len(distance_data), channel_plot.pyramid.levels))
                 plot.ymin = channel_data_values.min
                 plot.ymax = channel_data_values.max
-                plot.points = points
                 self._channel_plots[str(channel_plot)] = channel_plot
 
                 # sync max chart distances
@@ -493,8 +478,11 @@ class LineChart(ChannelAnalysisWidget):
                 Clock.schedule_once(lambda dt: self._add_channels_results_distance(channels[:], results))
             else:
                 Logger.error('LineChart: Unknown line chart mode ' + str(self.line_chart_mode))
+        def get_error(exception):
+            toast('Could not load channels {}'.format(', '.join(channels)), length_long=True)
+
         try:
-            self.datastore.get_channel_data(source_ref, ['Interval', 'Distance'] + channels, get_results)
+            self.datastore.get_channel_data(source_ref, ['Interval', 'Distance'] + channels, get_results, get_error)
         except Exception as e:
             Logger.warn('Non existant channel selected, not loading channels {}; {}'.format(channels, e))
         finally:
@@ -192,10 +192,11 @@ class StatusView(Screen):
     _menu_node = None
     menu_select_color = ColorScheme.get_primary()
 
-    def __init__(self, track_manager, status_pump, **kwargs):
+    def __init__(self, track_manager, status_pump, databus, **kwargs):
         Builder.load_file(STATUS_KV_FILE)
         super(StatusView, self).__init__(**kwargs)
         self.track_manager = track_manager
+        self._databus = databus
         self.register_event_type('on_tracks_updated')
         self._menu_node = self.ids.menu
         self._menu_node.bind(selected_node=self._on_menu_select)
@@ -264,6 +265,13 @@ class StatusView(Screen):
         self.ids.status_grid.add_widget(ApplicationLogView())
         self._add_item('Application Version', RaceCaptureApp.get_app_version())
 
+        update_stats = self._databus.update_scheduler.stats
+        notify_stats = self._databus.notify_stats
+        self._add_item('Dashboard update rate', '{:.0f}Hz (limited by {})'.format(update_stats['rate'], update_stats['limited_by']))
+        self._add_item('Dashboard update time', '{:.1f}ms (frame lag {:.1f}ms)'.format(update_stats['update_ms'], update_stats['frame_lag_ms']))
+        self._add_item('Rate capped channels', self._databus.rate_capped_channels)
+        self._add_item('Updates skipped / deferred', '{} / {}'.format(notify_stats['skipped'], notify_stats['deferred']))
+
     def render_system(self):
         if 'git_info' in self.status['system']:
             version = self.status['system']['git_info']
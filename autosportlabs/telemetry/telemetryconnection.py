@@ -323,10 +323,10 @@ class TelemetryConnection(asynchat.async_chat):
 
     # Event handler for when RCP sends data to app
     def _on_sample(self, sample):
-        # isolate the data from the calling thread by making a copy
-        sample_copy = copy(sample)
+        # the DataBus never modifies a sample row once published, so it
+        # can be shared with the sample worker without copying.
         # variable assignment in python is atomic, and therefore thread safe
-        self._sample_data = sample_copy
+        self._sample_data = sample
 
     # Event handler for when RCP's channel list changes
     def _on_meta(self, meta):
@@ -0,0 +1,165 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ('JsonClient',)
+import gzip
+import httplib
+import json
+import time
+import traceback
+import urlparse
+from StringIO import StringIO
+from threading import Lock
+from kivy.logger import Logger
+
+MAX_REDIRECTS = 5
+
+
+class JsonClient(object):
+    """
+    Fetches JSON documents, and the files they refer to, over HTTP and HTTPS.
+    Connections are kept open between requests and shared by the threads fetching
+    through the client, so fetching many documents from a host doesn't pay for a
+    new connection each time.
+    """
+
+    def __init__(self, name, retries=3, retry_delay=1.0, timeout=30):
+        """
+        :param name the name to log with
+        :type name string
+        :param retries the number of times to try a request
+        :type retries int
+        :param retry_delay the seconds to wait before trying again
+        :type retry_delay float
+        :param timeout the socket timeout, in seconds
+        :type timeout float
+        """
+        self.name = name
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        self._lock = Lock()
+        # (scheme, host) -> idle connections
+        self._idle = {}
+
+    def _get_connection(self, scheme, host):
+        with self._lock:
+            idle = self._idle.get((scheme, host))
+            if idle:
+                return idle.pop(), True
+        connection_class = httplib.HTTPSConnection if scheme == 'https' else httplib.HTTPConnection
+        return connection_class(host, timeout=self.timeout), False
+
+    def _put_connection(self, scheme, host, connection):
+        with self._lock:
+            self._idle.setdefault((scheme, host), []).append(connection)
+
+    def close(self):
+        """
+        Closes the idle connections
+        """
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+        for connections in idle.itervalues():
+            for connection in connections:
+                connection.close()
+
+    def _request(self, uri, headers):
+        """
+        Makes a single GET request, following redirects
+        :return (status, response headers, response body)
+        """
+        for redirect in range(MAX_REDIRECTS + 1):
+            parts = urlparse.urlsplit(uri)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            connection, reused = self._get_connection(parts.scheme, parts.netloc)
+            try:
+                try:
+                    connection.request('GET', path, headers=headers)
+                    response = connection.getresponse()
+                except (httplib.HTTPException, IOError):
+                    if not reused:
+                        raise
+                    # the server closed a kept alive connection; it's not a failure of the request
+                    connection.close()
+                    connection, reused = self._get_connection(parts.scheme, parts.netloc)
+                    connection.request('GET', path, headers=headers)
+                    response = connection.getresponse()
+                data = response.read()
+            except:
+                connection.close()
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                self._put_connection(parts.scheme, parts.netloc, connection)
+
+            if response.status in (301, 302, 303, 307, 308):
+                uri = urlparse.urljoin(uri, response.getheader('Location'))
+                continue
+            if response.status not in (200, 304):
+                raise IOError('HTTP {} {}'.format(response.status, response.reason))
+            if response.getheader('Content-Encoding') == 'gzip':
+                data = gzip.GzipFile(fileobj=StringIO(data)).read()
+            return response.status, dict(response.getheaders()), data
+        raise IOError('Too many redirects')
+
+    def _retry(self, uri, fetch, error_message):
+        retries = 0
+        while retries < self.retries:
+            try:
+                return fetch()
+            except Exception:
+                Logger.warning('{}: Failed to read: from {} : {}'.format(self.name, uri, traceback.format_exc()))
+                retries += 1
+                if retries < self.retries:
+                    Logger.warning('{}: retrying in {} seconds...'.format(self.name, self.retry_delay))
+                    time.sleep(self.retry_delay)
+        raise Exception(error_message + uri)
+
+    def get(self, uri, headers=None):
+        """
+        Fetches a document, trying again if the request fails
+        :param uri the document's URI
+        :type uri string
+        :param headers extra request headers, such as If-None-Match
+        :type headers dict
+        :return (status, response headers, response body). The status is 200, or 304 for
+        a conditional request whose document hasn't changed. Header names are lower case.
+        """
+        request_headers = {'Accept-encoding': 'gzip'}
+        if headers:
+            request_headers.update(headers)
+        return self._retry(uri, lambda: self._request(uri, request_headers), 'Error reading from: ')
+
+    def get_json(self, uri):
+        """
+        Fetches a JSON document, trying again if the request fails
+        :param uri the document's URI
+        :type uri string
+        :return the decoded document
+        """
+        request_headers = {'Accept': 'application/json', 'Accept-encoding': 'gzip'}
+        # a document cut short is retried like a failed request
+        return self._retry(uri, lambda: json.loads(self._request(uri, request_headers)[2]), 'Error reading json doc from: ')
@@ -0,0 +1,148 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ('LRUCache',)
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    A cache bounded by the approximate size in bytes of its entries. When adding
+    an entry takes the cache over its budget, the least recently used entries
+    are evicted. Safe to use from multiple threads.
+    """
+
+    def __init__(self, max_bytes, sizeof=None):
+        """
+        :param max_bytes the size budget of the cache
+        :type max_bytes int
+        :param sizeof function returning the approximate size in bytes of a value,
+        used when put() isn't given a size
+        :type sizeof function
+        """
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """
+        Fetches an entry, marking it as the most recently used
+        :param key the key of the entry
+        :param default the value to return if the entry isn't cached
+        :return the cached value, or default
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size=None):
+        """
+        Adds or replaces an entry, evicting the least recently used entries as needed.
+        A value larger than the whole budget is not cached.
+        :param key the key of the entry
+        :param value the value to cache
+        :param size the approximate size of the value in bytes
+        :type size int
+        :return True if the value was cached
+        """
+        if size is None:
+            size = self._sizeof(value) if self._sizeof is not None else 1
+
+        with self._lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                return False
+
+            while self.size_bytes + size > self.max_bytes:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self.size_bytes -= evicted[1]
+                self.evictions += 1
+
+            self._entries[key] = (value, size)
+            self.size_bytes += size
+            return True
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size_bytes -= entry[1]
+        return entry
+
+    def pop(self, key, default=None):
+        """
+        Removes an entry
+        :param key the key of the entry
+        :param default the value to return if the entry isn't cached
+        :return the removed value, or default
+        """
+        with self._lock:
+            entry = self._remove(key)
+            return default if entry is None else entry[0]
+
+    def invalidate(self, predicate):
+        """
+        Removes the entries whose key matches a predicate
+        :param predicate function called with each key; return True to remove the entry
+        :type predicate function
+        :return the number of entries removed
+        """
+        with self._lock:
+            keys = [key for key in self._entries.keys() if predicate(key)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        """
+        Removes all entries. The counters are left as they are.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+    @property
+    def stats(self):
+        """
+        Usage of the cache, for sizing its budget
+        :return dict of hits, misses, evictions, entries, bytes and max_bytes
+        """
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.size_bytes,
+                'max_bytes': self.max_bytes}
@@ -18,9 +18,11 @@
 # have received a copy of the GNU General Public License along with
 # this code. If not, see <http://www.gnu.org/licenses/>.
 
-from threading import RLock
+import sys
+import Queue
+from threading import RLock, Thread, Event
 from kivy import platform
-__all__ = ('safe_thread_exit')
+__all__ = ('safe_thread_exit', 'imap_unordered')
 
 
 if platform == 'android':
@@ -42,3 +44,64 @@ class ThreadSafeDict(dict) :
 
     def __exit__(self, type, value, traceback) :
         self._lock.release()
+
+
+def imap_unordered(function, items, max_workers):
+    """
+    Calls function with each item, on up to max_workers threads at once
+    :param function the function to call
+    :type function function
+    :param items the items to call it with
+    :type items list
+    :param max_workers the most threads to use
+    :type max_workers int
+    :return generator of (item, result), in the order the calls finish. If a call raises an
+    exception, no further calls are started, and the exception is raised once the results
+    of the calls under way have been returned.
+    """
+    pending = Queue.Queue()
+    for item in items:
+        pending.put(item)
+    results = Queue.Queue()
+    stop = Event()
+    done = object()
+
+    def worker():
+        try:
+            while not stop.is_set():
+                try:
+                    item = pending.get_nowait()
+                except Queue.Empty:
+                    break
+                try:
+                    results.put((item, function(item), None))
+                except Exception:
+                    stop.set()
+                    results.put((item, None, sys.exc_info()))
+        finally:
+            results.put(done)
+            safe_thread_exit()
+
+    worker_count = max(1, min(max_workers, pending.qsize()))
+    for i in range(worker_count):
+        t = Thread(target=worker)
+        t.daemon = True
+        t.start()
+
+    error = None
+    try:
+        while worker_count > 0:
+            result = results.get()
+            if result is done:
+                worker_count -= 1
+                continue
+            item, value, exc_info = result
+            if exc_info is not None:
+                error = error or exc_info
+                continue
+            yield item, value
+    finally:
+        # the caller stopped early; let the workers finish what they have
+        stop.set()
+    if error is not None:
+        raise error[0], error[1], error[2]
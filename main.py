@@ -105,6 +105,7 @@ if __name__ == '__main__':
 
 from kivy.app import App, Builder
 from autosportlabs.racecapture.config.rcpconfig import RcpConfig, VersionConfig
+from autosportlabs.racecapture.config.configcache import RcpConfigCache, forget_other_device
 from autosportlabs.racecapture.databus.databus import DataBusFactory, DataBusPump
 from autosportlabs.racecapture.status.statuspump import StatusPump
 from autosportlabs.racecapture.api.rcpapi import RcpApi
@@ -127,6 +128,12 @@ class RaceCaptureApp(App):
     # Central RCP configuration object
     rc_config = RcpConfig()
 
+    # the serial number of the device rc_config was read from
+    _config_serial = None
+
+    # the cached config shown while the device's config is read again
+    _cached_config_json = None
+
     # dataBus provides an eventing / polling mechanism to parts of the system that care
     _databus = None
 
@@ -195,13 +202,16 @@ class RaceCaptureApp(App):
 
         self.track_manager = TrackManager(user_dir=self.settings.get_default_data_dir(), base_dir=self.base_dir)
         self.preset_manager = PresetManager(user_dir=self.settings.get_default_data_dir(), base_dir=self.base_dir)
+        self._config_cache = RcpConfigCache(self.settings.get_default_data_dir())
 
         # RaceCapture communications API
         self._rc_api = RcpApi(on_disconnect=self._on_rcp_disconnect, settings=self.settings)
 
         self._databus = DataBusFactory().create_standard_databus(self.settings.systemChannels)
         self.settings.runtimeChannels.data_bus = self._databus
-        self._datastore = CachingAnalysisDatastore(databus=self._databus)
+        self._databus.update_scheduler.set_rate_bounds(self.settings.userPrefs.get_pref_int('dashboard_preferences', 'min_update_rate'),
+                                                       self.settings.userPrefs.get_pref_int('dashboard_preferences', 'max_update_rate'))
+        self._datastore = CachingAnalysisDatastore(databus=self._databus, columnar=True, wal=True)
         self._session_recorder = SessionRecorder(self._datastore, self._databus, self._rc_api, self.settings, self.track_manager, self._status_pump)
         self._session_recorder.bind(on_recording=self._on_session_recording)
 
@@ -308,6 +318,7 @@ class RaceCaptureApp(App):
         Logger.info("RaceCaptureApp: Config written")
         self.showActivity("Writing completed")
         self.rc_config.stale = False
+        self._save_cached_config()
         self._data_bus_pump.meta_is_stale()
         for listener in self.config_listeners:
             Clock.schedule_once(lambda dt, inner_listener=listener: inner_listener.dispatch('on_config_written', self.rc_config))
@@ -325,11 +336,58 @@ class RaceCaptureApp(App):
             self._serial_warning()
 
     def on_read_config_complete(self, rcpCfg):
+        version = self._rc_api.connected_version
+        self._config_serial = version.serial if version else None
+        cached_config_json = self._cached_config_json
+        self._cached_config_json = None
+        if cached_config_json is not None and cached_config_json == self.rc_config.toJson():
+            # the views already show this config
+            Logger.info("RaceCaptureApp: Cached config is current")
+            self.showActivity("Connected")
+        else:
+            self._notify_config_updated()
+        self.rc_config.stale = False
+        self._save_cached_config()
+
+    def _notify_config_updated(self):
         for listener in self.config_listeners:
             Clock.schedule_once(lambda dt, inner_listener=listener: inner_listener.dispatch('on_config_updated', self.rc_config))
-        self.rc_config.stale = False
+
+    def _is_other_device(self, version):
+        other_device = forget_other_device(self.rc_config, self._config_serial, version)
+        # keep any changes not yet written, rather than replacing them with the new device's config
+        return other_device and not self.rc_config.stale
+
+    def _load_cached_config(self, version):
+        """
+        Shows the config last read from a device, while it is read again
+        :param version the version of the connected device
+        :type version VersionConfig
+        """
+        cached_config_json = self._config_cache.load(version)
+        if cached_config_json is None:
+            return
+        Logger.info("RaceCaptureApp: Showing cached config for {}".format(version))
+        rc_config = self.rc_config
+        rc_config.fromJson(cached_config_json)
+        rc_config.stale = False
+        # writes can't be compared against a cached config until the device confirms it
+        rc_config.device_snapshot = None
+        self._config_serial = version.serial
+        self._cached_config_json = rc_config.toJson()
+        self._notify_config_updated()
+
+    def _save_cached_config(self):
+        try:
+            self._config_cache.save(self._rc_api.connected_version, self.rc_config)
+        except Exception as e:
+            Logger.warn("RaceCaptureApp: Could not cache config: {}".format(e))
 
     def on_read_config_error(self, detail):
+        if self._cached_config_json is not None:
+            # still showing the cached config; read the device's config when it next connects
+            self._cached_config_json = None
+            self.rc_config.loaded = False
         self.showActivity("Error reading configuration")
         toast("Error reading configuration. Check your connection", length_long=True)
         Logger.error("RaceCaptureApp:Error reading configuration: {}".format(str(detail)))
@@ -420,7 +478,7 @@ class RaceCaptureApp(App):
         return config_view
 
     def build_status_view(self):
-        status_view = StatusView(self.track_manager, self._status_pump, name='status')
+        status_view = StatusView(self.track_manager, self._status_pump, self._databus, name='status')
         self.tracks_listeners.append(status_view)
         return status_view
 
@@ -556,7 +614,8 @@ class RaceCaptureApp(App):
             self._status_pump.start(self._rc_api)
             self._telemetry_connection.data_connected = True
 
-            if self.rc_config.loaded == False:
+            if self.rc_config.loaded == False or self._is_other_device(version):
+                self._load_cached_config(version)
                 Clock.schedule_once(lambda dt: self.on_read_config(self))
             else:
                 self.showActivity('Connected')
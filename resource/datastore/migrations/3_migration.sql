@@ -0,0 +1,16 @@
+CREATE TABLE IF NOT EXISTS session_index
+        (session_id INTEGER PRIMARY KEY,
+        sample_count INTEGER NOT NULL,
+        sample_ids BLOB NOT NULL);
+
+CREATE TABLE IF NOT EXISTS channel_data
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        data BLOB NOT NULL);
+
+CREATE INDEX IF NOT EXISTS channel_data_session_id_index_id on channel_data(session_id);
+
+ALTER TABLE sample ADD data BLOB;
+
+CREATE INDEX IF NOT EXISTS sample_staged_session_id_index_id on sample(session_id) WHERE data IS NOT NULL;
@@ -0,0 +1,15 @@
+CREATE TABLE IF NOT EXISTS lap
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id INTEGER NOT NULL,
+        lap INTEGER NOT NULL,
+        first_sample_id INTEGER NOT NULL,
+        last_sample_id INTEGER NOT NULL,
+        lap_time REAL NULL,
+        start_interval REAL NULL,
+        end_interval REAL NULL,
+        start_distance REAL NULL,
+        end_distance REAL NULL);
+
+CREATE INDEX IF NOT EXISTS lap_session_id_index_id on lap(session_id, lap);
+
+ALTER TABLE session ADD laps_indexed INTEGER NOT NULL DEFAULT 0;
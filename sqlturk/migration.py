@@ -121,11 +121,15 @@ class MigrationTool(object):
         self.dburi = dburi
         self.engine = create_engine(dburi)
         self.migration_dir = migration_dir
-        self.table = Table(schema_table, metadata,
-                Column('id', types.Integer, primary_key=True),
-                Column('migration', types.String(80)),
-                Column('applied', types.DateTime, default=datetime.datetime.now),
-            )
+        # The table definition lives in the module level metadata, so reuse
+        # it when more than one database is migrated in a process
+        self.table = metadata.tables.get(schema_table)
+        if self.table is None:
+            self.table = Table(schema_table, metadata,
+                    Column('id', types.Integer, primary_key=True),
+                    Column('migration', types.String(80)),
+                    Column('applied', types.DateTime, default=datetime.datetime.now),
+                )
 
     def install(self):
         """Creates database table to track schema changes.
@@ -0,0 +1,73 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import socket
+import unittest
+from autosportlabs.comms.linebuffer import LineBuffer
+from autosportlabs.comms.socket.socketconnection import SocketConnection
+
+
+class LineBufferTest(unittest.TestCase):
+
+    def test_lines(self):
+        lines = LineBuffer()
+        lines.add('{"s":1}\r\n{"s":2}\r\n{"s"')
+        self.assertEqual(2, len(lines))
+        self.assertEqual('{"s":1}', lines.next_line())
+        self.assertEqual('{"s":2}', lines.next_line())
+        self.assertIsNone(lines.next_line())
+
+        # the rest of an incomplete line, with its delimiter split across blocks
+        lines.add(':3}\r')
+        self.assertIsNone(lines.next_line())
+        lines.add('\n\r\n')
+        self.assertEqual('{"s":3}', lines.next_line())
+        self.assertEqual('', lines.next_line())
+        self.assertIsNone(lines.next_line())
+
+    def test_clear(self):
+        lines = LineBuffer()
+        lines.add('one\r\ntw')
+        lines.clear()
+        lines.add('o\r\n')
+        self.assertEqual('o', lines.next_line())
+        self.assertIsNone(lines.next_line())
+
+
+class SocketConnectionTest(unittest.TestCase):
+
+    def test_read_line(self):
+        connection = SocketConnection()
+        connection.socket, device = socket.socketpair()
+        keep_reading = threading.Event()
+        keep_reading.set()
+        try:
+            # lines arriving together are each returned
+            device.sendall('one\r\ntwo\r\nthr')
+            self.assertEqual('one', connection.read_line(keep_reading))
+            self.assertEqual('two', connection.read_line(keep_reading))
+            device.sendall('ee\r\n')
+            self.assertEqual('three', connection.read_line(keep_reading))
+
+            device.close()
+            self.assertIsNone(connection.read_line(keep_reading))
+        finally:
+            connection.close()
@@ -0,0 +1,80 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+import Queue
+import socket
+import time
+import unittest
+from autosportlabs.comms.commscommon import PortNotOpenException
+from autosportlabs.comms.loopcomms import LoopComms
+from autosportlabs.comms.socket.socketconnection import SocketConnection
+
+
+class PairedSocketConnection(SocketConnection):
+    """
+    A socket connection to a local socket standing in for the device
+    """
+    def open(self, address):
+        self._lines.clear()
+        self.socket, self.device_socket = socket.socketpair()
+
+
+class LoopCommsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = PairedSocketConnection()
+        self.comms = LoopComms('device', self.connection, wireless=True)
+        self.comms.open()
+        self.messages = Queue.Queue()
+
+    def tearDown(self):
+        self.comms.close()
+
+    def test_message_handler(self):
+        self.comms.set_message_handler(self.messages.put)
+        self.connection.device_socket.sendall('{"s":1}\r\n{"s"')
+        self.connection.device_socket.sendall(':2}\r\n')
+        self.assertEqual('{"s":1}', self.messages.get(True, 2))
+        self.assertEqual('{"s":2}', self.messages.get(True, 2))
+
+    def test_read_message(self):
+        self.connection.device_socket.sendall('{"ver":1}\r\n')
+        self.assertEqual('{"ver":1}', self.comms.read_message())
+
+    def test_write_message(self):
+        self.comms.write_message('{"getVer":null}\r\n')
+        self.assertEqual('{"getVer":null}\r\n', self.connection.device_socket.recv(100))
+
+    def test_closed_by_device(self):
+        self.connection.device_socket.close()
+        # the loop notices the close on its own thread
+        for i in range(200):
+            if not self.comms.isOpen():
+                break
+            time.sleep(0.01)
+        self.assertFalse(self.comms.isOpen())
+        self.assertRaises(PortNotOpenException, self.comms.read_message)
+        self.assertRaises(PortNotOpenException, self.comms.write_message, '{}\r\n')
+
+    def test_close(self):
+        device_socket = self.connection.device_socket
+        self.comms.close()
+        self.assertFalse(self.comms.isOpen())
+        self.assertEqual('', device_socket.recv(100))
@@ -18,9 +18,28 @@
 # have received a copy of the GNU General Public License along with
 # this code. If not, see <http://www.gnu.org/licenses/>.
 
+import json
 import unittest
+import Queue
+from threading import Thread
 from mock import Mock
-from autosportlabs.racecapture.api.rcpapi import RcpApi
+from autosportlabs.racecapture.api.rcpapi import RcpApi, RcpCmd, parse_sample_message
+from autosportlabs.racecapture.config.rcpconfig import RcpConfig
+
+class FakeDevice(object):
+    """
+    Records the commands written to it; the test replies to them
+    """
+    def __init__(self):
+        self.commands = Queue.Queue()
+
+    def write_message(self, message):
+        # blank writes are the keep alive sent while waiting for a reply
+        if message.strip():
+            self.commands.put(json.loads(message))
+
+    def next_page(self):
+        return self.commands.get(True, 2)['setScriptCfg']['page']
 
 class TestRcpApi(unittest.TestCase):
     def setUp(self):
@@ -31,6 +50,22 @@ class TestRcpApi(unittest.TestCase):
         rcpapi = RcpApi(settings=self.settings, comms=None)
         self.assertFalse(rcpapi.is_firmware_update_supported())
 
+    def test_parse_sample_message(self):
+        msg = '{"s":{"t":33,"d":[0.00,2.50,-2.50,397.0,0,4294967295,16383]}}\r\n'
+        self.assertEqual(json.loads(msg), parse_sample_message(msg))
+        self.assertEqual({'s': {'t': 1, 'd': []}}, parse_sample_message('{"s":{"t":1,"d":[]}}'))
+
+        # anything else takes the JSON decoder
+        self.assertIsNone(parse_sample_message('{"s":{"t":33,"meta":[{"nm":"Battery","ut":"Volts","sr":1}],"d":[0.00,1]}}'))
+        self.assertIsNone(parse_sample_message('{"s":{"t":33,"d":[0.00,1,]}}'))
+        self.assertIsNone(parse_sample_message('{"ver":{"major":2}}'))
+
+    def test_decode_message(self):
+        rcpapi = RcpApi(settings=self.settings, comms=self.comms)
+        for msg in ['{"s":{"t":33,"d":[1.5,3]}}\r\n', '{"s":{"t":33,"meta":[{"nm":"Battery","ut":"Volts","sr":1}],"d":[1.5,1]}}\r\n',
+                    '{"ver":{"major":2}}\r\n']:
+            self.assertEqual(json.loads(msg), rcpapi._decode_message(msg))
+
     def test_is_firmware_update_available_on_wired(self):
         self.comms.is_wireless = Mock(return_value=False)
         rcpapi = RcpApi(settings=self.settings, comms=self.comms)
@@ -42,6 +77,162 @@ class TestRcpApi(unittest.TestCase):
         self.assertFalse(rcpapi.is_firmware_update_supported())
 
 
+    def _start_sequence(self, rcpapi, command_count, window):
+        commands = [RcpCmd('setScriptCfg', rcpapi.setScriptPage, 'x', page, 1) for page in range(command_count)]
+        results = []
+        t = Thread(target=lambda: results.append(rcpapi._execute_command_sequence(commands, window)))
+        t.start()
+        return t, results
+
+    def _reply(self, rcpapi):
+        rcpapi.rcpCmdComplete({'setScriptCfg': {'rc': 1}}, None)
+
+    def test_pipelined_sequence(self):
+        device = FakeDevice()
+        rcpapi = RcpApi(settings=self.settings, comms=device)
+        progress = []
+        rcpapi.on_progress = lambda value: progress.append(value)
+        t, results = self._start_sequence(rcpapi, 6, 4)
+
+        # the window fills, then each reply lets one more command out
+        self.assertEqual([0, 1, 2, 3], [device.next_page() for i in range(4)])
+        self.assertRaises(Queue.Empty, device.commands.get, True, 0.1)
+        self._reply(rcpapi)
+        self.assertEqual(4, device.next_page())
+        self._reply(rcpapi)
+        self.assertEqual(5, device.next_page())
+        for i in range(4):
+            self._reply(rcpapi)
+        t.join(2)
+
+        self.assertEqual([{'setScriptCfg': {'rc': 1}}], results)
+        self.assertTrue(device.commands.empty())
+        # progress is reported for each acknowledged command
+        self.assertEqual(7, len(progress))
+        self.assertEqual(100, progress[-1])
+
+    def test_pipelined_sequence_retry(self):
+        device = FakeDevice()
+        rcpapi = RcpApi(settings=self.settings, comms=device)
+        rcpapi.msg_rx_timeout = 0.05
+        t, results = self._start_sequence(rcpapi, 3, 3)
+
+        self.assertEqual([0, 1, 2], [device.next_page() for i in range(3)])
+        self._reply(rcpapi)
+        # without a reply for page 1, the reply taken for page 0 could have been page 1's,
+        # so every page is sent again, in order, one at a time
+        for page in range(3):
+            self.assertEqual(page, device.next_page())
+            self.assertRaises(Queue.Empty, device.commands.get, True, 0.02)
+            self._reply(rcpapi)
+        t.join(2)
+
+        self.assertEqual([{'setScriptCfg': {'rc': 1}}], results)
+        self.assertTrue(device.commands.empty())
+
+    def test_pipelined_sequence_dropped_reply(self):
+        device = FakeDevice()
+        rcpapi = RcpApi(settings=self.settings, comms=device)
+        rcpapi.msg_rx_timeout = 0.05
+        t, results = self._start_sequence(rcpapi, 4, 4)
+
+        # the device gets every page, but the reply to page 1 is lost
+        self.assertEqual([0, 1, 2, 3], [device.next_page() for i in range(4)])
+        for i in range(3):
+            self._reply(rcpapi)
+        # the replies can't tell which page was missed, so the run is written again
+        for page in range(4):
+            self.assertEqual(page, device.next_page())
+            self._reply(rcpapi)
+        t.join(2)
+
+        self.assertEqual([{'setScriptCfg': {'rc': 1}}], results)
+        self.assertTrue(device.commands.empty())
+        # no replies are left over for the next sequence
+        self.assertTrue(rcpapi.cmdSequenceQueue.empty())
+
+    def test_pipelined_sequence_dropped_indexed_reply(self):
+        device = FakeDevice()
+        rcpapi = RcpApi(settings=self.settings, comms=device)
+        rcpapi.msg_rx_timeout = 0.05
+        commands = [RcpCmd('setObd2Cfg', rcpapi.set_obd2_channel_config, [], index, True, index == 3) for index in range(4)]
+        results = []
+        t = Thread(target=lambda: results.append(rcpapi._execute_command_sequence(commands, 4)))
+        t.start()
+
+        def reply(index):
+            rcpapi.rcpCmdComplete({'setObd2Cfg': {'rc': 1, 'index': index}}, None)
+
+        def next_index():
+            return device.commands.get(True, 2)['setObd2Cfg']['index']
+
+        self.assertEqual([0, 1, 2, 3], [next_index() for i in range(4)])
+        reply(0)
+        # the reply to index 1 is lost; the reply to index 2 shows it
+        reply(2)
+        reply(3)
+        # only the commands from the lost reply on are sent again, one at a time
+        for index in (1, 2, 3):
+            self.assertEqual(index, next_index())
+            self.assertRaises(Queue.Empty, device.commands.get, True, 0.02)
+            reply(index)
+        t.join(2)
+
+        self.assertEqual(1, len(results))
+        self.assertTrue(device.commands.empty())
+        self.assertTrue(rcpapi.cmdSequenceQueue.empty())
+
+    def test_pipelined_sequence_timeout(self):
+        device = FakeDevice()
+        rcpapi = RcpApi(settings=self.settings, comms=device)
+        rcpapi.msg_rx_timeout = 0.01
+        rcpapi.level_2_retries = 1
+        commands = [RcpCmd('setScriptCfg', rcpapi.setScriptPage, 'x', page, 1) for page in range(2)]
+        self.assertRaises(Exception, rcpapi._execute_command_sequence, commands, 2)
+        # the level 2 retry sends the first command again, on its own
+        self.assertEqual([0, 1, 0], [device.next_page() for i in range(3)])
+        self.assertTrue(device.commands.empty())
+
+    def test_plan_rcp_cfg_write(self):
+        rcpapi = RcpApi(settings=self.settings, comms=self.comms)
+        cfg = RcpConfig()
+
+        # without a snapshot of the device's config, every stale section is written
+        cfg.stale = False
+        cfg.analogConfig.channels[1].stale = True
+        cfg.lapConfig.stale = True
+        self.assertEqual(['setLapCfg', 'setAnalogCfg', 'flashCfg'], [c.name for c in rcpapi.plan_rcp_cfg_write(cfg)])
+
+        # once the config has been read, only the sections that differ are written
+        cfg.device_snapshot = rcpapi.config_snapshot(cfg)
+        self.assertEqual([], rcpapi.plan_rcp_cfg_write(cfg))
+
+        cfg.analogConfig.channels[1].linearScaling = 2.5
+        cfg.analogConfig.channels[2].stale = True
+        cfg.obd2Config.stale = True
+        commands = rcpapi.plan_rcp_cfg_write(cfg)
+        self.assertEqual([('setAnalogCfg', 1), ('flashCfg', None)], [(c.name, c.index) for c in commands])
+
+    def test_write_rcp_cfg_snapshot(self):
+        rcpapi = RcpApi(settings=self.settings, comms=self.comms)
+        rcpapi._queue_multiple = Mock()
+        cfg = RcpConfig()
+        cfg.device_snapshot = rcpapi.config_snapshot(cfg)
+        cfg.stale = False
+        cfg.gpsConfig.stale = True
+        cfg.gpsConfig.sampleRate = 50
+
+        written = []
+        rcpapi.writeRcpCfg(cfg, written.append, None)
+        commands, root_name, on_written = rcpapi._queue_multiple.call_args[0][:3]
+        self.assertEqual(['setGpsCfg', 'flashCfg'], [c.name for c in commands])
+
+        # once written, the device has the new config
+        on_written({'setRcpCfg': {}})
+        self.assertEqual(1, len(written))
+        self.assertEqual([], rcpapi.plan_rcp_cfg_write(cfg))
+
+
 def main():
     unittest.main()
 
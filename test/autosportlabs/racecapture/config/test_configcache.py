@@ -0,0 +1,91 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from autosportlabs.racecapture.config.configcache import RcpConfigCache, forget_other_device
+from autosportlabs.racecapture.api.rcpapi import RcpApi
+from mock import Mock
+from autosportlabs.racecapture.config.rcpconfig import RcpConfig, VersionConfig
+
+class RcpConfigCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.cache = RcpConfigCache(self.data_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def _version(self, serial, minor=8):
+        version = VersionConfig(major=2, minor=minor, bugfix=0)
+        version.name = 'RCP_MK3'
+        version.serial = serial
+        return version
+
+    def test_save_load(self):
+        rc_config = RcpConfig()
+        # as read from a device
+        rc_config.fromJson(json.loads(json.dumps(RcpConfig().toJson())))
+        rc_config.gpsConfig.sampleRate = 25
+        self.cache.save(self._version('1234'), rc_config)
+
+        cached_config = RcpConfig()
+        cached_config.fromJson(self.cache.load(self._version('1234')))
+        self.assertEqual(25, cached_config.gpsConfig.sampleRate)
+        self.assertEqual(rc_config.toJson(), cached_config.toJson())
+
+    def test_cached_per_device(self):
+        self.cache.save(self._version('1234'), RcpConfig())
+        self.assertIsNone(self.cache.load(self._version('5678')))
+        # a firmware update may change the config
+        self.assertIsNone(self.cache.load(self._version('1234', minor=9)))
+        # devices without a serial number can't be told apart
+        self.cache.save(self._version(''), RcpConfig())
+        self.assertIsNone(self.cache.load(self._version('')))
+
+    def test_load_corrupt(self):
+        version = self._version('1234')
+        self.cache.save(version, RcpConfig())
+        cache_dir = os.path.join(self.data_dir, RcpConfigCache.CACHE_DIR)
+        for name in os.listdir(cache_dir):
+            with open(os.path.join(cache_dir, name), 'w') as cache_file:
+                cache_file.write('{"rcpCfg":')
+        self.assertIsNone(self.cache.load(version))
+
+    def test_forget_other_device(self):
+        rcpapi = RcpApi(settings=Mock(), comms=Mock())
+        rc_config = RcpConfig()
+        rc_config.device_snapshot = rcpapi.config_snapshot(rc_config)
+        self.assertFalse(forget_other_device(rc_config, None, self._version('1234')))
+        self.assertFalse(forget_other_device(rc_config, '1234', self._version('1234')))
+        self.assertIsNotNone(rc_config.device_snapshot)
+
+        # edits not yet written are kept for the new device, but compared with nothing of the old one
+        rc_config.stale = False
+        rc_config.gpsConfig.stale = True
+        rc_config.gpsConfig.sampleRate = 50
+        rc_config.analogConfig.channels[0].stale = True
+        self.assertTrue(forget_other_device(rc_config, '1234', self._version('5678')))
+        self.assertIsNone(rc_config.device_snapshot)
+        self.assertEqual(['setGpsCfg', 'setAnalogCfg', 'flashCfg'], [c.name for c in rcpapi.plan_rcp_cfg_write(rc_config)])
@@ -0,0 +1,69 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+from autosportlabs.racecapture.data.decimation import PlotPyramid
+
+class PlotPyramidTest(unittest.TestCase):
+
+    def _samples(self, count):
+        # a flat line with a one sample spike and dip, the way a brake spike shows up
+        ys = [10] * count
+        ys[count / 3] = 100
+        ys[count * 2 / 3] = -50
+        return range(count), ys
+
+    def test_whole_range(self):
+        xs, ys = self._samples(100000)
+        pyramid = PlotPyramid(xs, ys)
+        points = pyramid.points(0, 99999, 1000)
+        self.assertTrue(500 <= len(points) <= 1000)
+        # the extremes survive decimation
+        self.assertTrue((33333, 100) in points)
+        self.assertTrue((66666, -50) in points)
+        self.assertEqual(99999, pyramid.max_x)
+
+    def test_zoom(self):
+        xs, ys = self._samples(100000)
+        pyramid = PlotPyramid(xs, ys)
+        # zoomed in far enough, every sample is drawn
+        points = pyramid.points(33000, 33500, 1000)
+        self.assertEqual([(x, ys[x]) for x in range(32999, 33502)], points)
+
+        # a range in between is drawn with about as many points as the whole plot
+        points = pyramid.points(20000, 40000, 1000)
+        self.assertTrue(500 <= len(points) <= 1000)
+        self.assertTrue((33333, 100) in points)
+        self.assertTrue(points[0][0] < 20000 and points[-1][0] > 40000)
+
+    def test_small(self):
+        pyramid = PlotPyramid([0, 1, 2], [5, None, 7])
+        self.assertEqual(1, pyramid.levels)
+        self.assertEqual([(0, 5), (2, 7)], pyramid.points(0, 2, 1000))
+        self.assertIsNone(PlotPyramid([], []).max_x)
+        self.assertEqual([], PlotPyramid([], []).points(0, 1, 1000))
+
+    def test_sample_index_at(self):
+        pyramid = PlotPyramid([0.0, 1.5, 1.5, 3.0], [1, 2, 3, 4], [10, 11, 12, 13])
+        self.assertEqual(10, pyramid.sample_index_at(-1))
+        self.assertEqual(11, pyramid.sample_index_at(1.0))
+        self.assertEqual(13, pyramid.sample_index_at(1.5))
+        self.assertRaises(IndexError, pyramid.sample_index_at, 3.0)
@@ -20,7 +20,8 @@
 
 import unittest
 import json
-from autosportlabs.racecapture.data.sampledata import Sample
+from array import array
+from autosportlabs.racecapture.data.sampledata import Sample, ChannelIndex, SampleRow, SampleMetaException
 
 TEST_SAMPLE1 = '{"s":{"t":33,"meta":[{"nm":"Battery","ut":"Volts","sr":1},{"nm":"AccelX","ut":"G","sr":25},{"nm":"AccelY","ut":"G","sr":25},{"nm":"AccelZ","ut":"G","sr":25},{"nm":"Yaw","ut":"Deg/Sec","sr":25},{"nm":"Latitude","ut":"Degrees","sr":50},{"nm":"Longitude","ut":"Degrees","sr":50},{"nm":"Speed","ut":"MPH","sr":50},{"nm":"Time","ut":"","sr":50},{"nm":"Distance","ut":"Miles","sr":50},{"nm":"LapCount","ut":"Count","sr":1},{"nm":"LapTime","ut":"Min","sr":1},{"nm":"Sector","ut":"Count","sr":1},{"nm":"SectorTime","ut":"Min","sr":1}],"d":[0.00,2.50,2.50,-2.50,397.0,0.000000,0.000000,0.00,0.000000,0.000,0,0.0000,0,0.0000,16383]}}'
 
@@ -55,6 +56,52 @@ class SampleDataTest(unittest.TestCase):
     
     def test_meta_data(self):
         pass
+
+    def test_sparse_sample_data(self):
+        sample = Sample()
+        sample.fromJson(json.loads(TEST_SAMPLE1))
+        meta_count = len(sample.metas.channel_metas)
+
+        # only Battery, AccelY and LapTime are present
+        sample.fromJson({'s': {'t': 34, 'd': [12.5, 1.25, 1.5, (1 << 0) | (1 << 2) | (1 << 11)]}})
+        self.assertEqual(34, sample.tick)
+        self.assertListEqual([('Battery', 12.5), ('AccelY', 1.25), ('LapTime', 1.5)],
+                             [(s.channelMeta.name, s.value) for s in sample.samples])
+
+        # the number of values must match the bitmask
+        self.assertRaises(SampleMetaException, sample.fromJson, {'s': {'t': 35, 'd': [12.5, 1 | 4]}})
+        self.assertRaises(SampleMetaException, sample.fromJson, {'s': {'t': 35, 'd': [1] * (meta_count + 2)}})
+
+    def test_sample_data_multiple_bitmasks(self):
+        metas = [{'nm': 'c{}'.format(i), 'ut': '', 'sr': 1} for i in range(40)]
+        sample = Sample()
+        sample.fromJson({'s': {'t': 1, 'meta': metas, 'd': [1.0, 2.0, 3.0, 1 << 31, (1 << 0) | (1 << 7)]}})
+        self.assertListEqual([('c31', 1.0), ('c32', 2.0), ('c39', 3.0)],
+                             [(s.channelMeta.name, s.value) for s in sample.samples])
+
+        # new meta recompiles the decoder
+        sample.fromJson({'s': {'t': 2, 'meta': metas[:2], 'd': [5.0, 2]}})
+        self.assertListEqual([('c1', 5.0)], [(s.channelMeta.name, s.value) for s in sample.samples])
+
+    def test_sample_row(self):
+        index = ChannelIndex(['RPM', 'Speed', 'Yaw'])
+        row = SampleRow(index, array('d', [1111, float('nan'), -2.5]), 0b101)
+
+        self.assertEqual(1111, row['RPM'])
+        self.assertEqual(-2.5, row.get('Yaw'))
+        self.assertIsNone(row.get('Speed'))
+        self.assertEqual(0, row.get('Other', 0))
+        self.assertRaises(KeyError, lambda: row['Speed'])
+        self.assertIn('RPM', row)
+        self.assertNotIn('Speed', row)
+        self.assertEqual(2, len(row))
+        self.assertListEqual(['RPM', 'Yaw'], row.keys())
+        self.assertListEqual([('RPM', 1111), ('Yaw', -2.5)], row.items())
+        self.assertEqual((-2.5, None, 1111), row.select(['Yaw', 'Speed', 'RPM']))
+
+        empty = SampleRow(index)
+        self.assertEqual(0, len(empty))
+        self.assertEqual(3, len(empty.values))
         
 def main():
     unittest.main()
@@ -19,9 +19,10 @@
 # this code. If not, see <http://www.gnu.org/licenses/>.
 
 import unittest
-from mock import Mock, patch
+from mock import Mock, MagicMock, patch
 from autosportlabs.racecapture.data.sessionrecorder import SessionRecorder
-import Queue
+from autosportlabs.racecapture.data.sampledata import ChannelIndex, SampleRow
+from array import array
 
 class TestSessionRecorder(unittest.TestCase):
 
@@ -43,6 +44,7 @@ class TestSessionRecorder(unittest.TestCase):
         self.mock_datastore.create_session = Mock(return_value=1)
         self.mock_datastore.init_session = Mock(return_value=1)
         self.mock_datastore.get_sessions = Mock(return_value=[])
+        self.mock_datastore.writer = MagicMock()
         self.mock_status_pump.add_listener = Mock()
 
     def test_starts(self):
@@ -158,40 +160,34 @@ class TestSessionRecorder(unittest.TestCase):
         disconnect_listener()
         self.assertTrue(session_recorder.recording, "Session recorder stops recording on disconnect")
 
-    def test_on_sample(self):
-        # warning: this is test is  necessarily slow, as it involves timing the queue performance.
+    def test_records_sample_tap(self):
+        self.mock_databus.getMeta = Mock(return_value={"RPM": "meta", "Speed": "meta"})
+
         session_recorder = SessionRecorder(self.mock_datastore, self.mock_databus, self.mock_rcp_api,
-                                           self.mock_settings, self.mock_track_manager, self.mock_status_pump)
-        
-	q = session_recorder._sample_queue
-        session_recorder.recording = True
-
-	sampleIn = { 'v': 0 }
-	session_recorder._on_sample( sampleIn )
-	sampleOut = q.get( True, 0 )
-        self.assertTrue(sampleIn == sampleOut, "Session recorder basic queue test")
-
-	i = 0
-        while not session_recorder._sample_queue_full:
-            session_recorder._on_sample( { 'v': i } )
-            i += 1
-
-        self.assertTrue( session_recorder._sample_send_delay
-            == SessionRecorder.SAMPLE_QUEUE_MAX_SEND_DELAY_MS,
-                "Session recorder is slowing sample rate" )
-        
-        for i in range( 0, SessionRecorder.SAMPLE_QUEUE_MAX_SIZE * 2 ):
-            session_recorder._on_sample( { 'v': i } )
-            try:
-                sampleOut = q.get( True, 0 )
-                sampleOut = q.get( True, 0 )
-            except Queue.Empty:
-                pass
-
-        self.assertTrue( session_recorder._sample_send_delay
-            == SessionRecorder.SAMPLE_QUEUE_MIN_SEND_DELAY_MS,
-                "Session recorder is restoring max sample rate" )
-        
+                                           self.mock_settings, self.mock_track_manager, self.mock_status_pump, stop_delay=0)
+        session_recorder.on_view_change('dash')
+        connect_listener = self.mock_rcp_api.add_connect_listener.call_args[0][0]
+        connect_listener()
+        self.assertTrue(session_recorder.recording, "Session recorder is recording")
+
+        # samples captured by the tap are recorded as they are captured, in channel order
+        tap = session_recorder.sample_tap
+        index = ChannelIndex(['Speed', 'RPM'])
+        for tick in range(SessionRecorder.SAMPLE_QUEUE_UNCOMMITTED_INSERT_LIMIT + 1):
+            tap.capture(tick, SampleRow(index, array('d', [100, tick]), 0b11))
+
+        session_recorder.stop(stop_now=True)
+        self.assertFalse(tap.capturing)
+        self.assertEqual(0, len(tap))
+
+        recorded = []
+        for call in self.mock_datastore.insert_samples_nocommit.call_args_list:
+            channel_names, samples, session_id = call[0]
+            recorded.extend([dict(zip(channel_names, values)) for values in samples])
+        self.assertListEqual([{'RPM': tick, 'Speed': 100} for tick in range(SessionRecorder.SAMPLE_QUEUE_UNCOMMITTED_INSERT_LIMIT + 1)],
+                             recorded)
+        self.mock_datastore.finalize_session.assert_called_with(1)
+
 
 def main():
     unittest.main()
@@ -0,0 +1,81 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from autosportlabs.racecapture.databus.channelhistory import ChannelHistory
+
+
+class ChannelHistoryTest(unittest.TestCase):
+
+    def test_empty(self):
+        history = ChannelHistory(4)
+        for window in [history.last(3), history.last_seconds(1)]:
+            self.assertEqual(0, len(window))
+            self.assertListEqual([], list(window))
+            self.assertIsNone(window.min())
+            self.assertIsNone(window.max())
+            self.assertIsNone(window.mean())
+
+    def test_wraps(self):
+        history = ChannelHistory(4)
+        for i in range(6):
+            history.append(i * 100, i)
+
+        self.assertEqual(4, len(history))
+        window = history.last(10)
+        self.assertListEqual([(200, 2), (300, 3), (400, 4), (500, 5)], list(window))
+        self.assertEqual(2, window.min())
+        self.assertEqual(5, window.max())
+        self.assertEqual(3.5, window.mean())
+        self.assertListEqual([4, 5], list(history.last(2).values()))
+        self.assertListEqual([400, 500], list(history.last(2).ticks()))
+
+    def test_last_seconds(self):
+        history = ChannelHistory(5)
+        for i in range(8):
+            history.append(i * 100, i)
+
+        self.assertListEqual([5, 6, 7], list(history.last_seconds(0.2).values()))
+        self.assertListEqual([7], list(history.last_seconds(0).values()))
+        # limited to the values kept
+        self.assertListEqual([3, 4, 5, 6, 7], list(history.last_seconds(10).values()))
+
+    def test_overwritten_window(self):
+        history = ChannelHistory(3)
+        for i in range(3):
+            history.append(i, i)
+        window = history.last(3)
+        history.append(3, 3)
+        self.assertRaises(IndexError, window.values)
+
+    def test_resize(self):
+        history = ChannelHistory(3)
+        for i in range(5):
+            history.append(i, i)
+        window = history.last(2)
+
+        history.resize(6)
+        self.assertListEqual([3, 4], list(window.values()))
+        for i in range(5, 8):
+            history.append(i, i)
+        self.assertListEqual([2, 3, 4, 5, 6, 7], list(history.last(6).values()))
+
+        history.resize(2)
+        self.assertListEqual([6, 7], list(history.last(6).values()))
@@ -18,8 +18,12 @@
 # have received a copy of the GNU General Public License along with
 # this code. If not, see <http://www.gnu.org/licenses/>.
 
+import gc
+import threading
+import time
 import unittest
-from autosportlabs.racecapture.databus.databus import DataBus
+from mock import patch
+from autosportlabs.racecapture.databus.databus import DataBus, DataBusFrame, SampleTap
 from autosportlabs.racecapture.data.sampledata import Sample, ChannelMeta, SampleValue,\
 	ChannelMetaCollection
 
@@ -140,7 +144,364 @@ class DataBusTest(unittest.TestCase):
 		dataBus.update_channel_meta(metas)
 		dataBus.notify_listeners(None)
 		self.assertEqual(self.channelMeta['RPM'], metas.channel_metas[0])
-		
+
+	def test_sample_tap(self):
+		tap = SampleTap(max_size=3)
+		sample = Sample()
+		meta = ChannelMeta(name='RPM')
+		sample.channel_metas = [meta]
+		sample.samples = [SampleValue(1111, meta)]
+		sample.tick = 1
+
+		dataBus = DataBus()
+		metas = ChannelMetaCollection()
+		metas.channel_metas = [meta, ChannelMeta(name='Speed')]
+		dataBus.update_channel_meta(metas)
+		#nothing is captured until the tap is started
+		dataBus.update_samples(sample, [tap])
+		self.assertEqual(len(tap), 0)
+
+		tap.start()
+		dataBus.update_samples(sample, [tap])
+		samples = tap.take(10)
+		self.assertEqual(len(samples), 1)
+		self.assertEqual(samples[0][0], 1)
+		self.assertEqual(samples[0][1].select(['RPM', 'Speed']), (1111, None))
+
+		#every sample is captured, without waiting for the listeners to be notified
+		for tick in range(2, 7):
+			sample.tick = tick
+			sample.samples = [SampleValue(tick * 1000, meta)]
+			dataBus.update_samples(sample, [tap])
+		#the oldest samples are dropped once the tap is full
+		self.assertEqual(tap.dropped, 2)
+		self.assertListEqual([(tick, row['RPM']) for tick, row in tap.take(2)], [(4, 4000), (5, 5000)])
+		self.assertListEqual([(tick, row['RPM']) for tick, row in tap.take(2)], [(6, 6000)])
+
+		tap.stop()
+		dataBus.update_samples(sample, [tap])
+		self.assertEqual(len(tap), 0)
+
+	def test_update_decoded_sample(self):
+		sample = Sample()
+		sample.fromJson({'s': {'t': 1, 'meta': [{'nm': 'RPM', 'ut': '', 'sr': 10}, {'nm': 'Speed', 'ut': '', 'sr': 10}],
+						 'd': [1234, 88, 3]}})
+		dataBus = DataBus()
+		dataBus.update_channel_meta(sample.metas)
+		dataBus.update_samples(sample)
+
+		sample.fromJson({'s': {'t': 2, 'd': [99, 2]}})
+		dataBus.update_samples(sample)
+
+		self.assertEqual(dataBus.getData('RPM'), 1234)
+		self.assertEqual(dataBus.getData('Speed'), 99)
+		self.assertEqual(dict(dataBus.sample_row.iteritems()), {'RPM': 1234, 'Speed': 99})
+
+	def test_dirty_channels(self):
+		rpm_values = []
+		speed_values = []
+		deltas = []
+		sample = Sample()
+		rpm = ChannelMeta(name='RPM')
+		speed = ChannelMeta(name='Speed')
+
+		dataBus = DataBus()
+		metas = ChannelMetaCollection()
+		metas.channel_metas = [rpm, speed]
+		dataBus.update_channel_meta(metas)
+		dataBus.addChannelListener('RPM', rpm_values.append)
+		dataBus.addChannelListener('Speed', speed_values.append)
+		dataBus.add_sample_listener(deltas.append)
+
+		sample.samples = [SampleValue(1000, rpm), SampleValue(50, speed)]
+		dataBus.update_samples(sample)
+		dataBus.notify_listeners(None)
+		self.assertEqual(dataBus.frame_notifications, 2)
+
+		#only the channel that changed is notified
+		sample.samples = [SampleValue(2000, rpm), SampleValue(50, speed)]
+		dataBus.update_samples(sample)
+		dataBus.notify_listeners(None)
+		self.assertEqual(rpm_values, [1000, 2000])
+		self.assertEqual(speed_values, [50])
+		self.assertEqual(dataBus.frame_notifications, 1)
+		self.assertEqual(dataBus.frame_notifications_skipped, 1)
+		self.assertEqual(list(deltas[-1].iterchanged()), [('RPM', 2000)])
+		self.assertEqual(dict(deltas[-1].iteritems()), {'RPM': 2000, 'Speed': 50})
+
+		#nothing changed; no listeners are notified
+		dataBus.update_samples(sample)
+		dataBus.notify_listeners(None)
+		self.assertEqual(len(deltas), 2)
+		self.assertEqual(dataBus.notify_stats, {'frame_notifications': 0, 'frame_skipped': 2,
+												'deferred': 0, 'notifications': 3, 'skipped': 3})
+
+		#a new listener gets the current value
+		late_values = []
+		dataBus.addChannelListener('Speed', late_values.append)
+		dataBus.notify_listeners(None)
+		self.assertEqual(late_values, [50])
+
+		dataBus.removeChannelListener('RPM', rpm_values.append)
+		dataBus.removeChannelListener('Speed', speed_values.append)
+		dataBus.removeChannelListener('Speed', late_values.append)
+		dataBus.remove_sample_listener(deltas.append)
+
+	def test_decoding_not_blocked_by_listeners(self):
+		listener_blocked = threading.Event()
+		release_listener = threading.Event()
+		rpm_values = []
+
+		def slow_listener(value):
+			rpm_values.append(value)
+			listener_blocked.set()
+			release_listener.wait(10)
+
+		sample = Sample()
+		rpm = ChannelMeta(name='RPM')
+		dataBus = DataBus()
+		metas = ChannelMetaCollection()
+		metas.channel_metas = [rpm]
+		dataBus.update_channel_meta(metas)
+		dataBus.addChannelListener('RPM', slow_listener)
+		try:
+			sample.samples = [SampleValue(0, rpm)]
+			dataBus.update_samples(sample)
+			ui_thread = threading.Thread(target=dataBus.notify_listeners, args=(None,))
+			ui_thread.start()
+			self.assertTrue(listener_blocked.wait(10))
+
+			#the UI thread is stuck in a listener; samples are still decoded
+			for value in range(1, 1001):
+				sample.samples = [SampleValue(value, rpm)]
+				dataBus.update_samples(sample)
+			self.assertTrue(ui_thread.is_alive())
+			self.assertEqual(dataBus.getData('RPM'), 1000)
+
+			release_listener.set()
+			ui_thread.join(10)
+			#the next notification has the latest value
+			dataBus.notify_listeners(None)
+			self.assertEqual(rpm_values, [0, 1000])
+		finally:
+			release_listener.set()
+			dataBus.removeChannelListener('RPM', slow_listener)
+
+	def test_decoding_with_slow_listeners_stress(self):
+		rpm_values = []
+		sample_rows = []
+
+		def slow_listener(value):
+			rpm_values.append(value)
+			time.sleep(0.001)
+
+		sample = Sample()
+		rpm = ChannelMeta(name='RPM')
+		speed = ChannelMeta(name='Speed')
+		dataBus = DataBus()
+		metas = ChannelMetaCollection()
+		metas.channel_metas = [rpm, speed]
+		dataBus.update_channel_meta(metas)
+		dataBus.addChannelListener('RPM', slow_listener)
+		dataBus.add_sample_listener(sample_rows.append)
+
+		decoding = [True]
+		def ui_loop():
+			while decoding[0]:
+				dataBus.notify_listeners(None)
+
+		ui_thread = threading.Thread(target=ui_loop)
+		ui_thread.start()
+		longest_update = 0
+		try:
+			for value in range(20000):
+				sample.samples = [SampleValue(value, rpm), SampleValue(value % 7, speed)]
+				start = time.time()
+				dataBus.update_samples(sample)
+				longest_update = max(longest_update, time.time() - start)
+			decoding[0] = False
+			ui_thread.join(10)
+			dataBus.notify_listeners(None)
+		finally:
+			decoding[0] = False
+			dataBus.removeChannelListener('RPM', slow_listener)
+			dataBus.remove_sample_listener(sample_rows.append)
+
+		#no update waited on the listeners, which take a millisecond or more each
+		self.assertLess(longest_update, 0.5)
+		#listeners saw values in order, and ended up with the latest
+		self.assertEqual(rpm_values, sorted(rpm_values))
+		self.assertEqual(rpm_values[-1], 19999)
+		self.assertTrue(all(row['RPM'] % 7 == row['Speed'] for row in sample_rows))
+
+	@patch('autosportlabs.racecapture.databus.databus.time')
+	def test_rate_cap(self, mock_time):
+		temp_values = []
+		rpm_values = []
+		sample = Sample()
+		temp = ChannelMeta(name='EngineTemp')
+		rpm = ChannelMeta(name='RPM')
+
+		dataBus = DataBus()
+		metas = ChannelMetaCollection()
+		metas.channel_metas = [temp, rpm]
+		dataBus.update_channel_meta(metas)
+		dataBus.addChannelListener('EngineTemp', temp_values.append)
+		dataBus.addChannelListener('RPM', rpm_values.append)
+		dataBus.set_channel_rate_cap('EngineTemp', 1)
+
+		def update(now, temp_value, rpm_value):
+			mock_time.return_value = now
+			sample.samples = [SampleValue(temp_value, temp), SampleValue(rpm_value, rpm)]
+			dataBus.update_samples(sample)
+			dataBus.notify_listeners(None)
+
+		update(10.0, 90, 1000)
+		update(10.02, 91, 2000)
+		update(10.04, 92, 3000)
+		#changes within the cap are held back; other channels are not affected
+		self.assertEqual(temp_values, [90])
+		self.assertEqual(rpm_values, [1000, 2000, 3000])
+
+		#the latest held back value is notified once the cap allows, without a new change
+		mock_time.return_value = 11.0
+		dataBus.notify_listeners(None)
+		self.assertEqual(temp_values, [90, 92])
+		self.assertEqual(dataBus.notify_stats['deferred'], 2)
+
+		dataBus.set_channel_rate_cap('EngineTemp', None)
+		update(11.02, 93, 3000)
+		self.assertEqual(temp_values, [90, 92, 93])
+
+		dataBus.removeChannelListener('EngineTemp', temp_values.append)
+		dataBus.removeChannelListener('RPM', rpm_values.append)
+
+	@patch('autosportlabs.racecapture.databus.databus.time')
+	def test_sample_rate_caps(self, mock_time):
+		temp_values = []
+		rpm_values = []
+		sample = Sample()
+		temp = ChannelMeta(name='EngineTemp', sampleRate=1)
+		rpm = ChannelMeta(name='RPM', sampleRate=50)
+
+		dataBus = DataBus(cap_to_sample_rate=True)
+		metas = ChannelMetaCollection()
+		metas.channel_metas = [temp, rpm]
+		dataBus.update_channel_meta(metas)
+		dataBus.addChannelListener('EngineTemp', temp_values.append)
+		dataBus.addChannelListener('RPM', rpm_values.append)
+
+		for i in range(3):
+			mock_time.return_value = 10.0 + i * 0.02
+			sample.samples = [SampleValue(90 + i, temp), SampleValue(1000 * (i + 1), rpm)]
+			dataBus.update_samples(sample)
+			dataBus.notify_listeners(None)
+
+		#each channel is notified no more often than its sample rate
+		self.assertEqual(temp_values, [90])
+		self.assertEqual(rpm_values, [1000, 2000, 3000])
+		self.assertEqual(dataBus.rate_capped_channels, 1)
+
+		#a cap that is set takes the place of the one from the meta
+		dataBus.set_channel_rate_cap('EngineTemp', 100)
+		mock_time.return_value = 10.06
+		sample.samples = [SampleValue(93, temp)]
+		dataBus.update_samples(sample)
+		dataBus.notify_listeners(None)
+		self.assertEqual(temp_values, [90, 93])
+
+		dataBus.removeChannelListener('EngineTemp', temp_values.append)
+		dataBus.removeChannelListener('RPM', rpm_values.append)
+
+	def test_changes_kept_while_not_notified(self):
+		rpm_values = []
+		speed_values = []
+		sample = Sample()
+		rpm = ChannelMeta(name='RPM')
+		speed = ChannelMeta(name='Speed')
+
+		dataBus = DataBus()
+		metas = ChannelMetaCollection()
+		metas.channel_metas = [rpm, speed]
+		dataBus.update_channel_meta(metas)
+		dataBus.addChannelListener('RPM', rpm_values.append)
+		dataBus.addChannelListener('Speed', speed_values.append)
+
+		def live_frames():
+			return len([o for o in gc.get_objects() if isinstance(o, DataBusFrame)])
+
+		frames = live_frames()
+		sample.samples = [SampleValue(88, speed)]
+		dataBus.update_samples(sample)
+		for i in range(1000):
+			sample.samples = [SampleValue(i, rpm)]
+			dataBus.update_samples(sample)
+		#the frames published while the UI thread isn't notifying aren't kept
+		self.assertTrue(live_frames() - frames <= 1)
+
+		#the changes of every frame are notified together
+		dataBus.notify_listeners(None)
+		self.assertEqual(rpm_values, [999])
+		self.assertEqual(speed_values, [88])
+		dataBus.notify_listeners(None)
+		self.assertEqual(rpm_values, [999])
+
+		dataBus.removeChannelListener('RPM', rpm_values.append)
+		dataBus.removeChannelListener('Speed', speed_values.append)
+
+	def test_sample_row(self):
+		rows = []
+		sample = Sample()
+		rpm = ChannelMeta(name='RPM')
+		speed = ChannelMeta(name='Speed')
+		sample.samples = [SampleValue(1111, rpm)]
+
+		dataBus = DataBus()
+		metas = ChannelMetaCollection()
+		metas.channel_metas = [rpm, speed]
+		dataBus.update_channel_meta(metas)
+		dataBus.add_sample_listener(rows.append)
+		dataBus.update_samples(sample)
+		dataBus.notify_listeners(None)
+
+		sample.samples = [SampleValue(88, speed)]
+		dataBus.update_samples(sample)
+		dataBus.notify_listeners(None)
+		dataBus.remove_sample_listener(rows.append)
+
+		#each update publishes a new row; rows already published are left as they were
+		self.assertEqual(len(rows), 2)
+		self.assertEqual(dict(rows[0].iteritems()), {'RPM': 1111})
+		self.assertEqual(dict(rows[1].iteritems()), {'RPM': 1111, 'Speed': 88})
+		self.assertIsNot(rows[0].values, rows[1].values)
+
+	def test_channel_history(self):
+		sample = Sample()
+		sample.fromJson({'s': {'t': 100, 'meta': [{'nm': 'RPM', 'ut': '', 'sr': 10}, {'nm': 'Speed', 'ut': '', 'sr': 10}],
+						 'd': [1000, 50, 3]}})
+		dataBus = DataBus()
+		dataBus.update_channel_meta(sample.metas)
+		dataBus.update_samples(sample)
+
+		#history is recorded from when it is first requested, and shared
+		history = dataBus.get_channel_history('RPM', 10)
+		self.assertIs(history, dataBus.get_channel_history('RPM', 5))
+		self.assertEqual(len(history), 0)
+
+		for tick in range(200, 1000, 100):
+			sample.fromJson({'s': {'t': tick, 'd': [2000, 1]}})
+			dataBus.update_samples(sample)
+		#unchanged values are recorded; channels missing from a sample are not
+		sample.fromJson({'s': {'t': 1000, 'd': [60, 2]}})
+		dataBus.update_samples(sample)
+		self.assertEqual(len(history), 8)
+		self.assertEqual(list(history.last_seconds(0.25)), [(700, 2000), (800, 2000), (900, 2000)])
+
+		#asking for more values grows the shared history
+		self.assertIs(history, dataBus.get_channel_history('RPM', 20))
+		self.assertEqual(history.size, 20)
+		self.assertEqual(len(history), 8)
+
 def main():
 	unittest.main()
 
@@ -0,0 +1,68 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from autosportlabs.racecapture.databus.updatescheduler import AdaptiveUpdateScheduler, \
+    LIMIT_MAX_RATE, LIMIT_MIN_RATE, LIMIT_LOAD
+
+
+class AdaptiveUpdateSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.updates = []
+        self.scheduler = AdaptiveUpdateScheduler(self.updates.append, min_rate=10, max_rate=50, load_target=0.5)
+
+    def test_fast_updates(self):
+        for i in range(50):
+            self.scheduler.adapt(0.001, 0.002)
+        self.assertEqual(50, self.scheduler.rate)
+        self.assertEqual(LIMIT_MAX_RATE, self.scheduler.limited_by)
+
+    def test_backs_off_and_recovers(self):
+        # a slow frame drops the rate at once
+        self.scheduler.adapt(0.01, 0.1)
+        self.assertLess(self.scheduler.rate, 50)
+
+        for i in range(20):
+            self.scheduler.adapt(0.01, 0.02)
+        self.assertEqual(LIMIT_LOAD, self.scheduler.limited_by)
+        self.assertAlmostEqual(1 / 0.06, self.scheduler.rate, delta=2)
+
+        # and recovers gradually once the load drops
+        self.scheduler.adapt(0.001, 0.001)
+        self.assertLess(self.scheduler.rate, 20)
+        for i in range(100):
+            self.scheduler.adapt(0.001, 0.001)
+        self.assertEqual(50, self.scheduler.rate)
+
+    def test_rate_bounds(self):
+        for i in range(50):
+            self.scheduler.adapt(0.1, 0.2)
+        self.assertEqual(10, self.scheduler.rate)
+        self.assertEqual(LIMIT_MIN_RATE, self.scheduler.limited_by)
+
+        self.scheduler.set_rate_bounds(20, 30)
+        self.assertEqual(20, self.scheduler.rate)
+        self.assertRaises(ValueError, self.scheduler.set_rate_bounds, 30, 20)
+
+    def test_update(self):
+        self.scheduler._on_update(0.03)
+        self.assertListEqual([0.03], self.updates)
+        self.assertAlmostEqual(2.0, self.scheduler.stats['frame_lag_ms'], places=3)
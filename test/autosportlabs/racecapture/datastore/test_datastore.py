@@ -24,6 +24,8 @@ import csv
 import unittest
 import os
 import os.path
+import sqlite3
+import threading
 from collections import namedtuple
 from autosportlabs.racecapture.datastore.datastore import DataStore, Filter, \
     DataSet, _interp_dpoints, _smooth_dataset, _scrub_sql_value
@@ -33,15 +35,18 @@ fqp = os.path.dirname(os.path.realpath(__file__))
 db_path = os.path.join(fqp, 'rctest.sql3')
 log_path = os.path.join(fqp, 'rc_adj.log')
 import_export_path = os.path.join(fqp, 'import_export.log')
+sonoma_path = os.path.join(fqp, 'sonoma.log')
 
 # NOTE! that
 
 
 class DataStoreTest(unittest.TestCase):
+    columnar = False
+    wal = False
 
     @classmethod
     def setUpClass(self):
-        self.ds = DataStore()
+        self.ds = DataStore(columnar=self.columnar, wal=self.wal)
 
         if os.path.exists(db_path):
             os.remove(db_path)
@@ -425,6 +430,214 @@ class DataStoreTest(unittest.TestCase):
 
             self.ds.delete_session(import_export_id)
 
+    def test_import_sparse_datalog(self):
+        """
+        Ensures gaps are filled forward and leading gaps are filled backward,
+        including across the chunks the import is processed in
+        """
+        log = ('"Interval"|"ms"|0|0|1,"Utc"|"ms"|0|0|1,"A"|""|0|100|10,"B"|""|0|100|1,"C"|""|0|100|1\n'
+               '0,1000,,,\n'
+               '10,1010,5,,\n'
+               '20,1020,,7,\n'
+               'bad,line,,,\n'
+               '30,1030,6,,\n'
+               '40,1040,,,\n'
+               '50,1050,,,9\n'
+               '60,1060,8,1\n'
+               '70,1070,8,1,\n'
+               '80,1080,,,\n')
+
+        sparse_log_path = os.path.join(fqp, 'sparse.log')
+        chunk_bytes = DataStore.IMPORT_CHUNK_BYTES
+        try:
+            with open(sparse_log_path, 'wb') as sparse_log:
+                sparse_log.write(log)
+
+            DataStore.IMPORT_CHUNK_BYTES = 32
+            session_id = self.ds.import_datalog(sparse_log_path, 'sparse')
+            dataset = self.ds.query(sessions=[session_id],
+                                    channels=['Interval', 'A', 'B', 'C'])
+            records = dataset.fetch_records()
+            self.ds.delete_session(session_id)
+        finally:
+            DataStore.IMPORT_CHUNK_BYTES = chunk_bytes
+            os.remove(sparse_log_path)
+
+        self.assertListEqual([(session_id, 0.0, 5.0, 7.0, 9.0),
+                              (session_id, 10.0, 5.0, 7.0, 9.0),
+                              (session_id, 20.0, 5.0, 7.0, 9.0),
+                              (session_id, 30.0, 6.0, 7.0, 9.0),
+                              (session_id, 40.0, 6.0, 7.0, 9.0),
+                              (session_id, 50.0, 6.0, 7.0, 9.0),
+                              (session_id, 70.0, 8.0, 1.0, 9.0),
+                              (session_id, 80.0, 8.0, 1.0, 9.0)], records)
+
+    def test_record_session(self):
+        Meta = namedtuple('Meta', ['units', 'min', 'max', 'sampleRate'])
+        metas = {'Interval': Meta('ms', 0, 0, 1),
+                 'RPM': Meta('', 0, 10000, 10),
+                 'Speed': Meta('MPH', 0, 200, 10)}
+
+        session_id = self.ds.init_session('recorded', metas)
+        for index in range(10):
+            sample = {'Interval': index * 100, 'RPM': 1000 + index}
+            if index >= 5:
+                sample['Speed'] = index
+            self.ds.insert_sample_nocommit(sample, session_id)
+        self.ds.commit()
+        self.ds.finalize_session(session_id)
+
+        dataset = self.ds.query(sessions=[session_id],
+                                channels=['Interval', 'RPM', 'Speed'])
+        records = dataset.fetch_records()
+        self.ds.delete_session(session_id)
+
+        self.assertEqual(10, len(records))
+        self.assertEqual((session_id, 0, 1000, None), records[0])
+        self.assertEqual((session_id, 500, 1005, 5), records[5])
+        self.assertEqual((session_id, 900, 1009, 9), records[9])
+
+    def test_record_session_laps(self):
+        Meta = namedtuple('Meta', ['units', 'min', 'max', 'sampleRate'])
+        metas = {'Interval': Meta('ms', 0, 0, 1),
+                 'CurrentLap': Meta('', 0, 0, 1),
+                 'LapCount': Meta('', 0, 0, 1),
+                 'LapTime': Meta('Min', 0, 0, 1)}
+
+        session_id = self.ds.init_session('recorded laps', metas)
+        lap_time = 0
+        for index in range(12):
+            lap = index / 4
+            if lap > 0 and index % 4 == 0:
+                lap_time = 1.5 + lap
+            sample = {'Interval': index * 100, 'CurrentLap': lap + 1, 'LapCount': lap, 'LapTime': lap_time}
+            self.ds.insert_sample_nocommit(sample, session_id)
+            if index == 5:
+                self.ds.commit()
+                # The first lap is indexed as soon as it completes
+                self.assertTrue(self.ds.session_has_laps(session_id))
+                self.assertListEqual([(1, 2.5)], [(l.lap, l.lap_time) for l in self.ds.get_laps(session_id).values()])
+        self.ds.commit()
+        self.ds.finalize_session(session_id)
+
+        laps = self.ds.get_laps(session_id)
+        sample_ranges = self.ds.get_lap_sample_ranges(session_id, 2)
+        records = self.ds.query(sessions=[session_id],
+                                channels=['Interval', 'CurrentLap'],
+                                sample_ranges=sample_ranges).fetch_records()
+        self.ds.delete_session(session_id)
+
+        self.assertListEqual([(1, 2.5), (2, 3.5), (3, None)], [(l.lap, l.lap_time) for l in laps.values()])
+        self.assertEqual(1, len(sample_ranges))
+        self.assertListEqual([(session_id, 400, 2), (session_id, 500, 2), (session_id, 600, 2), (session_id, 700, 2)],
+                             records)
+
+    def test_record_session_batches(self):
+        Meta = namedtuple('Meta', ['units', 'min', 'max', 'sampleRate'])
+        metas = {'Interval': Meta('ms', 0, 0, 1),
+                 'CurrentLap': Meta('', 0, 0, 1),
+                 'LapCount': Meta('', 0, 0, 1),
+                 'LapTime': Meta('Min', 0, 0, 1),
+                 'RPM': Meta('', 0, 10000, 1)}
+        channel_names = ['RPM', 'LapTime', 'LapCount', 'CurrentLap', 'Interval']
+
+        session_id = self.ds.init_session('recorded batches', metas)
+        samples = []
+        lap_time = 0
+        for index in range(12):
+            lap = index / 4
+            if lap > 0 and index % 4 == 0:
+                lap_time = 1.5 + lap
+            rpm = None if index == 3 else index * 1000
+            samples.append((rpm, lap_time, lap, lap + 1, index * 100))
+
+        self.ds.insert_samples_nocommit(channel_names, samples[:5], session_id)
+        self.ds.insert_samples_nocommit(channel_names, [], session_id)
+        self.ds.insert_samples_nocommit(channel_names, samples[5:], session_id)
+        self.ds.commit()
+        self.ds.finalize_session(session_id)
+
+        laps = self.ds.get_laps(session_id)
+        records = self.ds.query(sessions=[session_id],
+                                channels=['Interval', 'RPM'],
+                                sample_ranges=self.ds.get_lap_sample_ranges(session_id, 1)).fetch_records()
+        self.ds.delete_session(session_id)
+
+        self.assertListEqual([(1, 2.5), (2, 3.5), (3, None)], [(l.lap, l.lap_time) for l in laps.values()])
+        # a missing value is stored as a gap
+        self.assertListEqual([(session_id, 0, 0), (session_id, 100, 1000), (session_id, 200, 2000), (session_id, 300, None)],
+                             records)
+
+    def test_record_sessions_concurrently(self):
+        """
+        Ensures batches recorded for different sessions from different threads keep
+        their own samples; the batches are inserted one at a time
+        """
+        Meta = namedtuple('Meta', ['units', 'min', 'max', 'sampleRate'])
+        metas = {'Interval': Meta('ms', 0, 0, 1),
+                 'RPM': Meta('', 0, 10000, 1)}
+        channel_names = ['Interval', 'RPM']
+        session_ids = [self.ds.init_session('recorded {}'.format(index), metas) for index in range(2)]
+
+        def record(session_id):
+            for batch in range(50):
+                samples = [(index * 100, session_id) for index in range(batch * 5, batch * 5 + 5)]
+                self.ds.insert_samples_nocommit(channel_names, samples, session_id)
+
+        threads = [threading.Thread(target=record, args=(session_id,)) for session_id in session_ids]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.ds.commit()
+
+        for session_id in session_ids:
+            self.ds.finalize_session(session_id)
+            records = self.ds.query(sessions=[session_id], channels=channel_names).fetch_records()
+            self.ds.delete_session(session_id)
+            self.assertListEqual([(session_id, index * 100, session_id) for index in range(250)], records)
+
+    def test_lap_index(self):
+        """
+        Ensures the lap index selects the samples of each lap, and is rebuilt
+        for sessions stored without one
+        """
+        lap_db_path = os.path.join(fqp, 'rctest_laps.sql3')
+        if os.path.exists(lap_db_path):
+            os.remove(lap_db_path)
+
+        try:
+            ds = DataStore(columnar=self.columnar)
+            ds.open_db(lap_db_path)
+            session_id = ds.import_datalog(sonoma_path, 'sonoma')
+            laps = [(l.lap, l.lap_time) for l in ds.get_laps(session_id).values()]
+
+            for lap in [1, 3, 8]:
+                records = ds.query(sessions=[session_id],
+                                   channels=['CurrentLap'],
+                                   sample_ranges=ds.get_lap_sample_ranges(session_id, lap)).fetch_records()
+                lap_records = ds.query(sessions=[session_id],
+                                       channels=['CurrentLap'],
+                                       data_filter=Filter().eq('CurrentLap', lap)).fetch_records()
+                self.assertTrue(len(records) > 0)
+                self.assertListEqual(lap_records, records)
+
+            ds.connection.execute('DELETE FROM lap')
+            ds.connection.execute('UPDATE session SET laps_indexed = 0')
+            ds.connection.commit()
+            ds.close()
+
+            ds = DataStore(columnar=self.columnar)
+            ds.open_db(lap_db_path)
+            rebuilt_laps = [(l.lap, l.lap_time) for l in ds.get_laps(session_id).values()]
+            ds.close()
+        finally:
+            os.remove(lap_db_path)
+
+        self.assertListEqual([(1, 2.135), (2, 2.105), (3, 2.13), (4, 2.1067),
+                              (5, 2.1317), (6, 2.1767), (7, 2.1133), (8, None)], laps)
+        self.assertListEqual(laps, rebuilt_laps)
+
     def test_scrub_sql_value(self):
         ds = self.ds
         self.assertEqual(_scrub_sql_value('ABCD1234'), '"ABCD1234"')
@@ -436,3 +649,74 @@ class DataStoreTest(unittest.TestCase):
             _scrub_sql_value('!!@@##ABCD%%1234%%**'), '"!!@@##ABCD%%1234%%**"')
         self.assertEqual(_scrub_sql_value('ABCD_1234'), '"ABCD_1234"')
         self.assertEqual(_scrub_sql_value('ABCD 1234'), '"ABCD 1234"')
+
+
+class ColumnarDataStoreTest(DataStoreTest):
+    columnar = True
+
+    def test_pack_row_sessions(self):
+        """
+        Ensures sessions stored as rows are moved into columnar storage when
+        opened in columnar mode
+        """
+        row_db_path = os.path.join(fqp, 'rctest_rows.sql3')
+        if os.path.exists(row_db_path):
+            os.remove(row_db_path)
+
+        try:
+            ds = DataStore()
+            ds.open_db(row_db_path)
+            session_id = ds.import_datalog(import_export_path, 'import_export')
+            row_records = ds.query(sessions=[session_id], channels=['Interval', 'c1hz', 'c1000hz']).fetch_records()
+            ds.close()
+
+            ds = DataStore(columnar=True)
+            ds.open_db(row_db_path)
+            columnar_records = ds.query(sessions=[session_id], channels=['Interval', 'c1hz', 'c1000hz']).fetch_records()
+            ds.close()
+        finally:
+            os.remove(row_db_path)
+
+        self.assertEqual(298, len(columnar_records))
+        self.assertListEqual(row_records, columnar_records)
+
+
+class WalDataStoreTest(DataStoreTest):
+    wal = True
+
+    def test_record_while_exporting(self):
+        Meta = namedtuple('Meta', ['units', 'min', 'max', 'sampleRate'])
+        metas = {'Interval': Meta('ms', 0, 0, 1),
+                 'RPM': Meta('', 0, 10000, 10)}
+
+        export_session_id = self.ds.import_datalog(import_export_path, 'import_export')
+        session_id = self.ds.init_session('recorded', metas)
+        exported = []
+
+        def record():
+            with self.ds.writer():
+                for index in range(100):
+                    self.ds.insert_sample_nocommit({'Interval': index * 100, 'RPM': 1000 + index}, session_id)
+                    if index % 10 == 9:
+                        self.ds.commit()
+                self.ds.finalize_session(session_id)
+
+        def export():
+            with self.ds.reader():
+                # readers can't write
+                self.assertRaises(sqlite3.OperationalError, self.ds.create_session, 'not allowed')
+            exported.append(self.ds.export_session(export_session_id, tempfile.TemporaryFile()))
+
+        threads = [threading.Thread(target=record), threading.Thread(target=export)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        records = self.ds.query(sessions=[session_id], channels=['Interval', 'RPM']).fetch_records()
+        self.ds.delete_session(session_id)
+        self.ds.delete_session(export_session_id)
+
+        self.assertEqual(100, len(records))
+        self.assertEqual((session_id, 9900, 1099), records[-1])
+        self.assertListEqual([298], exported)
@@ -0,0 +1,144 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import os.path
+import sqlite3
+import threading
+import unittest
+from autosportlabs.racecapture.datastore.datastore import DataStore
+from autosportlabs.racecapture.datastore.queryexecutor import QueryExecutor, QueryFuture, \
+    QueryCancelledException, gather_futures
+
+fqp = os.path.dirname(os.path.realpath(__file__))
+db_path = os.path.join(fqp, 'rctest_query.sql3')
+log_path = os.path.join(fqp, 'rc_adj.log')
+
+
+class QueryExecutorTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(self):
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        self.ds = DataStore()
+        self.ds.open_db(db_path)
+        self.session_id = self.ds.import_datalog(log_path, 'rc_adj')
+
+    @classmethod
+    def tearDownClass(self):
+        self.ds.close()
+        os.remove(db_path)
+
+    def setUp(self):
+        self.executor = QueryExecutor(self.ds, workers=1)
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.executor.shutdown()
+
+    def _block_worker(self):
+        started = threading.Event()
+
+        def blocked():
+            started.set()
+            self.release.wait()
+
+        future = self.executor.submit(['blocked'], blocked)
+        started.wait()
+        return future
+
+    def test_query(self):
+        future = self.executor.submit(['sessions'], self.ds.get_sessions)
+        sessions = future.result(10)
+        self.assertEqual(self.session_id, sessions[0].session_id)
+
+        # worker connections are read-only
+        future = self.executor.submit(['write'], self.ds.create_session, 'not allowed')
+        self.assertRaises(sqlite3.OperationalError, future.result, 10)
+
+    def test_query_error(self):
+        future = self.executor.submit(['write'], self.ds.create_session, 'not allowed')
+        self.assertRaises(sqlite3.OperationalError, future.result, 10)
+        self.assertIsInstance(future.exception(), sqlite3.OperationalError)
+        self.assertIn('create_session', future.exception_traceback())
+
+        # the traceback is kept by the combined future
+        combined = gather_futures([future, QueryFuture()])
+        self.assertIs(future.exception(), combined.exception())
+        self.assertEqual(future.exception_traceback(), combined.exception_traceback())
+
+    def test_coalesce(self):
+        calls = []
+
+        def query():
+            calls.append(1)
+            return self.ds.get_channel_average('RPM', [self.session_id])
+
+        self._block_worker()
+        first = self.executor.submit(['rpm', 'other'], query)
+        second = self.executor.join('rpm')
+        self.assertIsNone(self.executor.join('speed'))
+        self.release.set()
+
+        self.assertEqual(first.result(10), second.result(10))
+        self.assertEqual(1, len(calls))
+
+        # nothing is querying the key once the query completes
+        self.assertIsNone(self.executor.join('rpm'))
+
+    def test_cancel(self):
+        calls = []
+        callbacks = []
+
+        self._block_worker()
+        first = self.executor.submit(['rpm'], lambda: calls.append(1))
+        second = self.executor.join('rpm')
+        first.add_done_callback(callbacks.append)
+
+        # the query still runs while someone is waiting for it
+        self.assertTrue(first.cancel())
+        self.assertFalse(first.cancel())
+        self.assertListEqual([first], callbacks)
+        self.assertTrue(second.cancel())
+        self.assertIsNone(self.executor.join('rpm'))
+
+        done = self.executor.submit(['done'], lambda: True)
+        self.release.set()
+        self.assertTrue(done.result(10))
+        self.assertEqual(0, len(calls))
+        self.assertRaises(QueryCancelledException, second.result, 10)
+
+    def test_gather_futures(self):
+        futures = [QueryFuture(), QueryFuture()]
+        combined = gather_futures(futures)
+        futures[1].set_result(2)
+        self.assertFalse(combined.done())
+        futures[0].set_result(1)
+        self.assertListEqual([1, 2], combined.result(0))
+
+        futures = [QueryFuture(), QueryFuture()]
+        combined = gather_futures(futures)
+        combined.cancel()
+        self.assertTrue(futures[0].cancelled())
+        self.assertTrue(futures[1].cancelled())
+
+        self.assertListEqual([], gather_futures([]).result(0))
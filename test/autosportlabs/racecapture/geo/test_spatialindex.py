@@ -0,0 +1,83 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+import random
+import unittest
+from autosportlabs.racecapture.geo.spatialindex import GridIndex, distance_meters
+
+class GridIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        rnd = random.Random(42)
+        self.points = {}
+        self.index = GridIndex()
+        for i in range(2000):
+            # clusters of points, as venues are, plus some anywhere in the world
+            if i % 4:
+                lat, lon = rnd.choice([(38.16, -122.45), (51.5, -1.2), (-33.9, 151.2), (64.0, 179.95)])
+                lat += rnd.gauss(0, 0.2)
+                lon += rnd.gauss(0, 0.2)
+            else:
+                lat, lon = rnd.uniform(-85, 85), rnd.uniform(-180, 180)
+            lon = (lon + 180.0) % 360.0 - 180.0
+            self.points[i] = (lat, lon)
+            self.index.insert(i, lat, lon)
+        self.queries = [(38.161, -122.454), (51.4, -1.0), (64.0, -179.99), (0.0, 0.0), (89.9, 10.0), (-33.9, 151.2)]
+
+    def _brute_force(self, latitude, longitude):
+        return sorted((distance_meters(latitude, longitude, lat, lon), key) for key, (lat, lon) in self.points.iteritems())
+
+    def test_distance(self):
+        # one degree of latitude
+        self.assertAlmostEqual(111195, distance_meters(0, 0, 1, 0), delta=1)
+        # across the antimeridian
+        self.assertAlmostEqual(distance_meters(0, 179.9, 0, 180.0) * 2, distance_meters(0, 179.9, 0, -179.9), delta=0.01)
+
+    def test_within_radius(self):
+        for lat, lon in self.queries:
+            for meters in [100, 2000, 25000, 500000]:
+                expected = [p for p in self._brute_force(lat, lon) if p[0] <= meters]
+                self.assertEqual(expected, self.index.within_radius(lat, lon, meters))
+
+    def test_nearest(self):
+        for lat, lon in self.queries:
+            for count in [1, 5, 50]:
+                expected = self._brute_force(lat, lon)[:count]
+                self.assertEqual(expected, self.index.nearest(lat, lon, count))
+        self.assertEqual(self._brute_force(38.161, -122.454)[:3], self.index.nearest(38.161, -122.454, 3, max_meters=50000))
+
+    def test_update(self):
+        index = GridIndex()
+        index.insert('a', 38.16, -122.45)
+        index.insert('b', 38.17, -122.45)
+        index.insert('a', 51.5, -1.2)
+        self.assertEqual(2, len(index))
+        self.assertEqual(['b'], [key for distance, key in index.within_radius(38.16, -122.45, 5000)])
+        index.remove('b')
+        self.assertEqual([], index.within_radius(38.16, -122.45, 5000))
+        self.assertEqual(['a'], [key for distance, key in index.nearest(38.16, -122.45)])
+        index.clear()
+        self.assertEqual([], index.nearest(38.16, -122.45))
+
+def main():
+    unittest.main()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import urlparse
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from threading import Thread, Lock
+from autosportlabs.racecapture.presets.presetmanager import PresetManager
+
+
+class PresetServer(ThreadingMixIn, HTTPServer):
+    """
+    Stands in for the mappings API, serving canned presets and their images
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), PresetRequestHandler)
+        self.mappings = {}
+        self.images = {}
+        self.requests = []
+        self.lock = Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def add_mapping(self, mapping_id, mapping_type='analog', updated='2017-01-01T00:00:00', image='image'):
+        self.mappings[mapping_id] = {'id': mapping_id, 'name': 'Preset {}'.format(mapping_id), 'created': '2016-01-01T00:00:00',
+                                     'updated': updated, 'mapping_type': mapping_type, 'mapping': {},
+                                     'image_url': '{}/images/{}.png'.format(self.url, mapping_id)}
+        self.images['/images/{}.png'.format(mapping_id)] = image
+
+
+class PresetRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, headers={}):
+        self.send_response(status)
+        for name, value in headers.iteritems():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse.urlsplit(self.path)
+        with server.lock:
+            server.requests.append(url.path)
+        if url.path.startswith('/images/'):
+            image = server.images[url.path]
+            etag = '"{}"'.format(hashlib.sha1(image).hexdigest())
+            if self.headers.get('If-None-Match') == etag:
+                self._send(304, '', {'ETag': etag})
+            else:
+                self._send(200, image, {'ETag': etag, 'Content-Type': 'image/png'})
+            return
+        mapping_ids = sorted(server.mappings.keys())
+        if url.path == '/api/v1/mappings':
+            query = urlparse.parse_qs(url.query)
+            start = int(query['start'][0])
+            per_page = int(query['per_page'][0])
+            page = [server.mappings[mapping_id] for mapping_id in mapping_ids[start:start + per_page]]
+            if 'expand' not in query:
+                page = [{'id': mapping['id'], 'updated': mapping['updated']} for mapping in page]
+            self._send(200, json.dumps({'total': len(mapping_ids), 'mappings': page}))
+            return
+        mapping_id = int(url.path.split('/')[-1])
+        self._send(200, json.dumps({'mapping': server.mappings[mapping_id]}))
+
+
+class PresetManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = PresetServer()
+        t = Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+        for i in range(12):
+            self.server.add_mapping(i, mapping_type='analog' if i % 3 else 'can')
+        self.user_dir = tempfile.mkdtemp()
+        self.preset_manager = self._create_preset_manager()
+
+    def tearDown(self):
+        self.preset_manager._json_client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.user_dir)
+
+    def _create_preset_manager(self):
+        preset_manager = PresetManager(user_dir=self.user_dir)
+        preset_manager.PRESET_URL = self.server.url + '/api/v1/mappings'
+        preset_manager.PRESET_PAGE_SIZE = 5
+        preset_manager._json_client.retry_delay = 0
+        return preset_manager
+
+    def _image_requests(self):
+        return sorted([path for path in self.server.requests if path.startswith('/images/')])
+
+    def test_download_all(self):
+        self.preset_manager.refresh()
+        self.assertEqual(range(12), sorted(self.preset_manager.presets.keys()))
+        self.assertEqual([0, 3, 6, 9], sorted([k for k, v in self.preset_manager.get_presets_by_type('can')]))
+        self.assertEqual(8, len(self.preset_manager.get_presets_by_type('analog')))
+        self.assertEqual([], self.preset_manager.get_presets_by_type('obd2'))
+        preset = self.preset_manager.get_preset_by_id(1)
+        with open(preset.local_image_path, 'rb') as image_file:
+            self.assertEqual('image', image_file.read())
+
+        # the presets were saved
+        preset_manager = self._create_preset_manager()
+        preset_manager.init(None, None, None)
+        self.assertEqual(range(12), sorted(preset_manager.presets.keys()))
+        self.assertEqual([0, 3, 6, 9], sorted([k for k, v in preset_manager.get_presets_by_type('can')]))
+
+    def test_refresh_images(self):
+        self.preset_manager.refresh()
+        del self.server.requests[:]
+        # a changed preset with the same image, a changed preset with a new image, and a preset that changed type
+        self.server.add_mapping(1, updated='2017-06-01T00:00:00')
+        self.server.add_mapping(2, updated='2017-06-01T00:00:00', image='new image')
+        self.server.add_mapping(3, mapping_type='analog', updated='2017-06-01T00:00:00')
+        self.preset_manager.refresh()
+
+        # each changed image is asked for, but only the one that changed is sent again
+        self.assertEqual(['/images/1.png', '/images/2.png', '/images/3.png'], self._image_requests())
+        with open(self.preset_manager.get_preset_by_id(2).local_image_path, 'rb') as image_file:
+            self.assertEqual('new image', image_file.read())
+        self.assertEqual([0, 6, 9], sorted([k for k, v in self.preset_manager.get_presets_by_type('can')]))
+        self.assertTrue(3 in dict(self.preset_manager.get_presets_by_type('analog')))
+
+    def test_damaged_image(self):
+        self.preset_manager.refresh()
+        preset = self.preset_manager.get_preset_by_id(1)
+        with open(preset.local_image_path, 'wb') as image_file:
+            image_file.write('image, cut short')
+        del self.server.requests[:]
+        self.server.add_mapping(1, updated='2017-06-01T00:00:00')
+        self.preset_manager.refresh()
+
+        # the damaged copy fails validation, so the image is downloaded again
+        self.assertEqual(['/images/1.png'], self._image_requests())
+        with open(preset.local_image_path, 'rb') as image_file:
+            self.assertEqual('image', image_file.read())
+
+    def test_load_presets_unchanged(self):
+        self.preset_manager.refresh()
+        self.preset_manager.init(None, None, None)
+        preset = self.preset_manager.get_preset_by_id(4)
+        self.preset_manager.init(None, None, None)
+        # files that haven't changed aren't read again
+        self.assertTrue(preset is self.preset_manager.get_preset_by_id(4))
+
+def main():
+    unittest.main()
+
+if __name__ == "__main__":
+    main()
@@ -17,8 +17,13 @@
 # See the GNU General Public License for more details. You should
 # have received a copy of the GNU General Public License along with
 # this code. If not, see <http://www.gnu.org/licenses/>.
+import json
+import os
+import shutil
+import tempfile
 import unittest
-from autosportlabs.racecapture.tracks.trackmanager import TrackMap
+from autosportlabs.racecapture.geo.geopoint import GeoPoint
+from autosportlabs.racecapture.tracks.trackmanager import TrackMap, TrackManager
 from autosportlabs.util.timeutil import time_to_epoch
 
 class TrackMapTest(unittest.TestCase):
@@ -33,6 +38,84 @@ class TrackMapTest(unittest.TestCase):
         self.assertTrue(len(tm.map_points) == 0)
         self.assertTrue(len(tm.sector_points) == 0)
 
+class TrackManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.user_dir = tempfile.mkdtemp()
+        self.track_manager = TrackManager(user_dir=self.user_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.user_dir)
+
+    def _add_track(self, name, latitude, longitude, created):
+        track = TrackMap.create_new()
+        track.name = name
+        track.created = created
+        track.map_points.append(GeoPoint.fromPoint(latitude, longitude))
+        self.track_manager.add_track(track)
+        return track
+
+    def test_find_nearby_tracks(self):
+        sonoma = self._add_track('Sonoma', 38.1613, -122.4545, '2015-01-01T00:00:00')
+        sonoma_new = self._add_track('Sonoma 2', 38.1620, -122.4550, '2016-01-01T00:00:00')
+        thunderhill = self._add_track('Thunderhill', 39.5390, -122.3310, '2015-01-01T00:00:00')
+        track_manager = self.track_manager
+
+        # most recent first
+        point = GeoPoint.fromPoint(38.1613, -122.4545)
+        self.assertEqual([sonoma_new, sonoma], track_manager.find_nearby_tracks(point))
+        self.assertEqual([sonoma_new, sonoma, thunderhill], track_manager.find_nearby_tracks(point, 200000))
+        self.assertEqual([(0.0, sonoma)], track_manager.find_nearest_tracks(point))
+        self.assertEqual(thunderhill, track_manager.find_nearest_tracks(point, 3)[2][1])
+
+        # moving a track moves it in the index
+        thunderhill.map_points[0] = GeoPoint.fromPoint(38.1600, -122.4540)
+        track_manager.add_track(thunderhill)
+        self.assertEqual(3, len(track_manager.find_nearby_tracks(point)))
+
+        # the index is rebuilt from the saved tracks
+        track_manager.load_tracks()
+        self.assertEqual(3, len(track_manager.find_nearby_tracks(point)))
+        self.assertEqual([], track_manager.find_nearby_tracks(GeoPoint.fromPoint(39.5390, -122.3310)))
+
+    def test_load_tracks_lazily(self):
+        track = self._add_track('Sonoma', 38.1613, -122.4545, '2015-01-01T00:00:00')
+        track.map_points.append(GeoPoint.fromPoint(38.1620, -122.4550))
+        track.sector_points.append(GeoPoint.fromPoint(38.1630, -122.4560))
+        self.track_manager.save_track(track)
+
+        track_manager = TrackManager(user_dir=self.user_dir)
+        track_manager.load_tracks()
+        loaded = track_manager.get_track_by_id(track.track_id)
+        self.assertEqual('Sonoma', loaded.name)
+        self.assertEqual('38.163,-122.456', str(loaded.sector_points[0]))
+        # the map points are only read once they're used
+        self.assertIsNotNone(loaded._map_points_loader)
+        self.assertEqual('38.1613,-122.4545', str(loaded.centerpoint))
+        self.assertEqual(['38.1613,-122.4545', '38.162,-122.455'], [str(p) for p in loaded.map_points])
+        self.assertIsNone(loaded._map_points_loader)
+        self.assertEqual(track.to_dict(), loaded.to_dict())
+
+    def test_import_track_files(self):
+        track = TrackMap.create_new()
+        track.name = 'Sonoma'
+        track.map_points.append(GeoPoint.fromPoint(38.1613, -122.4545))
+        tracks_dir = os.path.join(self.user_dir, 'venues')
+        with open(os.path.join(tracks_dir, track.track_id + '.json'), 'w') as track_file:
+            json.dump({'venue': track.to_dict()}, track_file)
+        with open(os.path.join(tracks_dir, 'broken.json'), 'w') as track_file:
+            track_file.write('{')
+
+        track_manager = TrackManager(user_dir=self.user_dir)
+        track_manager.load_tracks()
+        self.assertEqual([track.track_id], track_manager.track_ids)
+        self.assertEqual(track.to_dict(), track_manager.get_track_by_id(track.track_id).to_dict())
+
+        # the files are only imported once
+        os.remove(os.path.join(tracks_dir, track.track_id + '.json'))
+        track_manager.load_tracks()
+        self.assertEqual([track.track_id], track_manager.track_ids)
+
 def main():
     unittest.main()
 
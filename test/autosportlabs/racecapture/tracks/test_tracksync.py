@@ -0,0 +1,169 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import shutil
+import tempfile
+import unittest
+import urlparse
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from threading import Thread, Lock
+from autosportlabs.racecapture.tracks.trackmanager import TrackManager
+
+
+class VenueServer(ThreadingMixIn, HTTPServer):
+    """
+    Stands in for the venue API, serving canned venues
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), VenueRequestHandler)
+        self.venues = {}
+        self.requests = []
+        self.connections = set()
+        self.failing_ids = set()
+        self.lock = Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/api/v1/venues'.format(self.server_address[1])
+
+    def add_venue(self, venue_id, updated='2017-01-01T00:00:00'):
+        self.venues[venue_id] = {'id': venue_id, 'name': 'Venue ' + venue_id, 'created': '2016-01-01T00:00:00',
+                                 'updated': updated, 'track_map_array': [[38.16, -122.45], [38.17, -122.46]]}
+
+
+class VenueRequestHandler(BaseHTTPRequestHandler):
+    # keep connections open between requests
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, doc):
+        body = json.dumps(doc)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse.urlsplit(self.path)
+        with server.lock:
+            server.requests.append(self.path)
+            server.connections.add(self.client_address)
+        venue_ids = sorted(server.venues.keys())
+        if url.path == '/api/v1/venues':
+            query = urlparse.parse_qs(url.query)
+            start = int(query['start'][0])
+            per_page = int(query['per_page'][0])
+            page = [server.venues[venue_id] for venue_id in venue_ids[start:start + per_page]]
+            if 'expand' not in query:
+                page = [{'id': venue['id'], 'updated': venue['updated']} for venue in page]
+            self._send_json(200, {'total': len(venue_ids), 'venues': page})
+            return
+        venue_id = url.path.split('/')[-1]
+        if venue_id in server.failing_ids or venue_id not in server.venues:
+            self._send_json(500, {})
+            return
+        self._send_json(200, {'venue': server.venues[venue_id]})
+
+
+class TrackSyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = VenueServer()
+        t = Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+        for i in range(25):
+            self.server.add_venue('venue{:02d}'.format(i))
+        self.user_dir = tempfile.mkdtemp()
+        self.track_manager = self._create_track_manager()
+
+    def tearDown(self):
+        self.track_manager._json_client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.user_dir)
+
+    def _create_track_manager(self):
+        track_manager = TrackManager(user_dir=self.user_dir)
+        track_manager.RCP_VENUE_URL = self.server.url
+        track_manager.VENUE_PAGE_SIZE = 10
+        track_manager._json_client.retry_delay = 0
+        return track_manager
+
+    def _venue_requests(self):
+        return set([path.split('/')[-1] for path in self.server.requests if '?' not in path])
+
+    def test_download_all(self):
+        progress = []
+        self.track_manager.refresh(lambda **kwargs: progress.append(kwargs.get('count')))
+        self.assertEqual(sorted(self.server.venues.keys()), sorted(self.track_manager.track_ids))
+        # three pages, fetched over kept alive connections
+        self.assertEqual(3, len(self.server.requests))
+        self.assertTrue(len(self.server.connections) <= 3)
+        self.assertEqual(range(1, 26), [count for count in progress if count])
+
+        # the tracks were saved
+        track_manager = self._create_track_manager()
+        track_manager.load_tracks()
+        self.assertEqual(25, len(track_manager.track_ids))
+
+    def test_refresh_changed(self):
+        self.track_manager.refresh()
+        del self.server.requests[:]
+        self.server.add_venue('venue05', updated='2017-06-01T00:00:00')
+        self.server.add_venue('venue99')
+
+        self.track_manager.refresh()
+        # only the changed venues are downloaded
+        self.assertEqual(set(['venue05', 'venue99']), self._venue_requests())
+        self.assertEqual('2017-06-01T00:00:00', self.track_manager.get_track_by_id('venue05').updated)
+        self.assertIsNotNone(self.track_manager.get_track_by_id('venue99'))
+        self.assertTrue(len(self.server.connections) < len(self.server.requests))
+
+    def test_refresh_resumes(self):
+        self.track_manager.refresh()
+        for i in range(10):
+            self.server.add_venue('venue{:02d}'.format(i), updated='2017-06-01T00:00:00')
+        self.server.failing_ids.add('venue05')
+        self.assertRaises(Exception, self.track_manager.refresh)
+
+        # the venues downloaded before the sync failed are kept, and not downloaded again
+        track_manager = self._create_track_manager()
+        track_manager.load_tracks()
+        updated = set([track_id for track_id in track_manager.track_ids if track_manager.get_track_by_id(track_id).updated == '2017-06-01T00:00:00'])
+        self.assertTrue(len(updated) > 0)
+        self.server.failing_ids.clear()
+        del self.server.requests[:]
+        track_manager.refresh()
+        self.assertEqual(set(['venue{:02d}'.format(i) for i in range(10)]) - updated, self._venue_requests())
+
+def main():
+    unittest.main()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+import unittest
+from autosportlabs.util.lrucache import LRUCache
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_get_put(self):
+        cache = LRUCache(100)
+        self.assertIsNone(cache.get('a'))
+        self.assertTrue(cache.put('a', 1, 10))
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual('default', cache.get('b', 'default'))
+
+        # replacing an entry replaces its size
+        cache.put('a', 2, 20)
+        self.assertEqual(2, cache.get('a'))
+        self.assertEqual(20, cache.size_bytes)
+        self.assertEqual(1, len(cache))
+
+        stats = cache.stats
+        self.assertEqual(2, stats['hits'])
+        self.assertEqual(2, stats['misses'])
+        self.assertEqual(0, stats['evictions'])
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(100)
+        cache.put('a', 1, 40)
+        cache.put('b', 2, 40)
+        # using 'a' makes 'b' the least recently used
+        cache.get('a')
+        cache.put('c', 3, 40)
+
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(80, cache.size_bytes)
+        self.assertEqual(1, cache.evictions)
+
+        # a value larger than the budget is not cached, and evicts nothing
+        self.assertFalse(cache.put('d', 4, 101))
+        self.assertNotIn('d', cache)
+        self.assertEqual(2, len(cache))
+
+    def test_sizeof(self):
+        cache = LRUCache(10, sizeof=len)
+        cache.put('a', [1, 2, 3])
+        cache.put('b', [1, 2, 3, 4, 5, 6])
+        self.assertEqual(9, cache.size_bytes)
+        cache.put('c', [1, 2])
+        self.assertNotIn('a', cache)
+        self.assertEqual(8, cache.size_bytes)
+
+    def test_invalidate(self):
+        cache = LRUCache(100)
+        cache.put((1, 'RPM'), 1, 10)
+        cache.put((1, 'Speed'), 2, 10)
+        cache.put((2, 'RPM'), 3, 10)
+
+        self.assertEqual(2, cache.invalidate(lambda key: key[0] == 1))
+        self.assertEqual(1, len(cache))
+        self.assertEqual(10, cache.size_bytes)
+        self.assertEqual(3, cache.pop((2, 'RPM')))
+        self.assertEqual(0, cache.size_bytes)
+
+        cache.put((3, 'RPM'), 4, 10)
+        cache.clear()
+        self.assertEqual(0, len(cache))
+        self.assertEqual(0, cache.size_bytes)
+
+def main():
+    unittest.main()
+
+if __name__ == "__main__":
+    main()
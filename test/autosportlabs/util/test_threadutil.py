@@ -0,0 +1,49 @@
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+import unittest
+from threading import Lock
+from autosportlabs.util.threadutil import imap_unordered
+
+class ThreadUtilTest(unittest.TestCase):
+
+    def test_imap_unordered(self):
+        results = list(imap_unordered(lambda x: x * 2, range(20), 4))
+        self.assertEqual([(x, x * 2) for x in range(20)], sorted(results))
+        self.assertEqual([], list(imap_unordered(lambda x: x, [], 4)))
+
+    def test_imap_unordered_error(self):
+        called = []
+        lock = Lock()
+
+        def function(x):
+            with lock:
+                called.append(x)
+            if x == 3:
+                raise ValueError('failed')
+            return x
+
+        results = []
+        def consume():
+            for item, value in imap_unordered(function, range(100), 2):
+                results.append(value)
+        self.assertRaises(ValueError, consume)
+        # no further calls are started after the failure
+        self.assertTrue(len(called) < 100)
+        self.assertEqual(len(called) - 1, len(results))
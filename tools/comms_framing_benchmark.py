@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures reading sample messages through SerialConnection and SocketConnection,
+with a pty and a local socket standing in for the device.
+
+Usage, from the top of the source tree:
+    python tools/comms_framing_benchmark.py [channel count] [message count]
+"""
+
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import tty
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from autosportlabs.comms.socket.socketconnection import SocketConnection
+from sample_decode_benchmark import create_messages
+
+DEFAULT_CHANNEL_COUNT = 120
+DEFAULT_MESSAGE_COUNT = 3000
+
+
+def create_lines(channel_count, message_count):
+    messages = create_messages(channel_count, 50, message_count / 50 + 1)[:message_count]
+    return [json.dumps(message, separators=(',', ':')) + '\r\n' for message in messages]
+
+
+def send(write, lines):
+    for line in lines:
+        write(line)
+
+
+def measure(name, read_line, write, lines):
+    sender = threading.Thread(target=send, args=(write, lines))
+    sender.daemon = True
+    start = time.time()
+    cpu_start = time.clock()
+    sender.start()
+    for line in lines:
+        msg = read_line()
+        if msg != line[:-2]:
+            raise Exception('{}: unexpected line {}'.format(name, repr(msg)[:80]))
+    elapsed = time.time() - start
+    cpu = time.clock() - cpu_start
+    sender.join()
+    print('{}: {:.1f}us per line, {:.1f}us CPU per line ({} bytes per line)'.format(
+        name, elapsed / len(lines) * 1000000.0, cpu / len(lines) * 1000000.0, sum(len(line) for line in lines) / len(lines)))
+
+
+def benchmark_serial(lines):
+    try:
+        from autosportlabs.comms.serial.serialconnection import SerialConnection
+    except ImportError:
+        print('SerialConnection: pyserial is not installed')
+        return
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    connection = SerialConnection()
+    connection.open(os.ttyname(slave))
+
+    def write(line):
+        os.write(master, line)
+
+    try:
+        measure('SerialConnection', connection.read_line, write, lines)
+    finally:
+        connection.close()
+        os.close(master)
+        os.close(slave)
+
+
+def benchmark_socket(lines):
+    connection = SocketConnection()
+    connection.socket, device = socket.socketpair()
+    keep_reading = threading.Event()
+    keep_reading.set()
+    try:
+        measure('SocketConnection', lambda: connection.read_line(keep_reading), device.sendall, lines)
+    finally:
+        connection.close()
+        device.close()
+
+
+def main():
+    channel_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_CHANNEL_COUNT
+    message_count = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_MESSAGE_COUNT
+    lines = create_lines(channel_count, message_count)
+    benchmark_serial(lines)
+    benchmark_socket(lines)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures how long a sample message takes from the device to its ApiDispatcher
+listener, and the CPU used while the connection is idle, with a local TCP
+server standing in for RC wifi.
+
+Usage, from the top of the source tree:
+    python tools/comms_latency_benchmark.py [message count] [idle seconds]
+"""
+
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from autosportlabs.comms.commsfactory import socket_comm
+from autosportlabs.comms.socket.socketconnection import SocketConnection
+from autosportlabs.racecapture.api.rcpapi import RcpApi
+
+DEFAULT_MESSAGE_COUNT = 500
+DEFAULT_IDLE_SECONDS = 5
+RATE = 50
+
+
+def main():
+    message_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MESSAGE_COUNT
+    idle_seconds = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_IDLE_SECONDS
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('127.0.0.1', SocketConnection.PORT))
+    server.listen(1)
+
+    received = []
+    received_all = threading.Event()
+
+    def on_sample(msg_json, source):
+        received.append(time.time())
+        if len(received) == message_count:
+            received_all.set()
+
+    comms = socket_comm('127.0.0.1')
+    rc_api = RcpApi(settings=None)
+    rc_api.init_api(comms)
+    rc_api.addListener('s', on_sample)
+    comms.open()
+    device, address = server.accept()
+    # wait for the connection to settle before measuring
+    time.sleep(1)
+
+    cpu_start = time.clock()
+    time.sleep(idle_seconds)
+    idle_cpu = time.clock() - cpu_start
+
+    sent = []
+    for i in range(message_count):
+        sent.append(time.time())
+        device.sendall('{"s":{"t":%d,"d":[1.5,2.5,3.5,7]}}\r\n' % i)
+        time.sleep(1.0 / RATE)
+    received_all.wait(10)
+
+    latencies = sorted([(r - s) * 1000000.0 for s, r in zip(sent, received)])
+    print('{}: {} of {} samples, latency median {:.0f}us p99 {:.0f}us; idle CPU {:.2f}% of one core'.format(
+        type(comms).__name__, len(latencies), message_count,
+        latencies[len(latencies) / 2], latencies[int(len(latencies) * 0.99)],
+        idle_cpu / idle_seconds * 100.0))
+
+    comms.close()
+    device.close()
+    server.close()
+    os._exit(0)
+
+if __name__ == "__main__":
+    main()
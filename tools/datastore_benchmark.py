@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures how recording into the DataStore holds up while a session is being
+exported, with and without WAL mode.
+
+Usage, from the top of the source tree:
+    python tools/datastore_benchmark.py [datalog to export] [seconds to record]
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from autosportlabs.racecapture.datastore import DataStore
+
+DEFAULT_LOG = 'test/autosportlabs/racecapture/datastore/sonoma.log'
+DEFAULT_RECORD_SECONDS = 10
+
+# The SessionRecorder's largest batch
+UNCOMMITTED_INSERT_LIMIT = 37
+
+Meta = namedtuple('Meta', ['units', 'min', 'max', 'sampleRate'])
+CHANNEL_METAS = dict([('Interval', Meta('ms', 0, 0, 1)), ('Utc', Meta('ms', 0, 0, 1))] +
+                     [('Channel{}'.format(i), Meta('', 0, 100, 50)) for i in range(30)])
+
+
+def benchmark(log_path, record_seconds, wal, columnar):
+    db_path = os.path.join(tempfile.mkdtemp(), 'benchmark.sql3')
+    datastore = DataStore(columnar=columnar, wal=wal)
+    datastore.open_db(db_path)
+    export_session_id = datastore.import_datalog(log_path, 'export')
+    session_id = datastore.init_session('recorded', CHANNEL_METAS)
+
+    recording = [True]
+    commit_times = []
+    export_times = []
+
+    def record():
+        index = 0
+        channel_names = CHANNEL_METAS.keys()
+        with datastore.writer():
+            while recording[0]:
+                samples = [tuple([index + offset] * len(channel_names)) for offset in range(UNCOMMITTED_INSERT_LIMIT)]
+                index += UNCOMMITTED_INSERT_LIMIT
+                start = time.time()
+                datastore.insert_samples_nocommit(channel_names, samples, session_id)
+                datastore.commit()
+                commit_times.append(time.time() - start)
+
+    def export():
+        while recording[0]:
+            start = time.time()
+            with open(os.devnull, 'w') as export_file:
+                datastore.export_session(export_session_id, export_file)
+            export_times.append(time.time() - start)
+
+    threads = [threading.Thread(target=record), threading.Thread(target=export)]
+    for t in threads:
+        t.start()
+    time.sleep(record_seconds)
+    recording[0] = False
+    for t in threads:
+        t.join()
+
+    datastore.close()
+    os.remove(db_path)
+
+    commit_times.sort()
+    samples = len(commit_times) * UNCOMMITTED_INSERT_LIMIT
+    print('wal={} columnar={}: {} samples/s recorded, batch ms avg {:.2f} p99 {:.2f} max {:.2f}, {} exports avg {:.2f}s'.format(
+        wal, columnar, samples / record_seconds,
+        sum(commit_times) / len(commit_times) * 1000.0 if commit_times else 0,
+        commit_times[int(len(commit_times) * 0.99)] * 1000.0 if commit_times else 0,
+        commit_times[-1] * 1000.0 if commit_times else 0,
+        len(export_times), sum(export_times) / len(export_times) if export_times else 0))
+
+
+def main():
+    log_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_LOG
+    record_seconds = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_RECORD_SECONDS
+    for columnar in [False, True]:
+        for wal in [False, True]:
+            benchmark(log_path, record_seconds, wal, columnar)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures decoding the 's' messages received by RcpApi.msg_rx_worker, through
+the JSON decoder and through the sample message fast path.
+
+Usage, from the top of the source tree:
+    python tools/msg_rx_benchmark.py [channel count] [seconds of samples]
+"""
+
+import json
+import os
+import sys
+import time
+from kivy.logger import Logger
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from autosportlabs.racecapture.api.rcpapi import RcpApi
+from autosportlabs.racecapture.data.sampledata import Sample
+from sample_decode_benchmark import create_messages
+
+DEFAULT_CHANNEL_COUNT = 120
+DEFAULT_SECONDS = 60
+RATE = 50
+
+
+def json_decode(rcp_api, msg):
+    # as msg_rx_worker decoded every message before the fast path
+    msg = unicode(msg, errors='ignore')
+    msg_json = json.loads(msg, strict=False)
+    Logger.trace('RCPAPI: Rx: ' + str(msg))
+    return msg_json
+
+
+def benchmark(name, decode, lines):
+    rcp_api = RcpApi(settings=None)
+    sample = Sample()
+    start = time.time()
+    for line in lines:
+        sample.fromJson(decode(rcp_api, line))
+    elapsed = time.time() - start
+    per_sample_us = elapsed / len(lines) * 1000000.0
+    print('{}: {:.1f}us per sample, {:.2f}% of one core at {}Hz'.format(name, per_sample_us, per_sample_us * RATE / 10000.0, RATE))
+
+
+def main():
+    channel_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_CHANNEL_COUNT
+    seconds = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_SECONDS
+    # as the device sends them
+    lines = [json.dumps(message, separators=(',', ':')) + '\r\n' for message in create_messages(channel_count, RATE, seconds)]
+    benchmark('JSON decoder', json_decode, lines)
+    benchmark('Sample fast path', RcpApi._decode_message, lines)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures syncing presets and their images from a local stand-in for the mappings
+API that adds a fixed delay to each request, the way a distant server would.
+
+Usage, from the top of the source tree:
+    python tools/preset_sync_benchmark.py [preset count] [request delay in ms]
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import urlparse
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from threading import Thread
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from autosportlabs.racecapture.presets.presetmanager import PresetManager
+
+DEFAULT_PRESET_COUNT = 200
+DEFAULT_REQUEST_DELAY_MS = 20
+IMAGE_SIZE = 20000
+
+
+class PresetServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, preset_count, delay):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), PresetRequestHandler)
+        self.delay = delay
+        self.request_count = 0
+        self.url = 'http://127.0.0.1:{}'.format(self.server_address[1])
+        self.mappings = [{'id': i, 'name': 'Preset {}'.format(i), 'updated': '2017-01-01T00:00:00',
+                          'mapping_type': 'can', 'mapping': {'chans': [{'id': c} for c in range(20)]},
+                          'image_url': '{}/images/{}.png'.format(self.url, i)} for i in range(preset_count)]
+
+
+class PresetRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # only the delay above should slow the replies
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header('ETag', '"image"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        server.request_count += 1
+        time.sleep(server.delay)
+        url = urlparse.urlsplit(self.path)
+        if url.path.startswith('/images/'):
+            if self.headers.get('If-None-Match') == '"image"':
+                self._send(304, '')
+            else:
+                self._send(200, 'x' * IMAGE_SIZE)
+        elif url.path == '/api/v1/mappings':
+            query = urlparse.parse_qs(url.query)
+            start = int(query['start'][0])
+            per_page = int(query['per_page'][0])
+            self._send(200, json.dumps({'total': len(server.mappings), 'mappings': server.mappings[start:start + per_page]}))
+        else:
+            mapping_id = int(url.path.split('/')[-1])
+            self._send(200, json.dumps({'mapping': server.mappings[mapping_id]}))
+
+
+def sync(server, workers, changed=False):
+    user_dir = tempfile.mkdtemp()
+    try:
+        preset_manager = PresetManager(user_dir=user_dir)
+        preset_manager.PRESET_URL = server.url + '/api/v1/mappings'
+        preset_manager.MAX_DOWNLOAD_WORKERS = workers
+        preset_manager.refresh()
+        if changed:
+            # every preset changes, but none of the images
+            for mapping in server.mappings:
+                mapping['updated'] = '2017-06-01T00:00:00'
+        server.request_count = 0
+        start = time.time()
+        if changed:
+            preset_manager.refresh()
+        else:
+            preset_manager._clear_presets()
+            os.remove(os.path.join(preset_manager.presets_user_dir, PresetManager.IMAGE_CACHE_FILE))
+            preset_manager.refresh()
+        elapsed = time.time() - start
+        preset_manager._json_client.close()
+        for mapping in server.mappings:
+            mapping['updated'] = '2017-01-01T00:00:00'
+        return elapsed, server.request_count
+    finally:
+        shutil.rmtree(user_dir)
+
+
+def main():
+    preset_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PRESET_COUNT
+    delay = (float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_REQUEST_DELAY_MS) / 1000.0
+    server = PresetServer(preset_count, delay)
+    t = Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    try:
+        for workers in (1, PresetManager.MAX_DOWNLOAD_WORKERS):
+            elapsed, requests = sync(server, workers)
+            print('{} worker(s), full download: {} presets in {:.2f}s, {} requests'.format(workers, preset_count, elapsed, requests))
+            elapsed, requests = sync(server, workers, changed=True)
+            print('{} worker(s), every preset changed, images cached: {:.2f}s, {} requests'.format(workers, elapsed, requests))
+    finally:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
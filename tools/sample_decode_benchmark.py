@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures decoding 's' messages into the DataBus, as the comms thread does
+for every sample streamed from the device.
+
+Usage, from the top of the source tree:
+    python tools/sample_decode_benchmark.py [channel count] [seconds of samples]
+"""
+
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from autosportlabs.racecapture.data.sampledata import Sample
+from autosportlabs.racecapture.databus.databus import DataBus
+
+DEFAULT_CHANNEL_COUNT = 120
+DEFAULT_SECONDS = 60
+# Channel sample rates, as a typical configuration mixes them
+CHANNEL_RATES = [1, 10, 25, 50, 100]
+
+
+def create_messages(channel_count, rate, seconds):
+    """
+    Creates the 's' messages a device streams at a rate, for channels logged at a mix of rates
+    """
+    channel_rates = [min(rate, CHANNEL_RATES[i % len(CHANNEL_RATES)]) for i in range(channel_count)]
+    metas = [{'nm': 'Channel{}'.format(i), 'ut': '', 'sr': channel_rates[i]} for i in range(channel_count)]
+    bitmask_count = (channel_count - 1) / 32 + 1
+
+    messages = []
+    for tick in range(rate * seconds):
+        values = []
+        bitmasks = [0] * bitmask_count
+        for i, channel_rate in enumerate(channel_rates):
+            if tick % (rate / channel_rate) == 0:
+                values.append(round(tick * 0.01 + i, 2))
+                bitmasks[i / 32] |= 1 << (i % 32)
+        message = {'s': {'t': tick, 'd': values + bitmasks}}
+        if tick == 0:
+            message['s']['meta'] = metas
+        messages.append(json.loads(json.dumps(message)))
+    return messages
+
+
+def benchmark(channel_count, rate, seconds):
+    messages = create_messages(channel_count, rate, seconds)
+    sample = Sample()
+    databus = DataBus()
+
+    start = time.time()
+    for message in messages:
+        sample.fromJson(message)
+        if sample.updated_meta:
+            databus.update_channel_meta(sample.metas)
+        databus.update_samples(sample)
+    elapsed = time.time() - start
+
+    per_sample_us = elapsed / len(messages) * 1000000.0
+    print('{} channels at {}Hz: {:.1f}us per sample, {:.2f}% of one core'.format(
+        channel_count, rate, per_sample_us, per_sample_us * rate / 10000.0))
+
+
+def main():
+    channel_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_CHANNEL_COUNT
+    seconds = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_SECONDS
+    for rate in [50, 100]:
+        benchmark(channel_count, rate, seconds)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures finding nearby tracks among a large synthetic set of venues, with the
+spatial index and with the linear scan it replaced.
+
+Usage, from the top of the source tree:
+    python tools/track_search_benchmark.py [venue count] [query count]
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from autosportlabs.racecapture.geo.geopoint import GeoPoint
+from autosportlabs.racecapture.tracks.trackmanager import TrackMap, TrackManager
+
+DEFAULT_VENUE_COUNT = 50000
+DEFAULT_QUERY_COUNT = 2000
+
+
+def create_tracks(track_manager, venue_count, query_count):
+    rnd = random.Random(1)
+    # venues cluster where people race
+    centers = [(rnd.uniform(-45, 60), rnd.uniform(-180, 180)) for i in range(200)]
+    for i in range(venue_count):
+        lat, lon = rnd.choice(centers)
+        track = TrackMap()
+        track.track_id = str(i)
+        track.name = 'Venue {}'.format(i)
+        track.created = '2017-01-01T00:00:00'
+        track.map_points.append(GeoPoint.fromPoint(lat + rnd.gauss(0, 2), lon + rnd.gauss(0, 2)))
+        track_manager._set_track(track)
+    return [GeoPoint.fromPoint(lat + rnd.gauss(0, 2), lon + rnd.gauss(0, 2)) for lat, lon in
+            [rnd.choice(centers) for i in range(query_count)]]
+
+
+def linear_scan(track_manager, point):
+    radius = point.metersToDegrees(TrackManager.TRACK_DEFAULT_SEARCH_RADIUS_METERS,
+                                   TrackManager.TRACK_DEFAULT_SEARCH_BEARING_DEGREES)
+    return [track for track in track_manager.tracks.itervalues()
+            if track.centerpoint and track.centerpoint.withinCircle(point, radius)]
+
+
+def measure(name, search, points):
+    start = time.time()
+    found = 0
+    for point in points:
+        found += len(search(point))
+    elapsed = time.time() - start
+    print('{}: {:.1f}us per query, {:.2f} tracks found per query'.format(
+        name, elapsed / len(points) * 1000000.0, float(found) / len(points)))
+
+
+def main():
+    venue_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_VENUE_COUNT
+    query_count = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_QUERY_COUNT
+    user_dir = tempfile.mkdtemp()
+    try:
+        track_manager = TrackManager(user_dir=user_dir)
+        start = time.time()
+        points = create_tracks(track_manager, venue_count, query_count)
+        print('{} venues loaded and indexed in {:.2f}s'.format(venue_count, time.time() - start))
+
+        measure('linear scan', lambda point: linear_scan(track_manager, point), points[:max(1, query_count / 20)])
+        measure('find_nearby_tracks', track_manager.find_nearby_tracks, points)
+        measure('find_nearest_tracks (1)', track_manager.find_nearest_tracks, points)
+        measure('find_nearest_tracks (10)', lambda point: track_manager.find_nearest_tracks(point, 10), points)
+    finally:
+        shutil.rmtree(user_dir)
+
+if __name__ == "__main__":
+    main()
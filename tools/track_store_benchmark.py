@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+#
+# Race Capture App
+#
+# Copyright (C) 2014-2017 Autosport Labs
+#
+# This file is part of the Race Capture App
+#
+# This is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details. You should
+# have received a copy of the GNU General Public License along with
+# this code. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures loading the tracks at startup, from a JSON file per track as earlier
+versions kept them, and from the track store.
+
+Usage, from the top of the source tree:
+    python tools/track_store_benchmark.py [track count] [map points per track]
+"""
+
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from autosportlabs.racecapture.geo.geopoint import GeoPoint
+from autosportlabs.racecapture.tracks.trackmanager import TrackMap, TrackManager
+
+DEFAULT_TRACK_COUNT = 2000
+DEFAULT_MAP_POINT_COUNT = 500
+
+
+def write_track_files(tracks_dir, track_count, map_point_count):
+    rnd = random.Random(1)
+    for i in range(track_count):
+        track = TrackMap.create_new()
+        track.name = 'Venue {}'.format(i)
+        lat, lon = rnd.uniform(-45, 60), rnd.uniform(-180, 180)
+        for p in range(map_point_count):
+            track.map_points.append(GeoPoint.fromPoint(lat + p * 0.00001, lon + rnd.uniform(0, 0.001)))
+        track.start_finish_point = track.map_points[0]
+        track_json_string = json.dumps(track.to_dict(), sort_keys=True, indent=2, separators=(',', ': '))
+        with open(os.path.join(tracks_dir, track.track_id + '.json'), 'w') as text_file:
+            text_file.write(track_json_string)
+
+
+def load_track_files(tracks_dir):
+    tracks = {}
+    for track_path in os.listdir(tracks_dir):
+        with open(os.path.join(tracks_dir, track_path)) as json_data:
+            track = TrackMap()
+            track.from_dict(json.load(json_data))
+            tracks[track.track_id] = track
+    return tracks
+
+
+def main():
+    track_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_TRACK_COUNT
+    map_point_count = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_MAP_POINT_COUNT
+    user_dir = tempfile.mkdtemp()
+    try:
+        track_manager = TrackManager(user_dir=user_dir)
+        write_track_files(track_manager.tracks_user_dir, track_count, map_point_count)
+
+        start = time.time()
+        tracks = load_track_files(track_manager.tracks_user_dir)
+        print('track files: {} tracks loaded in {:.3f}s'.format(len(tracks), time.time() - start))
+
+        start = time.time()
+        track_manager.load_tracks()
+        print('first start, importing the track files: {:.3f}s'.format(time.time() - start))
+
+        track_manager = TrackManager(user_dir=user_dir)
+        start = time.time()
+        track_manager.load_tracks()
+        print('track store: {} tracks loaded in {:.3f}s'.format(len(track_manager.tracks), time.time() - start))
+
+        track_ids = track_manager.track_ids[:100]
+        start = time.time()
+        for track_id in track_ids:
+            track_manager.get_track_by_id(track_id).map_points
+        print('track store: map points read in {:.0f}us per track'.format((time.time() - start) / len(track_ids) * 1000000.0))
+    finally:
+        shutil.rmtree(user_dir)
+
+if __name__ == "__main__":
+    main()